@@ -1,2 +1,39 @@
-from .canopy import *
-from .config import Config
\ No newline at end of file
+from importlib import import_module as _import_module
+from importlib.util import find_spec as _find_spec
+from .config import Config
+
+# Only Config is imported eagerly. The processing functions of canopy.canopy
+# need arcpy, which takes seconds to import, so they are loaded on first
+# access, e.g., canopy.clip_final_tiles(config) or from canopy import *.
+# Submodules such as canopy.objective or canopy.morphology load without
+# arcpy.
+
+# public functions and classes of canopy.canopy
+__all__ = [
+    'Config',
+    'assign_phyregs_to_naipqq', 'plan_work', 'reproject_naip_tiles',
+    'prefilter_naip_tiles', 'naip_tile_path', 'naip_tile_cache',
+    'result_cache', 'array_cache', 'benchmark_codecs',
+    'convert_afe_to_final_tiles', 'rasterize_afe_tiles', 'clip_final_tiles',
+    'mosaic_clipped_final_tiles', 'enqueue_stage', 'run_worker', 'warm_up',
+    'run_job', 'convert_afe_to_canopy_tif', 'correct_inverted_canopy_tif',
+    'detect_inverted_regions', 'estimate_canopy_cover', 'zonal_statistics',
+    'fill_canopy_gaps', 'clean_canopy_tif', 'convert_canopy_tif_to_shp',
+    'generate_gtpoints', 'update_gtpoints', 'add_naip_tiles_for_gt',
+    'assess_gt_accuracy', 'extract_gt_chips', 'objective_function',
+    'Check_gaps', 'check_snap',
+]
+
+def __getattr__(name):
+    if name in __all__:
+        value = getattr(_import_module('.canopy', __name__), name)
+        globals()[name] = value
+        return value
+    if not name.startswith('_') and \
+            _find_spec('%s.%s' % (__name__, name)) is not None:
+        return _import_module('%s.%s' % (__name__, name))
+    raise AttributeError("module '%s' has no attribute '%s'" %
+                         (__name__, name))
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,262 @@
+import json
+import argparse
+from .config import Config
+
+'''
+Command line interface of CanoPy. For example,
+    python -m canopy plan canopy.cfg --regions 8 7 2
+    python -m canopy prefilter canopy.cfg --regions 8 7 2
+    python -m canopy enqueue canopy.cfg clip --regions 8 7 2
+    python -m canopy worker canopy.cfg --stages clip
+    python -m canopy status canopy.cfg
+    python -m canopy benchmark canopy.cfg --regions 8 --tiles 5
+    python -m canopy cache stats canopy.cfg
+    python -m canopy cover canopy.cfg --regions 8 7 --error 0.01
+    python -m canopy zonal canopy.cfg --regions 8 7 \
+        --layers counties.shp:NAME tracts.shp:GEOID --csv zonal.csv
+    python -m canopy fill canopy.cfg --regions 8 7 --csv gaps.csv
+    python -m canopy serve canopy.cfg --workers 4
+    python -m canopy submit canopy.cfg --stage clip --region 8 \
+        --tile m_3408301_ne_17_1
+'''
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='canopy')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    plan_parser = subparsers.add_parser('plan',
+            help='print the work list of each stage without processing')
+    plan_parser.add_argument('config')
+    plan_parser.add_argument('--regions', type=int, nargs='+', required=True)
+
+    prefilter_parser = subparsers.add_parser('prefilter',
+            help='write noncanopy clipped final tiles for NAIP tiles '
+                 'without possible canopy')
+    prefilter_parser.add_argument('config')
+    prefilter_parser.add_argument('--regions', type=int, nargs='+',
+                                  required=True)
+
+    enqueue_parser = subparsers.add_parser('enqueue',
+            help='add the work units of a stage to the job queue')
+    enqueue_parser.add_argument('config')
+    enqueue_parser.add_argument('stage',
+            choices=['reproject', 'convert', 'clip', 'mosaic'])
+    enqueue_parser.add_argument('--regions', type=int, nargs='+',
+                                required=True)
+    enqueue_parser.add_argument('--queue')
+
+    worker_parser = subparsers.add_parser('worker',
+            help='process jobs from the job queue')
+    worker_parser.add_argument('config')
+    worker_parser.add_argument('--stages', nargs='+')
+    worker_parser.add_argument('--queue')
+    worker_parser.add_argument('--no-wait', action='store_true',
+            help='exit when no job can be claimed right now')
+
+    status_parser = subparsers.add_parser('status',
+            help='print the number of pending, running, done, and failed '
+                 'jobs')
+    status_parser.add_argument('config')
+    status_parser.add_argument('--queue')
+
+    benchmark_parser = subparsers.add_parser('benchmark',
+            help='compare the write time, read time, and size of raster '
+                 'outputs for each compression codec on sample tiles')
+    benchmark_parser.add_argument('config')
+    benchmark_parser.add_argument('--regions', type=int, nargs='+',
+                                  required=True)
+    benchmark_parser.add_argument('--tiles', type=int, default=5,
+            help='number of sample tiles of each kind')
+    benchmark_parser.add_argument('--codecs', nargs='+', type=str.upper)
+    benchmark_parser.add_argument('--seed', type=int)
+
+    cache_parser = subparsers.add_parser('cache',
+            help='report the NAIP tile, result, and array caches')
+    cache_parser.add_argument('action', choices=['stats'])
+    cache_parser.add_argument('config')
+
+    cover_parser = subparsers.add_parser('cover',
+            help='estimate canopy cover from random samples with '
+                 'confidence intervals')
+    cover_parser.add_argument('config')
+    cover_parser.add_argument('--regions', type=int, nargs='+',
+                              required=True)
+    cover_parser.add_argument('--zones',
+            help='polygon feature class of zones, e.g., counties')
+    cover_parser.add_argument('--zone-field')
+    cover_parser.add_argument('--error', type=float, default=0.01,
+            help='target half-width of the confidence intervals')
+    cover_parser.add_argument('--confidence', type=float, default=0.95)
+    cover_parser.add_argument('--seed', type=int)
+    cover_parser.add_argument('--csv')
+
+    zonal_parser = subparsers.add_parser('zonal',
+            help='count canopy cells per zone of polygon layers')
+    zonal_parser.add_argument('config')
+    zonal_parser.add_argument('--regions', type=int, nargs='+',
+                              required=True)
+    zonal_parser.add_argument('--layers', nargs='+', required=True,
+            metavar='PATH:FIELD',
+            help='polygon feature classes and their zone name fields')
+    zonal_parser.add_argument('--block-size', type=int, default=4096)
+    zonal_parser.add_argument('--csv')
+
+    fill_parser = subparsers.add_parser('fill',
+            help='fill nodata gaps inside regions of the canopy TIFF files')
+    fill_parser.add_argument('config')
+    fill_parser.add_argument('--regions', type=int, nargs='+',
+                             required=True)
+    fill_parser.add_argument('--max-distance', type=int, default=16,
+            help='maximum distance in cells from valid data to fill')
+    fill_parser.add_argument('--block-size', type=int, default=4096)
+    fill_parser.add_argument('--csv')
+
+    serve_parser = subparsers.add_parser('serve',
+            help='run the worker service with arcpy already imported')
+    serve_parser.add_argument('config')
+    serve_parser.add_argument('--workers', type=int)
+    serve_parser.add_argument('--address',
+            help='host:port or socket or pipe path (default '
+                 'service_address)')
+
+    submit_parser = subparsers.add_parser('submit',
+            help='run a stage or function in the worker service and print '
+                 'results as they finish')
+    submit_parser.add_argument('config')
+    submit_parser.add_argument('--address')
+    submit_group = submit_parser.add_mutually_exclusive_group(required=True)
+    submit_group.add_argument('--stage',
+            choices=['reproject', 'convert', 'clip', 'mosaic'])
+    submit_group.add_argument('--function',
+            help='public function of canopy that takes the configuration '
+                 'as its first argument')
+    submit_group.add_argument('--shutdown', action='store_true',
+            help='stop the worker service')
+    submit_parser.add_argument('--region', type=int, nargs='+',
+            help='physiographic region IDs of --stage or --function')
+    submit_parser.add_argument('--tile', nargs='+',
+            help='NAIP tiles of --stage to process even if up to date')
+    submit_parser.add_argument('--args', nargs='+', default=[],
+            metavar='JSON', help='arguments of --function as JSON values')
+
+    args = parser.parse_args(argv)
+    if args.command == 'submit' and args.stage and not args.region:
+        parser.error('--stage requires --region')
+    if args.command == 'submit' and args.tile and (not args.stage or
+                                                   len(args.region) != 1):
+        parser.error('--tile requires --stage and one --region')
+    if args.command == 'cover' and args.zones and not args.zone_field:
+        parser.error('--zones requires --zone-field')
+    if args.command == 'zonal':
+        zone_layers = [tuple(x.rsplit(':', 1)) for x in args.layers]
+        if any(len(x) != 2 for x in zone_layers):
+            parser.error('--layers requires PATH:FIELD')
+    config = Config(args.config)
+
+    if args.command == 'status':
+        from .jobqueue import JobQueue
+        queue_path = args.queue or '%s/canopy_queue' % config.results_path
+        print(JobQueue(queue_path).status())
+        return
+    if args.command == 'cache':
+        print_cache_stats(config)
+        return
+    if args.command == 'serve':
+        from .service import serve
+        serve(config.config, args.address or config.service_address,
+              args.workers or config.service_workers)
+        return
+    if args.command == 'submit':
+        submit_jobs(config, args)
+        return
+
+    # arcpy is imported only by the commands that need it
+    from . import canopy
+    if args.command == 'plan':
+        config.regions(args.regions)
+        print(canopy.plan_work(config).report())
+    elif args.command == 'prefilter':
+        canopy.prefilter_naip_tiles(config, args.regions)
+    elif args.command == 'enqueue':
+        config.regions(args.regions)
+        canopy.enqueue_stage(config, args.stage, args.queue)
+    elif args.command == 'worker':
+        canopy.run_worker(config, args.stages, args.queue, not args.no_wait)
+    elif args.command == 'cover':
+        canopy.estimate_canopy_cover(config, args.regions, args.zones,
+                                     args.zone_field, args.error,
+                                     args.confidence, seed=args.seed,
+                                     csv_path=args.csv)
+    elif args.command == 'zonal':
+        canopy.zonal_statistics(config, zone_layers, args.regions,
+                                args.block_size, args.csv)
+    elif args.command == 'fill':
+        canopy.fill_canopy_gaps(config, args.regions, args.max_distance,
+                                args.block_size, args.csv)
+    elif args.command == 'benchmark':
+        canopy.benchmark_codecs(config, args.tiles, args.codecs, args.regions,
+                                args.seed)
+
+def submit_jobs(config, args):
+    '''
+    Submits the jobs of the submit command to the worker service and prints
+    their results and timings as they finish.
+    '''
+    from .service import submit, shutdown
+    address = args.address or config.service_address
+    if args.shutdown:
+        shutdown(address)
+        return
+    if args.function:
+        jobs = [{'function': args.function,
+                 'args': [json.loads(x) for x in args.args]}]
+        if args.region:
+            jobs[0]['regions'] = args.region
+    elif args.tile:
+        jobs = [{'stage': args.stage, 'phyreg_id': args.region[0],
+                 'filename': x} for x in args.tile]
+    else:
+        jobs = [{'stage': args.stage, 'phyreg_id': x} for x in args.region]
+    for message in submit(jobs, address):
+        print('Job %d (%s): %.1f seconds on %s' %
+              (message['index'], ', '.join('%s=%s' % x for x in
+                                           message['job'].items()
+                                           if x[0] != 'args'),
+               message['seconds'], message['worker']))
+        if message['output']:
+            print(message['output'].rstrip())
+        if 'error' in message:
+            print(message['error'].rstrip())
+        else:
+            print('Result: %s' % (message['result'],))
+
+def print_cache_stats(config):
+    '''
+    Prints the statistics accumulated over all runs and the size of each
+    configured cache.
+    '''
+    from .cache import TileCache, ResultCache, ArrayCache
+    caches = (('NAIP tile cache', TileCache, config.naip_cache_path,
+               config.naip_cache_max_mb),
+              ('Result cache', ResultCache, config.result_cache_path,
+               config.result_cache_max_mb),
+              ('Array cache', ArrayCache, config.array_cache_path,
+               config.array_cache_max_mb))
+    for title, cls, path, max_mb in caches:
+        if path is None:
+            print('%s: not configured' % title)
+            continue
+        stats = cls(path, max_mb * 1024**2).totals()
+        print('%s: %s' % (title, path))
+        print('    %d entries, %.1f/%.1f MiB used' %
+              (stats['entries'], stats['cached_bytes'] / 1024**2,
+               stats['max_bytes'] / 1024**2))
+        print('    %d hits, %d misses (%.1f%% hit rate), %d evicted' %
+              (stats['hits'], stats['misses'], stats['hit_rate'] * 100,
+               stats['evictions']))
+        print('    %.1f MiB served from cache, %.1f MiB stored' %
+              (stats['hit_bytes'] / 1024**2, stats['miss_bytes'] / 1024**2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+import csv
+import math
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+'''
+Functions
+---------
+    confusion_matrices(regions, truth, predicted, num_regions, num_classes):
+        Computes the confusion matrix of each region in one pass.
+    accuracy_metrics(cm):
+        Computes overall, user's, and producer's accuracy and kappa from
+        confusion matrices.
+    bootstrap_metrics(regions, truth, predicted, num_regions, num_classes,
+                      num_resamples, seed, num_workers):
+        Computes bootstrap resamples of the accuracy metrics in a process
+        pool.
+    assess_accuracy(regions, truth, predicted, num_regions, num_classes,
+                    num_resamples, confidence, seed, num_workers):
+        Computes the accuracy metrics and their confidence intervals per
+        region and statewide.
+    write_accuracy_report(path, names, result):
+        Writes accuracy metrics to a CSV file.
+    inversion_confidence(agreement, cells):
+        Tests whether a map agrees with a reference less than by chance
+        using cluster samples.
+'''
+
+# metrics with one value per region and per region and class
+METRICS = ('overall', 'kappa')
+CLASS_METRICS = ('user', 'producer')
+
+def confusion_matrices(regions, truth, predicted, num_regions, num_classes):
+    '''
+    This function computes the confusion matrices of all regions with one
+    np.bincount() call.
+
+    Parameters
+    ----------
+        regions : array
+            region index of each point (0 to num_regions - 1)
+        truth : array
+            reference class of each point (0 to num_classes - 1)
+        predicted : array
+            mapped class of each point (0 to num_classes - 1)
+        num_regions, num_classes : int
+            numbers of regions and classes
+
+    Returns
+    -------
+        (num_regions, num_classes, num_classes) array
+            rows are reference classes and columns are mapped classes
+    '''
+    codes = ((np.asarray(regions, dtype=np.int64) * num_classes +
+              truth) * num_classes + predicted)
+    return np.bincount(codes, minlength=num_regions * num_classes**2).reshape(
+            num_regions, num_classes, num_classes)
+
+def accuracy_metrics(cm):
+    '''
+    This function computes accuracy metrics from confusion matrices with any
+    number of leading dimensions, e.g., (regions, classes, classes) or
+    (resamples, regions, classes, classes). Metrics that divide by zero are
+    NaN.
+
+    Returns
+    -------
+        dict
+            n : number of points
+            overall : overall accuracy
+            kappa : Cohen's kappa
+            user : user's accuracy of each class (correct / mapped)
+            producer : producer's accuracy of each class (correct /
+                       reference)
+    '''
+    cm = np.asarray(cm, dtype=float)
+    n = cm.sum(axis=(-2, -1))
+    diag = np.diagonal(cm, axis1=-2, axis2=-1)
+    reference = cm.sum(axis=-1)
+    mapped = cm.sum(axis=-2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        overall = diag.sum(axis=-1) / n
+        chance = (reference * mapped).sum(axis=-1) / n**2
+        kappa = (overall - chance) / (1 - chance)
+        user = diag / mapped
+        producer = diag / reference
+    return {'n': n, 'overall': overall, 'kappa': kappa, 'user': user,
+            'producer': producer}
+
+def __resample(args):
+    # Worker function for bootstrap_metrics(); it must be a module-level
+    # function so that the process pool can pickle it. Resamples points
+    # within each region and returns the metrics of the resampled
+    # confusion matrices of the regions and the state.
+    (regions, truth, predicted, num_regions, num_classes, num_resamples,
+     seed) = args
+    rng = np.random.default_rng(seed)
+    cm = np.zeros((num_resamples, num_regions, num_classes, num_classes),
+                  dtype=np.int64)
+    for r in range(num_regions):
+        idx = np.flatnonzero(regions == r)
+        if len(idx) == 0:
+            continue
+        # (resamples, points) indices drawn with replacement
+        sample = idx[rng.integers(0, len(idx), (num_resamples, len(idx)))]
+        codes = ((np.arange(num_resamples)[:, None] * num_classes +
+                  truth[sample]) * num_classes + predicted[sample])
+        cm[:, r] = np.bincount(codes.ravel(),
+                minlength=num_resamples * num_classes**2).reshape(
+                        num_resamples, num_classes, num_classes)
+    cm = np.concatenate((cm, cm.sum(axis=1, keepdims=True)), axis=1)
+    metrics = accuracy_metrics(cm)
+    del metrics['n']
+    return metrics
+
+def bootstrap_metrics(regions, truth, predicted, num_regions, num_classes,
+                      num_resamples=2000, seed=None, num_workers=None,
+                      chunk_size=250):
+    '''
+    This function resamples the points of each region with replacement and
+    computes the accuracy metrics of each resample for the regions and the
+    state. Chunks of resamples run in a process pool with independent
+    random streams, so the results are reproducible for a seed regardless
+    of the number of workers.
+
+    Returns
+    -------
+        dict
+            metric => (num_resamples, num_regions + 1, ...) array; the last
+            region is the state
+    '''
+    regions = np.asarray(regions, dtype=np.int64)
+    truth = np.asarray(truth, dtype=np.int64)
+    predicted = np.asarray(predicted, dtype=np.int64)
+    sizes = [min(chunk_size, num_resamples - i)
+             for i in range(0, num_resamples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    jobs = [(regions, truth, predicted, num_regions, num_classes, size,
+             child) for size, child in zip(sizes, seeds)]
+    if num_workers == 1 or len(jobs) == 1:
+        chunks = list(map(__resample, jobs))
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            chunks = list(executor.map(__resample, jobs))
+    return dict((k, np.concatenate([x[k] for x in chunks]))
+                for k in chunks[0])
+
+def assess_accuracy(regions, truth, predicted, num_regions, num_classes=2,
+                    num_resamples=2000, confidence=0.95, seed=None,
+                    num_workers=None):
+    '''
+    This function computes the confusion matrices and accuracy metrics per
+    region and statewide and their bootstrap percentile confidence
+    intervals. Points are resampled within regions, so the statewide
+    intervals reflect the number of points in each region.
+
+    Parameters
+    ----------
+        regions : array
+            region index of each point (0 to num_regions - 1)
+        truth : array
+            reference class of each point
+        predicted : array
+            mapped class of each point
+        num_regions : int
+            number of regions
+        num_classes : int
+            number of classes
+        num_resamples : int
+            number of bootstrap resamples; 0 to skip confidence intervals
+        confidence : float
+            confidence level of the intervals
+        seed : int
+            seed for reproducible intervals
+        num_workers : int
+            number of worker processes
+
+    Returns
+    -------
+        dict
+            cm : (num_regions + 1, num_classes, num_classes) confusion
+                 matrices where the last one is statewide
+            n, overall, kappa, user, producer : metrics as returned by
+                accuracy_metrics()
+            <metric>_ci : (num_regions + 1, ..., 2) lower and upper bounds
+    '''
+    cm = confusion_matrices(regions, truth, predicted, num_regions,
+                            num_classes)
+    cm = np.concatenate((cm, cm.sum(axis=0, keepdims=True)))
+    result = accuracy_metrics(cm)
+    result['cm'] = cm
+    if num_resamples > 0:
+        resamples = bootstrap_metrics(regions, truth, predicted, num_regions,
+                                      num_classes, num_resamples, seed,
+                                      num_workers)
+        q = [(1 - confidence) / 2 * 100, (1 + confidence) / 2 * 100]
+        for k, v in resamples.items():
+            with warnings.catch_warnings():
+                # regions without points have all-NaN resamples
+                warnings.simplefilter('ignore', RuntimeWarning)
+                ci = np.nanpercentile(v, q, axis=0)
+            result['%s_ci' % k] = np.moveaxis(ci, 0, -1)
+    return result
+
+def write_accuracy_report(path, names, result):
+    '''
+    This function writes the accuracy metrics of assess_accuracy() to a CSV
+    file with one row per region and a last row for the state.
+
+    Parameters
+    ----------
+        path : str
+            CSV file path
+        names : list
+            region names; 'Statewide' is appended
+        result : dict
+            output of assess_accuracy()
+    '''
+    names = list(names) + ['Statewide']
+    num_classes = result['cm'].shape[-1]
+    header = ['region', 'n']
+    for k in METRICS:
+        header += [k, '%s_lower' % k, '%s_upper' % k]
+    for k in CLASS_METRICS:
+        for c in range(num_classes):
+            header += ['%s_%d' % (k, c), '%s_%d_lower' % (k, c),
+                       '%s_%d_upper' % (k, c)]
+    header += ['cm_%d_%d' % (t, p) for t in range(num_classes)
+               for p in range(num_classes)]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for i, name in enumerate(names):
+            row = [name, int(result['n'][i])]
+            for k in METRICS:
+                row += [result[k][i]] + __bounds(result, k, i)
+            for k in CLASS_METRICS:
+                for c in range(num_classes):
+                    row += [result[k][i, c]] + __bounds(result, k, i, c)
+            row += result['cm'][i].ravel().tolist()
+            writer.writerow(row)
+
+def __bounds(result, k, *index):
+    ci = result.get('%s_ci' % k)
+    if ci is None:
+        return ['', '']
+    return ci[index].tolist()
+
+def inversion_confidence(agreement, cells):
+    '''
+    This function tests whether a binary map is inverted from cluster
+    samples, e.g., small windows of cells. A map that agrees with a reference
+    in less than half of the cells is more likely inverted than not. The
+    standard error of the mean agreement accounts for the correlation of
+    cells within a window by using the ratio estimator for cluster samples.
+
+    Parameters
+    ----------
+        agreement : array
+            fraction of the cells of each window that agree with the
+            reference
+        cells : array
+            number of valid cells in each window
+
+    Returns
+    -------
+        agreement, inverted, confidence
+            mean agreement weighted by cells, whether the map is likely
+            inverted, and the confidence of that decision (0.5 to 1)
+    '''
+    agreement = np.asarray(agreement, dtype=float)
+    cells = np.asarray(cells, dtype=float)
+    keep = cells > 0
+    agreement = agreement[keep]
+    cells = cells[keep]
+    m = len(cells)
+    if m == 0:
+        return math.nan, False, 0.5
+    mean = (agreement * cells).sum() / cells.sum()
+    if m == 1:
+        return mean, mean < 0.5, 0.5
+    se = math.sqrt((cells**2 * (agreement - mean)**2).sum() /
+                   (m * (m - 1))) / cells.mean()
+    if se == 0:
+        confidence = 0.5 if mean == 0.5 else 1.
+    else:
+        z = abs(mean - 0.5) / se
+        confidence = 0.5 * (1 + math.erf(z / math.sqrt(2)))
+    return mean, mean < 0.5, confidence
@@ -0,0 +1,29 @@
+'''
+Functions
+---------
+    raster_blocks(nrows, ncols, block_size):
+        Splits a raster into blocks for streaming.
+'''
+
+def raster_blocks(nrows, ncols, block_size):
+    '''
+    This function splits a raster into square blocks in row-major order so
+    that large rasters can be streamed through NumPy one block at a time.
+    Blocks at the right and bottom edges are smaller.
+
+    Parameters
+    ----------
+        nrows, ncols : int
+            raster dimensions
+        block_size : int
+            block width and height in cells
+
+    Yields
+    ------
+        row, col, height, width
+            upper left row and column of each block and its dimensions
+    '''
+    for row in range(0, nrows, block_size):
+        for col in range(0, ncols, block_size):
+            yield (row, col, min(block_size, nrows - row),
+                   min(block_size, ncols - col))
@@ -0,0 +1,444 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import numpy as np
+from .journal import atomic_output
+
+'''
+Classes
+-------
+    FileCache(cache_path, max_bytes, min_age):
+        Persistent file cache with least recently used eviction under a byte
+        budget.
+    TileCache(cache_path, max_bytes, min_age):
+        Persistent local cache of source tiles keyed by source path, size,
+        and modification time.
+    ResultCache(cache_path, max_bytes, min_age):
+        Persistent content-addressed cache of tile products keyed by input
+        contents, operation, and parameters.
+    ArrayCache(cache_path, max_bytes, min_age):
+        Persistent cache of decoded rasters as memory-mapped .npy files.
+'''
+
+
+class FileCache:
+    '''
+    Persistent file cache with least recently used eviction under a byte
+    budget. The cache folder itself is the index: each entry is one file and
+    its modification time is the time it was last used, so the cache
+    survives restarts and can be shared by several processes without an
+    index file that they would have to lock.
+
+    When the cached bytes exceed max_bytes, the least recently used entries
+    are removed. Entries used within the last min_age seconds are never
+    removed because another thread or process may be about to read them.
+
+    Attributes
+    ----------
+    cache_path : str
+        Cache folder.
+    max_bytes : int
+        Maximum number of bytes in the cache folder.
+    min_age : float
+        Seconds after its last use during which an entry is not evicted.
+    hits : int
+        Number of lookups served from the cache by this instance.
+    misses : int
+        Number of lookups not served from the cache by this instance.
+    '''
+    def __init__(self, cache_path, max_bytes, min_age=300):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.miss_bytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_path, exist_ok=True)
+        self._total_bytes = sum(x[2] for x in self._scan())
+
+    def _scan(self):
+        # Returns (path, mtime, size) of all entries with one os.scandir()
+        # call; partial files and the statistics file are not entries
+        entries = []
+        with os.scandir(self.cache_path) as it:
+            for entry in it:
+                if entry.name.endswith('.part') or \
+                        entry.name.startswith('cache_stats'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def entry_path(self, name):
+        return '%s/%s' % (self.cache_path, name)
+
+    def lookup(self, name):
+        '''
+        Returns the path to a cached entry and marks it as used, or None if
+        the entry is not cached.
+        '''
+        path = self.entry_path(name)
+        try:
+            size = os.path.getsize(path)
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.hit_bytes += size
+        return path
+
+    def store(self, name, write):
+        '''
+        Adds an entry to the cache and evicts old entries if the cache
+        exceeds its budget.
+
+        Parameters
+        ----------
+            name : str
+                Entry name.
+            write : function
+                Function that takes a path and writes the entry to it.
+
+        Returns
+        -------
+            str
+                path to the cached entry
+        '''
+        path = self.entry_path(name)
+        part_path = '%s.%d.%d.part' % (path, os.getpid(),
+                                       threading.get_ident())
+        try:
+            write(part_path)
+            os.replace(part_path, path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        size = os.path.getsize(path)
+        with self._lock:
+            self.miss_bytes += size
+            self._total_bytes += size
+            over = self._total_bytes > self.max_bytes
+        if over:
+            self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        '''
+        Removes least recently used entries until the cache fits in
+        max_bytes.
+
+        Parameters
+        ----------
+            keep : str
+                Path to an entry that must not be removed.
+
+        Returns
+        -------
+            int
+                number of bytes removed
+        '''
+        with self._lock:
+            # other processes may have added or removed entries
+            entries = sorted(self._scan(), key=lambda x: x[1])
+            total_bytes = sum(x[2] for x in entries)
+            removed_bytes = 0
+            now = time.time()
+            for path, mtime, size in entries:
+                if total_bytes - removed_bytes <= self.max_bytes:
+                    break
+                if path == keep or now - mtime < self.min_age:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    # already removed or open on Windows
+                    continue
+                removed_bytes += size
+                self.evictions += 1
+            self._total_bytes = total_bytes - removed_bytes
+        return removed_bytes
+
+    def totals(self):
+        '''
+        Returns the statistics accumulated in cache_stats.json by
+        save_stats() and the current size of the cache folder without
+        changing them.
+        '''
+        try:
+            with open('%s/cache_stats.json' % self.cache_path) as f:
+                totals = json.load(f)
+        except (FileNotFoundError, ValueError):
+            totals = {}
+        for key in ('hits', 'misses', 'hit_bytes', 'miss_bytes',
+                    'evictions'):
+            totals.setdefault(key, 0)
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_rate'] = totals['hits'] / lookups if lookups else 0.
+        entries = self._scan()
+        totals['entries'] = len(entries)
+        totals['cached_bytes'] = sum(x[2] for x in entries)
+        totals['max_bytes'] = self.max_bytes
+        return totals
+
+    def stats(self):
+        '''
+        Returns the statistics of this instance as a dictionary.
+        '''
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.,
+                    'hit_bytes': self.hit_bytes,
+                    'miss_bytes': self.miss_bytes,
+                    'evictions': self.evictions,
+                    'cached_bytes': self._total_bytes,
+                    'max_bytes': self.max_bytes}
+
+    def save_stats(self):
+        '''
+        Adds the statistics of this instance to the totals in
+        cache_stats.json in the cache folder and resets them. Concurrent
+        updates by several processes may lose counts, which only affects the
+        statistics.
+
+        Returns
+        -------
+            dict
+                statistics accumulated over all runs
+        '''
+        stats_path = '%s/cache_stats.json' % self.cache_path
+        keys = ('hits', 'misses', 'hit_bytes', 'miss_bytes', 'evictions')
+        try:
+            with open(stats_path) as f:
+                totals = json.load(f)
+        except (FileNotFoundError, ValueError):
+            totals = {}
+        with self._lock:
+            for key in keys:
+                totals[key] = totals.get(key, 0) + getattr(self, key)
+                setattr(self, key, 0)
+        tmp_path = '%s.%d.tmp' % (stats_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(totals, f)
+        os.replace(tmp_path, stats_path)
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_rate'] = totals['hits'] / lookups if lookups else 0.
+        return totals
+
+    def report(self):
+        '''
+        Returns the statistics of this instance as a printable line.
+        '''
+        stats = self.stats()
+        return ('Cache: %d hits, %d misses (%.1f%% hit rate), '
+                '%.1f MiB read from cache, %.1f MiB copied, '
+                '%d evicted, %.1f/%.1f MiB used' %
+                (stats['hits'], stats['misses'], stats['hit_rate'] * 100,
+                 stats['hit_bytes'] / 1024**2, stats['miss_bytes'] / 1024**2,
+                 stats['evictions'], stats['cached_bytes'] / 1024**2,
+                 stats['max_bytes'] / 1024**2))
+
+
+class TileCache(FileCache):
+    '''
+    Persistent local cache of source tiles, e.g., original NAIP tiles on a
+    network share. An entry is keyed by the source path, size, and
+    modification time, so a replaced source tile is copied again and its
+    old copy is eventually evicted.
+
+    Usage
+    -----
+        cache = TileCache('D:/naip_cache', 20 * 1024**3)
+        local_path = cache.get(src_path)
+        print(cache.report())
+    '''
+    def key(self, src_path, size=None, mtime=None):
+        '''
+        Returns the entry name of a source tile.
+
+        Parameters
+        ----------
+            src_path : str
+                Source path.
+            size : int
+                Size of the source file; read with os.stat() if None.
+            mtime : float
+                Modification time of the source file; read with os.stat()
+                if None.
+        '''
+        if size is None or mtime is None:
+            stat = os.stat(src_path)
+            size, mtime = stat.st_size, stat.st_mtime
+        src_path = os.path.abspath(src_path).replace('\\', '/')
+        digest = hashlib.sha1(('%s|%d|%d' % (src_path, size, mtime * 1e6)).
+                              encode()).hexdigest()[:16]
+        return '%s_%s' % (digest, os.path.basename(src_path))
+
+    def get(self, src_path):
+        '''
+        Returns the path to a local copy of a source tile, copying it into
+        the cache first if necessary. If the source cannot be stat'ed, e.g.,
+        because it does not exist, src_path is returned so that the caller
+        reports the error.
+        '''
+        try:
+            name = self.key(src_path)
+        except OSError:
+            return src_path
+        path = self.lookup(name)
+        if path is None:
+            path = self.store(name, lambda x: shutil.copyfile(src_path, x))
+        return path
+
+
+class ResultCache(FileCache):
+    '''
+    Persistent content-addressed cache of tile products such as final and
+    clipped final tiles. An entry is keyed by the contents of the input
+    files, the operation, and its parameters, e.g., the snap grid, WKID, and
+    output format, so any identical computation is a hit regardless of the
+    region folder, run, or year that asks for it.
+
+    Usage
+    -----
+        cache = ResultCache('D:/result_cache', 20 * 1024**3)
+        key = cache.key('clip', [frtif_path], qq=qq_digest, wkid=102039)
+        if not cache.fetch(key, cfrtif_path):
+            clip(frtif_path, cfrtif_path)
+            cache.put(key, cfrtif_path)
+    '''
+    def __init__(self, cache_path, max_bytes, min_age=300):
+        super().__init__(cache_path, max_bytes, min_age)
+        # (path, size, mtime) => content digest
+        self._digests = {}
+
+    def digest(self, path):
+        '''
+        Returns the SHA-1 digest of the contents of a file. Digests are
+        remembered by path, size, and modification time, so a file is read
+        only once per process.
+        '''
+        stat = os.stat(path)
+        ident = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(ident)
+        if digest is None:
+            h = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1024**2), b''):
+                    h.update(block)
+            digest = self._digests[ident] = h.hexdigest()
+        return digest
+
+    def key(self, op, input_paths, **params):
+        '''
+        Returns the key of an operation.
+
+        Parameters
+        ----------
+            op : str
+                Operation name.
+            input_paths : list
+                Paths to all the input files, e.g., .shp, .shx, and .dbf
+                files of a shapefile.
+            params : dict
+                Parameters that affect the output; values must be
+                serializable to JSON or have a stable str().
+        '''
+        h = hashlib.sha1(op.encode())
+        for path in input_paths:
+            h.update(self.digest(path).encode())
+        h.update(json.dumps(params, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    def fetch(self, key, path):
+        '''
+        Copies a cached result to path and returns True, or returns False
+        if the result is not cached. path is written atomically.
+        '''
+        ext = os.path.splitext(path)[1]
+        entry_path = self.lookup('%s%s' % (key, ext))
+        if entry_path is None:
+            return False
+        with atomic_output(path) as tmp_path:
+            shutil.copyfile(entry_path, tmp_path)
+        return True
+
+    def put(self, key, path):
+        '''
+        Adds a result file to the cache.
+        '''
+        ext = os.path.splitext(path)[1]
+        return self.store('%s%s' % (key, ext),
+                          lambda x: shutil.copyfile(path, x))
+
+
+class ArrayCache(FileCache):
+    '''
+    Persistent cache of decoded rasters as .npy files. A raster is decoded
+    only once per version; later reads map the .npy file read-only, so they
+    copy nothing and processes that read the same raster share the
+    operating system's page cache. An entry is keyed by the source path,
+    size, modification time, and decoding parameters, e.g., the nodata
+    value or the mask of a derived raster.
+
+    Usage
+    -----
+        cache = ArrayCache('D:/array_cache', 10 * 1024**3)
+        arr = cache.get(raster_path,
+                        lambda: arcpy.RasterToNumPyArray(raster_path))
+    '''
+    def key(self, src_path, **params):
+        '''
+        Returns the entry name of a decoded raster.
+        '''
+        stat = os.stat(src_path)
+        src_path = os.path.abspath(src_path).replace('\\', '/')
+        digest = hashlib.sha1(('%s|%d|%d|%s' % (src_path, stat.st_size,
+                stat.st_mtime * 1e6, json.dumps(params, sort_keys=True,
+                                                default=str))).
+                encode()).hexdigest()[:16]
+        return '%s_%s.npy' % (digest, os.path.basename(src_path))
+
+    def get(self, src_path, decode, **params):
+        '''
+        Returns a read-only memory-mapped array of a raster, decoding it
+        into the cache first if necessary. If the source cannot be stat'ed,
+        e.g., because it is not a file, the decoded array is returned
+        without caching.
+
+        Parameters
+        ----------
+            src_path : str
+                Path to the source raster whose version keys the entry.
+            decode : function
+                Function without arguments that returns the decoded array.
+            params : dict
+                Parameters of decode that affect the array.
+        '''
+        try:
+            name = self.key(src_path, **params)
+        except OSError:
+            return decode()
+        path = self.lookup(name)
+        if path is None:
+            arr = decode()
+
+            def write(x):
+                with open(x, 'wb') as f:
+                    np.save(f, arr)
+
+            path = self.store(name, write)
+        return np.load(path, mmap_mode='r')
@@ -13,12 +13,34 @@
 
 import arcpy
 import os
+import csv
 import sys
-import glob
 import math
-from configparser import ConfigParser
 import time
+import hashlib
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .planner import WorkPlan, tile_store_path
+from .geometry import snap_grid, geometry_rings, burn_polygons, \
+        points_in_polygon
+from .qqgrid import QQIndex, lonlat_to_qq, projected_to_lonlat
+from .sampling import sample_points
+from .accuracy import assess_accuracy, write_accuracy_report, \
+        inversion_confidence
+from .estimate import adaptive_estimate
+from .journal import Journal, atomic_output, remove_dataset, dataset_size, \
+        link_dataset
+from .jobqueue import JobQueue, worker_name
+from .prefetch import Prefetcher
+from .cache import TileCache, ResultCache, ArrayCache
+from .rasterformat import CODECS, raster_env, check_pixel_type
+from .blocks import raster_blocks
+from .zonal import ZoneLayer, write_zonal_table
+from .morphology import clean_canopy, cleanup_halo
+from .gapfill import fill_gaps, has_gaps
+from .context import ExecutionContext, run_concurrently
+from .vegetation import ndvi_summary
+from .objective import class_counts, rank_tiles, weighted_best_tiles
 
 '''
 Functions
@@ -27,6 +49,9 @@ Functions
         Adds the phyregs field to the NAIP QQ shapefile and
         populates it with physiographic region IDs that intersect each NAIP
         tile.
+    prefilter_naip_tiles(config, phyreg_ids):
+        Writes noncanopy clipped final tiles for NAIP tiles without possible
+        canopy.
     reproject_naip_tiles():
         Function reprojects and snaps the NAIP tiles that intersect
         selected physiographic regions.
@@ -45,54 +70,75 @@ Functions
     correct_inverted_canopy_tif(inverted_phyreg_ids):
         Corrects the values of mosaikced and clipped regions that
         have been inverted.
+    detect_inverted_regions(config, nlcd, expected_fraction):
+        Detects regions whose model produced an inverted result from
+        sampled canopy statistics.
+    estimate_canopy_cover(config, phyreg_ids, zones, zone_field, error,
+                          confidence):
+        Estimates the canopy cover of regions or zones from random samples
+        with confidence intervals.
+    zonal_statistics(config, zone_layers, phyreg_ids, block_size, csv_path):
+        Counts canopy, noncanopy, and nodata cells per zone of several
+        polygon layers in one pass over the canopy TIFF files.
+    fill_canopy_gaps(config, phyreg_ids, max_distance, block_size,
+                     csv_path):
+        Fills nodata gaps inside regions of the canopy TIFF files.
+    clean_canopy_tif(config, block_size):
+        Removes salt-and-pepper cells from the canopy TIFF files before
+        polygonization.
     convert_canopy_tif_to_shp():
         Converts the canopy TIFF files to shapefile.
     generate_gtpoints(phyreg_ids, min_area_sqkm, max_area_sqkm, min_points,
-                      max_points):
+                      max_points, seed, stratify):
         Generates randomized points for ground truthing.
     update_gtpoints(self, old_points, phyreg_ids)
         Copies a previous years GT points but with the new years GT values.
     add_naip_tiles_for_gt(gtpoints):
         Adds NAIP imagery where a ground truthing point is located.
+    assess_gt_accuracy(config, truth_field):
+        Assesses the accuracy of the canopy maps using ground truthing
+        points.
+    extract_gt_chips(config, gtpoints, chip_size):
+        Extracts NAIP and canopy windows around ground truthing points.
+    plan_work():
+        Scans the NAIP and results folders once and computes the work list of
+        each stage.
+    rasterize_afe_tiles(config, tiles):
+        Rasterizes AFE shapefiles onto the snap grid in parallel.
+    enqueue_stage(config, stage):
+        Adds the work units of a stage to a job queue on the shared file
+        system.
+    run_worker(config):
+        Claims and processes jobs from the job queue.
+    warm_up(config):
+        Loads the layers and snap raster grid reused by later jobs.
+    run_job(config, job):
+        Runs one job of the worker service.
+    naip_tile_path(config, filename):
+        Returns the path to an original NAIP tile.
+    naip_tile_cache(config):
+        Returns the persistent NAIP tile cache.
+    result_cache(config):
+        Returns the persistent cache of final and clipped final tiles.
+    array_cache(config):
+        Returns the persistent cache of rasters decoded into NumPy arrays.
+    benchmark_codecs(config, num_tiles, codecs):
+        Measures the write time, read time, and size of raster outputs for
+        each compression codec on sample tiles.
 '''
 def __timed(func):
     # Decorative function for verbose time outputs
     def wrapper(self, *args, **kwargs):
         if self.verbosity == 1:
             start_time = time.time()
-            func(self, *args, **kwargs)
+            ret = func(self, *args, **kwargs)
             end_time = time.time() - start_time
             print(f"---- {end_time / 60} minutes elapsed----")
         else:
-            func(self, *args, **kwargs)
+            ret = func(self, *args, **kwargs)
+        return ret
     return wrapper
 
-def __calculate_row_column(xy, rast_ext, rast_res):
-    '''
-    This function calculates array row and column using x, y, extent, and
-    resolution.
-
-    Parameters
-    ----------
-        xy : list, tuple
-            (x, y) coordinates
-        rast_ext :
-            raster extent
-        rast_res : list, tuple
-            (width, height) raster resolution
-
-    Returns
-    -------
-        row, col
-    '''
-    x = xy[0]
-    y = xy[1]
-    w = rast_res[0]
-    h = rast_res[1]
-    row = int((rast_ext.YMax - y) / h)
-    col = int((x - rast_ext.XMin) / w)
-    return row, col
-
 def assign_phyregs_to_naipqq(config):
     '''
     This function adds the phyregs field to the NAIP QQ shapefile and
@@ -163,286 +209,1177 @@ def assign_phyregs_to_naipqq(config):
 
     print('Completed')
 
+def plan_work(config, phyreg_ids=None, adopt=False):
+    '''
+    This function scans the NAIP and results folders only once and computes
+    the work list of each stage for the selected physiographic regions
+    including missing AFE outputs, already processed tiles, and stale tiles
+    whose outputs are older than their inputs. Print the report() of the
+    returned plan for a dry run.
+
+    Outputs are complete only if they are recorded in the journal of the
+    results folder. Outputs of a region that has not been adopted yet and
+    has nothing in the journal, e.g., outputs of runs before the journal was
+    introduced, are all trusted and, if adopt is True, recorded in the
+    journal the first time the region is planned.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    phyreg_ids : list
+        list of physiographic region IDs to process (default
+        config.phyreg_ids)
+    adopt : bool
+        whether to record existing outputs of regions not yet adopted in the
+        journal
+
+    Returns
+    -------
+    WorkPlan
+        its journal attribute is the Journal object of the results folder
+    '''
+    naipqq_layer = config.naipqq_layer
+    naipqq_phyregs_field = config.naipqq_phyregs_field
+
+    if phyreg_ids is None:
+        phyreg_ids = config.phyreg_ids
+
+    # private views instead of selections on the shared layers, so plans can
+    # be computed while other stages run
+    with ExecutionContext(name='plan') as context:
+        names = dict(__region_names(context, config, phyreg_ids))
+
+        # read all the NAIP QQ's in one pass instead of selecting them per
+        # region
+        tiles = dict((x, []) for x in names)
+        with arcpy.da.SearchCursor(context.view(naipqq_layer),
+                ['OID@', 'FileName', naipqq_phyregs_field]) as cur:
+            for row in cur:
+                filename = row[1][:-13]
+                for phyreg_id in row[2].strip(',').split(','):
+                    if phyreg_id and int(phyreg_id) in tiles:
+                        tiles[int(phyreg_id)].append((row[0], filename))
+
+    journal = Journal(config.results_path)
+    plan = WorkPlan([(names[x], x, tiles[x]) for x in names],
+                    config.results_path, config.naip_path,
+                    config.analysis_year, journal,
+                    config.inverted_phyreg_ids)
+    # outputs of runs before the journal was introduced are adopted per
+    # region, so planning some regions does not distrust the others
+    count = 0
+    for region in plan:
+        folder = '%s/%s' % (config.results_path, region.name)
+        if journal.adopted(folder):
+            continue
+        if adopt:
+            artifacts = region.artifacts() + plan.stored_artifacts(region)
+            journal.adopt(artifacts, folder)
+            count += len(artifacts)
+        else:
+            region.journal = None
+        region.update()
+    if count:
+        print('Adopted %d existing outputs' % count)
+    return plan
+
+def __region_names(context, config, phyreg_ids):
+    # Returns (phyreg_id, name) of physiographic regions using a private view
+    # of phyregs_layer; names are used in folder and file names
+    phyregs_view = context.view(config.phyregs_layer,
+            'PHYSIO_ID in (%s)' % ','.join(map(str, phyreg_ids)))
+    names = []
+    with arcpy.da.SearchCursor(phyregs_view, ['NAME', 'PHYSIO_ID']) as cur:
+        for row in cur:
+            # CreateRandomPoints cannot create a shapefile with - in its
+            # filename
+            names.append((row[1], row[0].replace(' ', '_').replace('-',
+                                                                   '_')))
+    return names
+
 @__timed
 def reproject_naip_tiles(config):
     '''
     This function reprojects and snaps the NAIP tiles that intersect
-    selected physiographic regions.
+    selected physiographic regions. Each tile is reprojected only once into
+    the shared tile store of the analysis year and hard linked into the
+    Inputs folder of every region it intersects. If scratch_path is
+    configured, upcoming NAIP tiles are prefetched from naip_path in the
+    background while the current tile is reprojected. Tiles without
+    possible canopy are skipped if the vegetation prefilter is configured.
     '''
-    phyregs_layer = config.phyregs_layer
-    naipqq_layer = config.naipqq_layer
-    naipqq_phyregs_field = config.naipqq_phyregs_field
-    spatref_wkid = config.spatref_wkid
-    naip_path = config.naip_path
-    results_path = config.results_path
-    snaprast_path = config.snaprast_path
+    __create_snaprast(config)
 
-    spatref = arcpy.SpatialReference(spatref_wkid)
+    with ExecutionContext(__stage_env(config), 'reproject'):
+        __reproject_naip_tiles(config)
+
+    __report_naip_cache(config)
+    print('Completed')
+
+def __reproject_naip_tiles(config):
+    # Reprojects and links the NAIP tiles of all regions in the execution
+    # context of the stage
+    if config.prefilter_ndvi_threshold is not None:
+        prefilter_naip_tiles(config)
+
+    plan = plan_work(config, adopt=True)
+    for region in plan:
+        __make_region_dirs(region)
+        for filename in region.stage('reproject').missing:
+            print('Missing NAIP tile: %s.tif' % filename)
+    # tiles in processing order across all regions so that the next
+    # region's tiles are prefetched while the current one finishes
+    units = plan.reproject_units()
+    filenames = [x for x in units if not plan.stored(x)]
+
+    paths = [naip_tile_path(config, '%s.tif' % x) for x in filenames]
+    sizes = [plan.naip_index.lookup('%s.tif' % x)[0] for x in filenames]
+    with __prefetcher(config, paths, sizes) as prefetcher:
+        for filename, infile_path in zip(filenames, prefetcher):
+            print(filename)
+            __reproject_naip_tile(config, filename, plan.journal,
+                                  infile_path)
+
+    for filename, regions in units.items():
+        for region in regions:
+            __link_naip_tile(config, region.name, filename, plan.journal)
+    print('Reprojected %d tiles for %d region tiles' %
+          (len(filenames), sum(len(x) for x in units.values())))
+
+def prefilter_naip_tiles(config, phyreg_ids=None):
+    '''
+    This function finds NAIP tiles that cannot contain any canopy, e.g.,
+    open water, reservoirs, or dense urban cores, using the NDVI of a sparse
+    sample of their red and near infrared cells. For each such tile, the
+    clipped final tile is written directly as noncanopy inside its NAIP QQ
+    polygon, so reprojection, Feature Analyst, conversion, and clipping are
+    skipped and the tile is still part of the mosaic. Tiles that already
+    have a clipped final tile are not evaluated.
+
+    Every evaluated tile is appended to prefilter_<analysis_year>.csv in
+    results_path with its NDVI statistics and whether it was skipped, so
+    the decisions can be audited.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object; prefilter_ndvi_threshold,
+        prefilter_max_vegetated_fraction, and prefilter_windows configure
+        the prefilter
+    phyreg_ids : list
+        list of physiographic region IDs to process (default
+        config.phyreg_ids)
+
+    Returns
+    -------
+    dict
+        filename => NDVI summary of each evaluated tile with its skipped
+        flag
+    '''
+    threshold = config.prefilter_ndvi_threshold
+    if threshold is None:
+        threshold = 0.2
+
+    plan = plan_work(config, phyreg_ids, adopt=True)
+    summaries = {}
+    rows = []
+    context = ExecutionContext(__stage_env(config), 'prefilter')
+    for region in plan:
+        print(region.name)
+        # a truncated clipped tile left by a crash is not complete, so its
+        # tile is evaluated again
+        candidates = [x for x in region.tiles
+                      if x[1] not in region.prefiltered and
+                      'cfr%s.tif' % x[1] not in region.complete_outputs]
+        skipped = []
+        for oid, filename in candidates:
+            if filename not in summaries:
+                summaries[filename] = __prefilter_naip_tile(config, filename,
+                                                            threshold)
+            summary = summaries[filename]
+            if summary is None:
+                continue
+            if summary['skipped']:
+                skipped.append((oid, filename))
+            rows.append([region.name, filename] +
+                        [summary[x] for x in ('valid_cells', 'ndvi_mean',
+                                              'ndvi_p99',
+                                              'vegetated_fraction',
+                                              'skipped')])
+        if skipped:
+            __make_region_dirs(region)
+            with context:
+                __write_noncanopy_tiles(context, config, region, skipped,
+                                        summaries, plan.journal)
+        print('Skipped %d of %d tiles' % (len(skipped), len(candidates)))
+
+    if rows:
+        csv_path = '%s/prefilter_%d.csv' % (config.results_path,
+                                            config.analysis_year)
+        exists = os.path.exists(csv_path)
+        with open(csv_path, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if not exists:
+                writer.writerow(['region', 'tile', 'valid_cells',
+                                 'ndvi_mean', 'ndvi_p99',
+                                 'vegetated_fraction', 'skipped'])
+            writer.writerows(rows)
+
+    print('Completed')
+    return dict((x, y) for x, y in summaries.items() if y is not None)
+
+def __prefilter_naip_tile(config, filename, threshold):
+    # Summarizes the NDVI of a regular grid of small windows of an original
+    # NAIP tile instead of reading all of its cells; returns None if the
+    # tile is missing or has no near infrared band
+    infile_path = naip_tile_path(config, '%s.tif' % filename)
+    if not os.path.exists(infile_path):
+        return None
+    infile_path = naip_tile_path(config, '%s.tif' % filename, True)
+    ras = arcpy.Raster(infile_path)
+    if ras.bandCount < 4:
+        return None
+    num_windows = config.prefilter_windows
+    ext = ras.extent
+    xs = ext.XMin + (np.arange(num_windows) + 0.5) * \
+            (ext.XMax - ext.XMin) / num_windows
+    ys = ext.YMax - (np.arange(num_windows) + 0.5) * \
+            (ext.YMax - ext.YMin) / num_windows
+    red = []
+    nir = []
+    for y in ys:
+        for x in xs:
+            # NAIP bands are red, green, blue, and near infrared
+            arr = __read_window(ras, x, y, 4, 0)[0]
+            red.append(arr[0])
+            nir.append(arr[3])
+    summary = ndvi_summary(np.array(red), np.array(nir), threshold)
+    # a tile without any valid cell is not skipped because nothing is known
+    # about it
+    summary['skipped'] = summary['valid_cells'] > 0 and \
+            summary['vegetated_fraction'] <= \
+            config.prefilter_max_vegetated_fraction
+    print('%s: %.3f vegetated%s' % (filename, summary['vegetated_fraction'],
+                                    ' (skipped)' if summary['skipped']
+                                    else ''))
+    return summary
+
+def __write_noncanopy_tiles(context, config, region, tiles, summaries,
+                            journal):
+    # Writes noncanopy clipped final tiles with nodata outside their NAIP QQ
+    # polygons onto the snap grid as __clip_final_tile() would for an
+    # all-noncanopy final tile
+    spatref = arcpy.SpatialReference(config.spatref_wkid)
+    snap_origin, cellsize = __snap_grid_info(config)
+    pixel_type = check_pixel_type(config.bit_depth)
+    filenames = dict(tiles)
+    with arcpy.da.SearchCursor(context.view(config.naipqq_layer,
+                context.oid_where(config.naipqq_layer, filenames)),
+            ['OID@', 'SHAPE@'], spatial_reference=spatref) as cur:
+        for oid, shape in cur:
+            filename = filenames[oid]
+            ext = shape.extent
+            xmin, ymax, nrows, ncols = snap_grid((ext.XMin, ext.YMin,
+                                                  ext.XMax, ext.YMax),
+                                                 snap_origin, cellsize)
+            arr = burn_polygons([geometry_rings(shape.__geo_interface__)],
+                                [0], xmin, ymax, cellsize, nrows, ncols, 3)
+            out_raster = arcpy.NumPyArrayToRaster(arr, arcpy.Point(xmin,
+                                                  ymax - nrows * cellsize[1]),
+                                                  cellsize[0], cellsize[1], 3)
+            cfrtiffile_path = '%s/cfr%s.tif' % (region.outputs_path,
+                                                filename)
+            with atomic_output(cfrtiffile_path) as tmp_path:
+                __save_canopy_raster(out_raster, tmp_path, pixel_type)
+                del out_raster
+                arcpy.DefineProjection_management(tmp_path, spatref)
+            summary = summaries[filename]
+            journal.record('prefilter', cfrtiffile_path,
+                           inverted=region.inverted,
+                           **dict((x, summary[x]) for x in
+                                  ('valid_cells', 'ndvi_mean', 'ndvi_p99',
+                                   'vegetated_fraction')))
+
+def naip_tile_path(config, filename, cached=False):
+    '''
+    This function returns the path to an original NAIP tile in naip_path.
+    If cached is True and naip_cache_path is configured, the tile is copied
+    into the NAIP tile cache if necessary and the path to the cached copy is
+    returned instead.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    filename : str
+        NAIP tile filename with the .tif extension
+    cached : bool
+        Whether to read the tile through the NAIP tile cache
+    '''
+    path = '%s/%s/%s' % (config.naip_path, filename[2:7], filename)
+    cache = naip_tile_cache(config)
+    if cached and cache is not None:
+        path = cache.get(path)
+    return path
+
+# NAIP tile caches by (naip_cache_path, naip_cache_max_mb) so that their
+# statistics cover all the stages run in this process
+__naip_caches = {}
+
+def naip_tile_cache(config):
+    '''
+    This function returns the NAIP tile cache of the configuration or None
+    if naip_cache_path is not configured.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    '''
+    if config.naip_cache_path is None:
+        return None
+    key = (config.naip_cache_path, config.naip_cache_max_mb)
+    if key not in __naip_caches:
+        __naip_caches[key] = TileCache(config.naip_cache_path,
+                                       config.naip_cache_max_mb * 1024**2)
+    return __naip_caches[key]
+
+# result caches by (result_cache_path, result_cache_max_mb)
+__result_caches = {}
+
+def result_cache(config):
+    '''
+    This function returns the result cache of the configuration or None if
+    result_cache_path is not configured. Final and clipped final tiles are
+    cached by the contents of their inputs, the operation, the snap grid,
+    the spatial reference, and the output format.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    '''
+    if config.result_cache_path is None:
+        return None
+    key = (config.result_cache_path, config.result_cache_max_mb)
+    if key not in __result_caches:
+        __result_caches[key] = ResultCache(config.result_cache_path,
+                config.result_cache_max_mb * 1024**2)
+    return __result_caches[key]
+
+# array caches by (array_cache_path, array_cache_max_mb)
+__array_caches = {}
+
+def array_cache(config):
+    '''
+    This function returns the array cache of the configuration or None if
+    array_cache_path is not configured. Rasters are decoded into memory-mapped
+    .npy files once per version and mapped read-only afterwards.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    '''
+    if config.array_cache_path is None:
+        return None
+    key = (config.array_cache_path, config.array_cache_max_mb)
+    if key not in __array_caches:
+        __array_caches[key] = ArrayCache(config.array_cache_path,
+                                         config.array_cache_max_mb * 1024**2)
+    return __array_caches[key]
+
+def __cached_array(cache, src_path, decode, **params):
+    # Returns the array of decode() through the array cache if any; params
+    # identify a raster derived from src_path, e.g., by a mask
+    if cache is None:
+        return decode()
+    return cache.get(src_path, decode, **params)
+
+def __result_key(config, op, input_paths, **params):
+    # Returns the result cache key of an operation or None if the result
+    # cache is not configured; every key includes the snap grid, spatial
+    # reference, and output format
+    cache = result_cache(config)
+    if cache is None:
+        return None
+    return cache.key(op, input_paths, snap_grid=__snap_grid_info(config),
+                     wkid=config.spatref_wkid, format=__raster_format(config),
+                     **params)
+
+def __fetch_result(config, key, path):
+    # Restores an output from the result cache; returns False on a miss or
+    # if the result cache is not configured
+    return key is not None and result_cache(config).fetch(key, path)
+
+def __store_result(config, key, path):
+    # Adds an output to the result cache if it is configured
+    if key is not None:
+        result_cache(config).put(key, path)
+
+def __shapefile_files(shp_path):
+    # Returns the paths to the files of a shapefile that define its
+    # features and attributes
+    stem = os.path.splitext(shp_path)[0]
+    return [x for x in ('%s%s' % (stem, ext) for ext in ('.shp', '.shx',
+                                                         '.dbf', '.prj'))
+            if os.path.exists(x)]
+
+def __report_naip_cache(config):
+    # Prints the hit rate of the NAIP tile cache for this call and adds it to
+    # the statistics stored in the cache folder
+    cache = naip_tile_cache(config)
+    if cache is not None:
+        print(cache.report())
+        cache.save_stats()
+
+def __report_result_cache(config):
+    # Prints the hit rate of the result cache for this call and adds it to
+    # the statistics stored in the cache folder
+    cache = result_cache(config)
+    if cache is not None:
+        print(cache.report())
+        cache.save_stats()
+
+def __prefetcher(config, paths, sizes=None):
+    # Returns a Prefetcher for NAIP tiles using the configured scratch
+    # folder and budget; tiles are fetched through the NAIP tile cache if
+    # configured
+    cache = naip_tile_cache(config)
+    return Prefetcher(paths, config.scratch_path,
+                      max_tiles=config.prefetch_tiles,
+                      max_bytes=config.prefetch_max_mb * 1024**2,
+                      sizes=sizes,
+                      fetch=None if cache is None else cache.get)
+
+def __create_snaprast(config):
+    # Creates the snap raster from an original NAIP tile if it does not exist
+    snaprast_path = config.snaprast_path
 
-    arcpy.env.addOutputsToMap = False
     if not os.path.exists(snaprast_path):
         snaprast_file = os.path.basename(snaprast_path)
         # Account for different filename lengths between years
         if len(snaprast_file) == 28:
-            infile_path = '%s/%s/%s' % (naip_path, snaprast_file[2:7],
-                                        snaprast_file)
+            infile_path = naip_tile_path(config, snaprast_file, True)
         else:
-            infile_path = '%s/%s/%s' % (naip_path, snaprast_file[3:8],
-                                        snaprast_file[1:])
-        arcpy.ProjectRaster_management(infile_path, snaprast_path, spatref)
-    arcpy.env.snapRaster = snaprast_path
+            infile_path = naip_tile_path(config, snaprast_file[1:], True)
+        # the snap raster cannot snap to itself
+        env = {'addOutputsToMap': False}
+        env.update(__raster_format(config)[0])
+        with ExecutionContext(env, 'snaprast'), \
+                atomic_output(snaprast_path) as tmp_path:
+            arcpy.ProjectRaster_management(infile_path, tmp_path,
+                    arcpy.SpatialReference(config.spatref_wkid))
+
+def __stage_env(config):
+    # Returns the arcpy.env settings shared by all processing stages for
+    # their execution contexts
+    env = {'addOutputsToMap': False, 'snapRaster': config.snaprast_path,
+           # stale outputs are processed again
+           'overwriteOutput': True}
+    env.update(__raster_format(config)[0])
+    return env
+
+def __raster_format(config):
+    # Returns the arcpy environment settings and pixel type of raster
+    # outputs; they are passed to worker processes, which do not inherit
+    # arcpy.env
+    return (raster_env(config.compression, config.tile_size),
+            check_pixel_type(config.bit_depth))
+
+def __set_raster_env(config, settings=None):
+    # Sets the compression and tiling of raster outputs
+    if settings is None:
+        settings = __raster_format(config)[0]
+    for name, value in settings.items():
+        setattr(arcpy.env, name, value)
+
+def __save_canopy_raster(raster, path, pixel_type):
+    # Writes a canopy raster with values 0 and 1 and nodata 3 in the
+    # configured pixel type; CopyRaster_management() is used because
+    # Raster.save() does not take a pixel type
+    arcpy.CopyRaster_management(raster, path, nodata_value='3',
+                                pixel_type=pixel_type)
+
+def benchmark_codecs(config, num_tiles=5, codecs=None, phyreg_ids=None,
+                     seed=None):
+    '''
+    This function measures the write time, read time, and size of raster
+    outputs for each compression codec on a random sample of existing
+    tiles: clipped final tiles (canopy) in the configured bit depth and
+    reprojected NAIP tiles (naip). The results are printed and written to
+    results_path/codec_benchmark.csv, and the test outputs are removed.
 
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-            where_clause='PHYSIO_ID in (%s)' % ','.join(map(str,
-                                        config.phyreg_ids)))
-    with arcpy.da.SearchCursor(phyregs_layer, ['NAME', 'PHYSIO_ID']) as cur:
-        for row in cur:
-            name = row[0]
-            print(name)
-            # CreateRandomPoints cannot create a shapefile with - in its
-            # filename
-            name = name.replace(' ', '_').replace('-', '_')
-            phyreg_id = row[1]
-            outdir_path = '%s/%s/Inputs' % (results_path, name)
-            if not os.path.exists(outdir_path):
-                if not os.path.exists(outdir_path[:-7]):
-                    os.mkdir(outdir_path[:-7])
-                os.mkdir(outdir_path)
-            outputs_path = '%s/%s/Outputs' % (results_path, name)
-            if not os.path.exists(outputs_path):
-                os.mkdir(outputs_path)
-            arcpy.SelectLayerByAttribute_management(naipqq_layer,
-                    where_clause="%s like '%%,%d,%%'" % (
-                        naipqq_phyregs_field, phyreg_id))
-            with arcpy.da.SearchCursor(naipqq_layer, ['FileName']) as cur2:
-                for row2 in sorted(cur2):
-                    filename = '%s.tif' % row2[0][:-13]
-                    folder = filename[2:7]
-                    infile_path = '%s/%s/%s' % (naip_path, folder, filename)
-                    outfile_path = '%s/r%s' % (outdir_path, filename)
-                    check_snap(infile_path, snaprast_path)
-                    if not os.path.exists(outfile_path):
-                        arcpy.ProjectRaster_management(infile_path,
-                                outfile_path, spatref)
-
-    # clear selection
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-                                            'CLEAR_SELECTION')
-    arcpy.SelectLayerByAttribute_management(naipqq_layer,
-                                            'CLEAR_SELECTION')
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    num_tiles : int
+        number of tiles of each kind
+    codecs : list
+        codecs to compare (default all in rasterformat.CODECS)
+    phyreg_ids : list
+        list of physiographic region IDs to sample tiles from (default
+        config.phyreg_ids)
+    seed : int
+        seed for a reproducible sample
 
+    Returns
+    -------
+    list
+        dictionaries of codec, kind, tiles, write_s, read_s, and mb
+    '''
+    if codecs is None:
+        codecs = list(CODECS)
+    pixel_type = check_pixel_type(config.bit_depth)
+    plan = plan_work(config, phyreg_ids)
+    samples = {'canopy': [], 'naip': []}
+    for region in plan:
+        for tile in region.tiles:
+            if 'cfr%s.tif' % tile[1] in region.outputs:
+                samples['canopy'].append('%s/cfr%s.tif' %
+                                         (region.outputs_path, tile[1]))
+            if 'r%s.tif' % tile[1] in region.inputs:
+                samples['naip'].append('%s/r%s.tif' %
+                                       (region.inputs_path, tile[1]))
+    rng = np.random.default_rng(seed)
+    for kind in samples:
+        paths = samples[kind]
+        if len(paths) > num_tiles:
+            samples[kind] = [paths[i] for i in sorted(
+                rng.choice(len(paths), num_tiles, replace=False))]
+
+    bench_path = '%s/codec_benchmark' % (config.scratch_path or
+                                         config.results_path)
+    if not os.path.exists(bench_path):
+        os.makedirs(bench_path)
+    results = []
+    for codec in codecs:
+        # pyramids would be timed with the codec
+        env = dict(__stage_env(config), pyramid='NONE',
+                   **raster_env(codec, config.tile_size))
+        with ExecutionContext(env, 'benchmark'):
+            for kind, paths in samples.items():
+                if not paths:
+                    continue
+                write_s = read_s = 0.
+                size = 0
+                for path in paths:
+                    out_path = '%s/%s_%s' % (bench_path, codec.lower(),
+                                             os.path.basename(path))
+                    start_time = time.time()
+                    if kind == 'canopy':
+                        __save_canopy_raster(path, out_path, pixel_type)
+                    else:
+                        arcpy.CopyRaster_management(path, out_path)
+                    write_s += time.time() - start_time
+                    size += dataset_size(out_path)
+                    start_time = time.time()
+                    arcpy.RasterToNumPyArray(out_path)
+                    read_s += time.time() - start_time
+                    arcpy.Delete_management(out_path)
+                result = {'codec': codec, 'kind': kind, 'tiles': len(paths),
+                          'write_s': write_s, 'read_s': read_s,
+                          'mb': size / 1024**2}
+                print('%-8s %-6s %d tiles: write %.2f s, read %.2f s, '
+                      '%.1f MiB' % (codec, kind, len(paths), write_s, read_s,
+                                    result['mb']))
+                results.append(result)
+
+    csv_path = '%s/codec_benchmark.csv' % config.results_path
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, ['codec', 'kind', 'tiles', 'write_s',
+                                    'read_s', 'mb'])
+        writer.writeheader()
+        writer.writerows(results)
     print('Completed')
+    return results
+
+def __make_region_dirs(region):
+    # Creates the Inputs and Outputs folders of a region
+    for path in (region.inputs_path, region.outputs_path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+def __reproject_naip_tile(config, filename, journal, infile_path=None):
+    # Reprojects one NAIP tile into the shared tile store; infile_path is a
+    # local copy of the NAIP tile, if any
+    filename = '%s.tif' % filename
+    if infile_path is None:
+        infile_path = naip_tile_path(config, filename, True)
+    store_path = tile_store_path(config.results_path, config.analysis_year)
+    if not os.path.exists(store_path):
+        os.makedirs(store_path, exist_ok=True)
+    outfile_path = '%s/r%s' % (store_path, filename)
+    check_snap(infile_path, config.snaprast_path)
+    with atomic_output(outfile_path) as tmp_path:
+        arcpy.ProjectRaster_management(infile_path, tmp_path,
+                arcpy.SpatialReference(config.spatref_wkid))
+    journal.record('reproject', outfile_path)
+    return outfile_path
+
+def __link_naip_tile(config, name, filename, journal):
+    # Links a reprojected tile from the shared tile store into the Inputs
+    # folder of a region, where Feature Analyst and later stages expect it
+    filename = 'r%s.tif' % filename
+    store_path = '%s/%s' % (tile_store_path(config.results_path,
+                                            config.analysis_year), filename)
+    outfile_path = '%s/%s/Inputs/%s' % (config.results_path, name, filename)
+    with atomic_output(outfile_path) as tmp_path:
+        link_dataset(store_path, tmp_path)
+    journal.record('reproject', outfile_path, shared=True)
+    return outfile_path
 
 @__timed
 def convert_afe_to_final_tiles(config):
     '''
-    This function converts AFE outputs to final TIFF files.
+    This function converts AFE outputs to final TIFF files. The values of
+    final tiles of regions in inverted_phyreg_ids are inverted in the same
+    pass, so all later stages produce a correct canopy TIFF.
     '''
-    phyregs_layer = config.phyregs_layer
-    naipqq_layer = config.naipqq_layer
-    naipqq_phyregs_field = config.naipqq_phyregs_field
-    results_path = config.results_path
-    snaprast_path = config.snaprast_path
-
-    arcpy.env.addOutputsToMap = False
-    arcpy.env.snapRaster = snaprast_path
-
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-            where_clause='PHYSIO_ID in (%s)' % ','.join(map(str,
-                                                    config.phyreg_ids)))
-    with arcpy.da.SearchCursor(phyregs_layer, ['NAME', 'PHYSIO_ID']) as cur:
-        for row in cur:
-            name = row[0]
-            print(name)
-            # CreateRandomPoints cannot create a shapefile with - in its
-            # filename
-            name = name.replace(' ', '_').replace('-', '_')
-            phyreg_id = row[1]
+    with ExecutionContext(__stage_env(config), 'convert'):
+        plan = plan_work(config, adopt=True)
+        for region in plan:
+            print(region.name)
             # Check and ensure that FA has classified all files.
-            outdir_path = '%s/%s/Outputs' % (results_path, name)
-            # Path for reprojected tiles
-            inputs_path = '%s/%s/Inputs' % (results_path, name)
+            outdir_path = region.outputs_path
 
-            if len(os.listdir(outdir_path)) == 0:
+            if len(region.outputs) == 0:
                 continue
-            # File names for all reprojected inputs
-            inputs_check = [os.path.basename(x) for x in
-                            glob.glob(f"{inputs_path}/rm_*.tif")]
-            # File names for all classified outputs
-            output_class_check = [os.path.basename(x) for x in
-                                  glob.glob(f"{outdir_path}/rm_*.tif")]
-            # Check and get file names of those missing.
-            missing = []
-            for i in inputs_check:
-                if i not in output_class_check:
-                    missing.append(i)
-            # If any are missing then the length of each list will be
-            # different. Raise I/O error and return missing file names.
-            if len(inputs_check) != len(output_class_check):
-                # Format the same way FA specifies batch inputs.
-                missing_formated = " ".join(missing).replace(' ', '; ')
-                raise IOError(f"Missing classified file: {missing_formated}")
-            arcpy.SelectLayerByAttribute_management(naipqq_layer,
-                    where_clause="%s like '%%,%d,%%'" % (
-                        naipqq_phyregs_field, phyreg_id))
-            with arcpy.da.SearchCursor(naipqq_layer, ['FileName']) as cur2:
-                for row2 in sorted(cur2):
-                    filename = row2[0][:-13]
-                    rshpfile_path = '%s/r%s.shp' % (outdir_path, filename)
-                    rtiffile_path = '%s/r%s.tif' % (outdir_path, filename)
-                    frtiffile_path = '%s/fr%s.tif' % (outdir_path, filename)
-                    if os.path.exists(frtiffile_path):
-                        continue
-                    if os.path.exists(rshpfile_path):
-                        arcpy.FeatureToRaster_conversion(rshpfile_path,
-                                'CLASS_ID', frtiffile_path)
-                        # Compare output tif cell size to snap raster
-                        check_snap(frtiffile_path, snaprast_path)
-                    elif os.path.exists(rtiffile_path):
-                        # Compare input tif cell size to snap raster
-                        check_snap(rtiffile_path, snaprast_path)
-                        arcpy.Reclassify_3d(rtiffile_path, 'Value',
-                                            '1 0;2 1', frtiffile_path)
-    # clear selection
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-                                            'CLEAR_SELECTION')
-    arcpy.SelectLayerByAttribute_management(naipqq_layer,
-                                            'CLEAR_SELECTION')
+            __check_missing_afe(region)
+            shp_tiles = []
+            for filename in region.stage('convert').work:
+                if 'r%s.shp' % filename in region.outputs:
+                    # rasterized in parallel below; the output grid is aligned
+                    # by construction, so no check_snap is needed
+                    shp_tiles.append(('%s/r%s.shp' % (outdir_path, filename),
+                                      '%s/fr%s.tif' % (outdir_path, filename),
+                                      '%s/r%s.tif' % (region.inputs_path,
+                                                      filename),
+                                      region.inverted))
+                else:
+                    __reclassify_afe_tile(config, region.name, filename,
+                                          plan.journal, region.inverted)
+            for frtiffile_path in rasterize_afe_tiles(config, shp_tiles):
+                plan.journal.record('convert', frtiffile_path,
+                                    inverted=region.inverted)
 
+    __report_result_cache(config)
     print('Completed')
 
-@__timed
-def clip_final_tiles(config):
+def __check_missing_afe(region):
+    # Reprojected inputs without classified outputs. If any are missing,
+    # raise I/O error and return missing file names formatted the same way
+    # FA specifies batch inputs.
+    missing = region.missing_afe
+    if missing:
+        raise IOError(f"Missing classified file: {'; '.join(missing)}")
+
+def __reclassify_afe_tile(config, name, filename, journal, inverted=False):
+    # Converts one AFE output TIFF to a final tile; the lookup table of an
+    # inverted region swaps canopy and noncanopy
+    outdir_path = '%s/%s/Outputs' % (config.results_path, name)
+    rtiffile_path = '%s/r%s.tif' % (outdir_path, filename)
+    frtiffile_path = '%s/fr%s.tif' % (outdir_path, filename)
+    # Compare input tif cell size to snap raster
+    check_snap(rtiffile_path, config.snaprast_path)
+    key = __result_key(config, 'reclassify', [rtiffile_path],
+                       inverted=inverted)
+    if __fetch_result(config, key, frtiffile_path):
+        journal.record('convert', frtiffile_path, inverted=inverted,
+                       cached=True)
+        return frtiffile_path
+    with atomic_output(frtiffile_path) as tmp_path:
+        out_raster = arcpy.sa.Reclassify(rtiffile_path, 'Value',
+                arcpy.sa.RemapValue([[1, 1], [2, 0]] if inverted
+                                    else [[1, 0], [2, 1]]))
+        __save_canopy_raster(out_raster, tmp_path,
+                             check_pixel_type(config.bit_depth))
+        del out_raster
+    __store_result(config, key, frtiffile_path)
+    journal.record('convert', frtiffile_path, inverted=inverted)
+    return frtiffile_path
+
+# snap grids by snaprast_path
+__snap_grids = {}
+
+def __snap_grid_info(config):
+    # Returns the origin and cell size of the snap raster; the snap raster is
+    # read only once per process
+    if config.snaprast_path not in __snap_grids:
+        snaprast = arcpy.Raster(config.snaprast_path)
+        __snap_grids[config.snaprast_path] = (
+                (snaprast.extent.XMin, snaprast.extent.YMax),
+                (snaprast.meanCellWidth, snaprast.meanCellHeight))
+    return __snap_grids[config.snaprast_path]
+
+def rasterize_afe_tiles(config, tiles):
     '''
-    This function clips final TIFF files.
-    '''
-    phyregs_layer = config.phyregs_layer
-    naipqq_layer = config.naipqq_layer
-    naipqq_phyregs_field = config.naipqq_phyregs_field
-    results_path = config.results_path
-    snaprast_path = config.snaprast_path
-
-    # Get inmutiable ID's, does not need to be encoded.
-    naipqq_oid_field = arcpy.Describe(naipqq_layer).OIDFieldName
+    This function rasterizes AFE shapefiles using their CLASS_ID field
+    directly onto the snap grid in a process pool. It replaces
+    FeatureToRaster_conversion, which is serial and does not guarantee
+    alignment with the snap raster.
 
-    arcpy.env.addOutputsToMap = False
-    arcpy.env.snapRaster = snaprast_path
-
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-            where_clause='PHYSIO_ID in (%s)' % ','.join(map(str,
-                                                    config.phyreg_ids)))
-    with arcpy.da.SearchCursor(phyregs_layer, ['NAME', 'PHYSIO_ID']) as cur:
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    tiles : list
+        list of (rshpfile_path, frtiffile_path, extent_path, inverted)
+        tuples where extent_path is the reprojected input tile that defines
+        the output extent; the shapefile extent is used if it does not
+        exist; canopy (1) and noncanopy (0) are swapped if inverted is True
+
+    Tiles found in the result cache are restored instead of rasterized.
+
+    Yields
+    ------
+    str
+        path of each completed output tile
+    '''
+    if not tiles:
+        return
+    snap_origin, cellsize = __snap_grid_info(config)
+    # tiles in the result cache are restored instead of rasterized
+    jobs = []
+    keys = {}
+    for tile in tiles:
+        key = __rasterize_key(config, tile)
+        if __fetch_result(config, key, tile[1]):
+            print('%s (cached)' % os.path.basename(tile[1]))
+            yield tile[1]
+            continue
+        keys[tile[1]] = key
+        jobs.append(tile + (snap_origin, cellsize, config.spatref_wkid,
+                            __raster_format(config)))
+    if not jobs:
+        return
+    if config.num_workers <= 1 or len(jobs) == 1:
+        for frtiffile_path in map(__rasterize_afe_tile, jobs):
+            print(os.path.basename(frtiffile_path))
+            __store_result(config, keys[frtiffile_path], frtiffile_path)
+            yield frtiffile_path
+        return
+    with ProcessPoolExecutor(max_workers=config.num_workers) as executor:
+        for frtiffile_path in executor.map(__rasterize_afe_tile, jobs):
+            print(os.path.basename(frtiffile_path))
+            __store_result(config, keys[frtiffile_path], frtiffile_path)
+            yield frtiffile_path
+
+def __rasterize_key(config, tile):
+    # Returns the result cache key of rasterizing an AFE shapefile; the
+    # extent of the reprojected input tile defines the output grid
+    if result_cache(config) is None:
+        return None
+    rshpfile_path, frtiffile_path, extent_path, inverted = tile
+    extent = None
+    if os.path.exists(extent_path):
+        ext = arcpy.Describe(extent_path).extent
+        extent = (ext.XMin, ext.YMin, ext.XMax, ext.YMax)
+    return __result_key(config, 'rasterize',
+                        __shapefile_files(rshpfile_path), extent=extent,
+                        inverted=inverted)
+
+def __rasterize_afe_tile(job):
+    # Worker function for rasterize_afe_tiles(); it must be a module-level
+    # function so that the process pool can pickle it.
+    (rshpfile_path, frtiffile_path, extent_path, inverted, snap_origin,
+     cellsize, spatref_wkid, (settings, pixel_type)) = job
+    __set_raster_env(None, settings)
+    spatref = arcpy.SpatialReference(spatref_wkid)
+    if os.path.exists(extent_path):
+        ext = arcpy.Describe(extent_path).extent
+    else:
+        ext = arcpy.Describe(rshpfile_path).extent
+    xmin, ymax, nrows, ncols = snap_grid((ext.XMin, ext.YMin, ext.XMax,
+                                          ext.YMax), snap_origin, cellsize)
+    polygons = []
+    values = []
+    with arcpy.da.SearchCursor(rshpfile_path, ['SHAPE@', 'CLASS_ID'],
+                               spatial_reference=spatref) as cur:
         for row in cur:
-            name = row[0]
-            print(name)
-            # CreateRandomPoints cannot create a shapefile with - in its
-            # filename
-            name = name.replace(' ', '_').replace('-', '_')
-            phyreg_id = row[1]
-            outdir_path = '%s/%s/Outputs' % (results_path, name)
-            if len(os.listdir(outdir_path)) == 0:
+            if row[0] is None:
                 continue
-            arcpy.SelectLayerByAttribute_management(naipqq_layer,
-                    where_clause="%s like '%%,%d,%%'" % (
-                        naipqq_phyregs_field, phyreg_id))
-            with arcpy.da.SearchCursor(naipqq_layer,
-                    [naipqq_oid_field, 'FileName']) as cur2:
-                for row2 in sorted(cur2):
-                    oid = row2[0]
-                    filename = row2[1][:-13]
-                    frtiffile_path = '%s/fr%s.tif' % (
-                        outdir_path, filename)
-                    cfrtiffile_path = '%s/cfr%s.tif' % (
-                        outdir_path, filename)
-                    if os.path.exists(cfrtiffile_path):
-                        continue
-                    if os.path.exists(frtiffile_path):
-                        arcpy.SelectLayerByAttribute_management(
-                                naipqq_layer,
-                                where_clause='%s=%d' % (
-                                    naipqq_oid_field, oid))
-                        out_raster = arcpy.sa.ExtractByMask(
-                            frtiffile_path, naipqq_layer)
-                        out_raster.save(cfrtiffile_path)
-    # clear selection
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-                                            'CLEAR_SELECTION')
-    arcpy.SelectLayerByAttribute_management(naipqq_layer,
-                                            'CLEAR_SELECTION')
+            polygons.append(geometry_rings(row[0].__geo_interface__))
+            values.append(1 - row[1] if inverted and row[1] in (0, 1)
+                          else row[1])
+    # 3 is the nodata value of final tiles as in Check_gaps
+    arr = burn_polygons(polygons, values, xmin, ymax, cellsize, nrows, ncols,
+                        3)
+    out_raster = arcpy.NumPyArrayToRaster(arr, arcpy.Point(xmin,
+                                          ymax - nrows * cellsize[1]),
+                                          cellsize[0], cellsize[1], 3)
+    with atomic_output(frtiffile_path) as tmp_path:
+        __save_canopy_raster(out_raster, tmp_path, pixel_type)
+        del out_raster
+        arcpy.DefineProjection_management(tmp_path, spatref)
+    return frtiffile_path
 
+@__timed
+def clip_final_tiles(config):
+    '''
+    This function clips final TIFF files. Regions are processed
+    concurrently by num_threads threads.
+    '''
+    plan = plan_work(config, adopt=True)
+
+    def clip_region(context, region):
+        print(region.name)
+        if len(region.outputs) == 0:
+            return
+        for filename in region.stage('clip').work:
+            __clip_final_tile(context, config, region.name, filename,
+                              region.oids[filename], plan.journal,
+                              region.inversion_applied('fr%s.tif' %
+                                                       filename))
+
+    list(run_concurrently(clip_region, plan.regions, __stage_env(config),
+                          config.num_threads))
+
+    __report_result_cache(config)
     print('Completed')
 
+def __clip_final_tile(context, config, name, filename, oid, journal,
+                      inverted=False):
+    # Clips one final tile to its NAIP QQ polygon. A private layer view of
+    # the execution context is used instead of selecting the feature in the
+    # shared naipqq layer. inverted is whether the final tile was inverted
+    # and is recorded for the clipped tile.
+    outdir_path = '%s/%s/Outputs' % (config.results_path, name)
+    frtiffile_path = '%s/fr%s.tif' % (outdir_path, filename)
+    cfrtiffile_path = '%s/cfr%s.tif' % (outdir_path, filename)
+    naipqq_view = context.view(config.naipqq_layer,
+                               context.oid_where(config.naipqq_layer, [oid]))
+    key = None
+    if result_cache(config) is not None:
+        # the QQ polygon is identified by its geometry
+        with arcpy.da.SearchCursor(naipqq_view, ['SHAPE@WKB']) as cur:
+            qq = hashlib.sha1(bytes(next(cur)[0])).hexdigest()
+        key = __result_key(config, 'clip', [frtiffile_path], qq=qq)
+    if __fetch_result(config, key, cfrtiffile_path):
+        journal.record('clip', cfrtiffile_path, inverted=inverted,
+                       cached=True)
+        return cfrtiffile_path
+    with atomic_output(cfrtiffile_path) as tmp_path:
+        out_raster = arcpy.sa.ExtractByMask(frtiffile_path, naipqq_view)
+        __save_canopy_raster(out_raster, tmp_path,
+                             check_pixel_type(config.bit_depth))
+        del out_raster
+    __store_result(config, key, cfrtiffile_path)
+    journal.record('clip', cfrtiffile_path, inverted=inverted)
+    return cfrtiffile_path
+
 @__timed
 def mosaic_clipped_final_tiles(config):
     '''
     This function mosaics clipped final TIFF files and clips mosaicked files
-    to physiographic regions.
+    to physiographic regions. Regions are processed concurrently by
+    num_threads threads.
     '''
-    phyregs_layer = config.phyregs_layer
-    naipqq_layer = config.naipqq_layer
-    naipqq_phyregs_field = config.naipqq_phyregs_field
+    plan = plan_work(config, adopt=True)
+
+    def mosaic_region(context, region):
+        print(region.name)
+        if len(region.outputs) == 0:
+            return
+        if region.name not in region.stage('mosaic').work:
+            return
+        __mosaic_region(context, config, region, plan.journal)
+
+    list(run_concurrently(mosaic_region, plan.regions, __stage_env(config),
+                          config.num_threads))
+
+    print('Completed')
+
+def __mosaic_region(context, config, region, journal):
+    # Mosaics the clipped final tiles of a region and clips the mosaic to
+    # the region using a private layer of the region polygon
     analysis_year = config.analysis_year
-    results_path = config.results_path
-    snaprast_path = config.snaprast_path
+    name = region.name
+    if name in region.stage('mosaic').missing:
+        raise ValueError('%s: No clipped final tiles to mosaic' % name)
+    outdir_path = region.outputs_path
+    canopytif_path = '%s/canopy_%d_%s.tif' % (outdir_path,
+        analysis_year, name)
+    mosaictif_filename = 'mosaic_%d_%s.tif' % (analysis_year, name)
+    mosaictif_path = '%s/%s' % (outdir_path, mosaictif_filename)
+    if mosaictif_filename not in region.complete_outputs or \
+            name in region.stage('mosaic').stale:
+        input_rasters = ';'.join(["'%s/cfr%s.tif'" % (outdir_path, x[1])
+                                  for x in region.tiles
+                                  if 'cfr%s.tif' % x[1] in
+                                  region.complete_outputs])
+        with atomic_output(mosaictif_path) as tmp_path:
+            arcpy.MosaicToNewRaster_management(input_rasters,
+                outdir_path, os.path.basename(tmp_path),
+                pixel_type=check_pixel_type(config.bit_depth),
+                number_of_bands=1)
+        journal.record('mosaic', mosaictif_path)
+    phyreg_view = context.view(config.phyregs_layer,
+                               'PHYSIO_ID=%d' % region.phyreg_id)
+    with atomic_output(canopytif_path) as tmp_path:
+        canopytif_raster = arcpy.sa.ExtractByMask(mosaictif_path,
+                phyreg_view)
+        __save_canopy_raster(canopytif_raster, tmp_path,
+                             check_pixel_type(config.bit_depth))
+        del canopytif_raster
+    # the canopy TIFF is corrected if all of its tiles were inverted
+    inverted = len(region.tiles) > 0 and all(
+            region.inversion_applied('cfr%s.tif' % x[1])
+            for x in region.tiles)
+    journal.record('mosaic', canopytif_path, inverted=inverted)
+    if inverted:
+        # a corrected_ file of the old layout is now out of date
+        remove_dataset('%s/corrected_%s' % (outdir_path,
+                                            region.canopytif_filename))
+    return canopytif_path
+
+def enqueue_stage(config, stage, queue_path=None):
+    '''
+    This function adds the work units of a stage for the selected
+    physiographic regions to a job queue on the shared file system. Worker
+    processes on any host started with run_worker() then process them. The
+    reproject stage creates one job per tile that reprojects it into the
+    shared tile store and links it into all its regions; the convert and
+    clip stages create one job per tile and region; the mosaic stage creates
+    one job per region. Enqueue a stage only after all the jobs of the
+    previous stage are done.
 
-    arcpy.env.addOutputsToMap = False
-    arcpy.env.snapRaster = snaprast_path
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    stage : str
+        reproject, convert, clip, or mosaic
+    queue_path : str
+        job queue folder (default results_path/canopy_queue)
 
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-            where_clause='PHYSIO_ID in (%s)' % ','.join(map(str,
-                                                    config.phyreg_ids)))
-    with arcpy.da.SearchCursor(phyregs_layer, ['NAME', 'PHYSIO_ID']) as cur:
-        for row in cur:
-            name = row[0]
-            print(name)
-            # CreateRandomPoints cannot create a shapefile with - in its
-            # filename
-            name = name.replace(' ', '_').replace('-', '_')
-            phyreg_id = row[1]
-            outdir_path = '%s/%s/Outputs' % (results_path, name)
-            if len(os.listdir(outdir_path)) == 0:
-                continue
-            canopytif_path = '%s/canopy_%d_%s.tif' % (outdir_path,
-                analysis_year, name)
-            if os.path.exists(canopytif_path):
-                continue
-            mosaictif_filename = 'mosaic_%d_%s.tif' % (analysis_year, name)
-            mosaictif_path = '%s/%s' % (outdir_path, mosaictif_filename)
-            if not os.path.exists(mosaictif_path):
-                arcpy.SelectLayerByAttribute_management(naipqq_layer,
-                        where_clause="%s like '%%,%d,%%'" % (
-                            naipqq_phyregs_field, phyreg_id))
-                input_rasters = ''
-                with arcpy.da.SearchCursor(naipqq_layer,
-                                           ['FileName']) as cur2:
-                    for row2 in sorted(cur2):
-                        filename = row2[0][:-13]
-                        cfrtiffile_path = '%s/cfr%s.tif' % (outdir_path,
-                                filename)
-                        if not os.path.exists(cfrtiffile_path):
-                            input_rasters += ''
-                        if input_rasters is not '':
-                            input_rasters += ';'
-                        if os.path.exists(cfrtiffile_path):
-                            input_rasters += "'%s'" % cfrtiffile_path
-                if input_rasters == '':
-                    continue
-                arcpy.MosaicToNewRaster_management(input_rasters,
-                    outdir_path, mosaictif_filename, pixel_type='2_BIT',
-                    number_of_bands=1)
-            arcpy.SelectLayerByAttribute_management(phyregs_layer,
-                    where_clause='PHYSIO_ID=%d' % phyreg_id)
-            canopytif_raster = arcpy.sa.ExtractByMask(mosaictif_path,
-                    phyregs_layer)
-            canopytif_raster.save(canopytif_path)
+    Returns
+    -------
+    int
+        number of enqueued jobs
+    '''
+    if stage not in ('reproject', 'convert', 'clip', 'mosaic'):
+        raise ValueError('%s: Not a queueable stage' % stage)
+    if queue_path is None:
+        queue_path = '%s/canopy_queue' % config.results_path
+    if stage == 'reproject':
+        __create_snaprast(config)
+
+    queue = JobQueue(queue_path)
+    count = 0
+    plan = plan_work(config, adopt=True)
+    for region in plan:
+        if stage == 'reproject':
+            __make_region_dirs(region)
+        elif stage == 'convert' and len(region.outputs) > 0:
+            __check_missing_afe(region)
+        if stage == 'mosaic':
+            if len(region.outputs) > 0 and \
+                    region.name in region.stage('mosaic').work:
+                queue.put(stage, region.name, name=region.name,
+                          phyreg_id=region.phyreg_id)
+                count += 1
+            continue
+        if stage == 'reproject':
+            continue
+        for filename in region.stage(stage).work:
+            # convert jobs invert tiles of inverted regions; clip jobs record
+            # whether their final tile was inverted
+            if stage == 'clip':
+                inverted = region.inversion_applied('fr%s.tif' % filename)
+            else:
+                inverted = region.inverted
+            queue.put(stage, '%s/%s' % (region.name, filename),
+                      name=region.name, phyreg_id=region.phyreg_id,
+                      filename=filename, oid=region.oids[filename],
+                      inverted=inverted)
+            count += 1
+    if stage == 'reproject':
+        for filename, regions in plan.reproject_units().items():
+            queue.put(stage, filename, filename=filename,
+                      names=[x.name for x in regions],
+                      stored=plan.stored(filename))
+            count += 1
+
+    print('Enqueued %d jobs' % count)
+    return count
+
+def run_worker(config, stages=None, queue_path=None, wait=True):
+    '''
+    This function runs a worker that claims and processes jobs from the job
+    queue until it is drained. Any number of workers can run on any number
+    of hosts that share the results folder. Each worker writes its own
+    journal file. The phyregs_layer and naipqq_layer settings must be paths
+    to feature classes when workers run outside ArcGIS.
 
-    # clear selection
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-                                            'CLEAR_SELECTION')
-    arcpy.SelectLayerByAttribute_management(naipqq_layer,
-                                            'CLEAR_SELECTION')
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    stages : list
+        stages to process (default all)
+    queue_path : str
+        job queue folder (default results_path/canopy_queue)
+    wait : bool
+        whether to keep waiting while other workers are running jobs whose
+        leases may expire
 
-    print('Completed')
+    Returns
+    -------
+    int
+        number of jobs completed by this worker
+    '''
+    if queue_path is None:
+        queue_path = '%s/canopy_queue' % config.results_path
+    worker = worker_name()
+    journal = Journal(config.results_path, worker)
+    context = ExecutionContext(__stage_env(config), worker)
+
+    def handler(job):
+        return __run_stage_job(context, config, journal, job['stage'],
+                               job['params'])
+
+    with context:
+        return JobQueue(queue_path).work(handler, worker, stages, wait)
+
+def __run_stage_job(context, config, journal, stage, params):
+    # Processes one work unit of a stage with the parameters of a job queue
+    # job and returns the path of its output
+    name = params.get('name')
+    if stage == 'reproject':
+        filename = params['filename']
+        if not params.get('stored', False):
+            __reproject_naip_tile(config, filename, journal)
+        for name in params['names']:
+            __link_naip_tile(config, name, filename, journal)
+        return filename
+    elif stage == 'convert':
+        filename = params['filename']
+        outdir_path = '%s/%s/Outputs' % (config.results_path, name)
+        rshpfile_path = '%s/r%s.shp' % (outdir_path, filename)
+        inverted = params.get('inverted', False)
+        if not os.path.exists(rshpfile_path):
+            return __reclassify_afe_tile(config, name, filename, journal,
+                                         inverted)
+        frtiffile_path = next(rasterize_afe_tiles(config,
+            [(rshpfile_path, '%s/fr%s.tif' % (outdir_path, filename),
+              '%s/%s/Inputs/r%s.tif' % (config.results_path, name,
+                                        filename), inverted)]))
+        journal.record('convert', frtiffile_path, inverted=inverted)
+        return frtiffile_path
+    elif stage == 'clip':
+        return __clip_final_tile(context, config, name, params['filename'],
+                                 params['oid'], journal,
+                                 params.get('inverted', False))
+    elif stage == 'mosaic':
+        region = plan_work(config, [params['phyreg_id']]).regions[0]
+        if region.name in region.stage('mosaic').done:
+            # the canopy TIFF is up to date
+            return None
+        return __mosaic_region(context, config, region, journal)
+    raise ValueError('%s: Not a queueable stage' % stage)
+
+def warm_up(config):
+    '''
+    This function loads what the jobs of a long-lived worker process reuse,
+    i.e., the descriptions of phyregs_layer and naipqq_layer and the grid of
+    the snap raster, so that the first job does not pay for them.
+
+    Returns
+    -------
+    dict
+        seconds spent on each item
+    '''
+    timings = {}
+    for layer in ('phyregs_layer', 'naipqq_layer'):
+        start = time.time()
+        arcpy.Describe(getattr(config, layer))
+        timings[layer] = time.time() - start
+    if os.path.exists(config.snaprast_path):
+        start = time.time()
+        __snap_grid_info(config)
+        timings['snaprast_path'] = time.time() - start
+    return timings
+
+def run_job(config, job):
+    '''
+    This function runs one job of the worker service (canopy.service) in
+    this process. A job is a dictionary of either
+
+        function : name of a public function of this module that takes the
+            configuration as its first argument
+        args, kwargs : its other arguments
+        regions : physiographic region IDs to select with Config.regions()
+
+    or
+
+        stage : reproject, convert, clip, or mosaic
+        phyreg_id : physiographic region ID
+        filename : NAIP tile to process even if its output is up to date;
+            all the work units of the stage in the region if not given
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    job : dict
+        job specification
+
+    Returns
+    -------
+    object
+        return value of the function or list of outputs of the stage; the
+        output of a mosaic job is None if the canopy TIFF is up to date
+    '''
+    if 'function' in job:
+        if 'regions' in job:
+            config.regions(job['regions'])
+        func = globals().get(job['function'])
+        if job['function'].startswith('_') or \
+                getattr(func, '__module__', None) != __name__ or \
+                job['function'] in ('run_job', 'run_worker'):
+            raise ValueError('%s: Not a function of canopy' %
+                             job['function'])
+        return func(config, *job.get('args', ()), **job.get('kwargs', {}))
+
+    stage = job['stage']
+    if stage not in ('reproject', 'convert', 'clip', 'mosaic'):
+        raise ValueError('%s: Not a queueable stage' % stage)
+    if stage == 'reproject':
+        __create_snaprast(config)
+    plan = plan_work(config, [job['phyreg_id']], adopt=True)
+    if not plan.regions:
+        raise ValueError('%s: No such physiographic region' %
+                         job['phyreg_id'])
+    region = plan.regions[0]
+    journal = Journal(config.results_path, worker_name())
+    with ExecutionContext(__stage_env(config), 'job') as context:
+        if stage == 'mosaic':
+            return [__run_stage_job(context, config, journal, stage,
+                                    {'phyreg_id': region.phyreg_id})]
+        filename = job.get('filename')
+        if filename is not None and filename not in region.oids:
+            raise ValueError('%s: Not a tile of %s' % (filename,
+                                                       region.name))
+        outputs = []
+        for filename in [filename] if filename else \
+                region.stage(stage).work:
+            params = {'name': region.name, 'phyreg_id': region.phyreg_id,
+                      'filename': filename, 'oid': region.oids[filename]}
+            if stage == 'reproject':
+                __make_region_dirs(region)
+                params.update(names=[region.name],
+                              stored=plan.stored(filename))
+            elif stage == 'clip':
+                params['inverted'] = region.inversion_applied('fr%s.tif' %
+                                                              filename)
+            else:
+                params['inverted'] = region.inverted
+            outputs.append(__run_stage_job(context, config, journal, stage,
+                                           params))
+        return outputs
 
 @__timed
 def convert_afe_to_canopy_tif(config):
@@ -458,62 +1395,791 @@ def convert_afe_to_canopy_tif(config):
     mosaic_clipped_final_tiles(config)
 
 @__timed
-def correct_inverted_canopy_tif(config, inverted_phyreg_ids):
+def correct_inverted_canopy_tif(config, inverted_phyreg_ids=None):
     '''
     This function corrects the values of mosaikced and clipped regions that
     have been inverted with values canopy 0 and noncanopy 1, and changes
     them to canopy 1 and noncanopy 0.
 
+    convert_afe_to_final_tiles() now inverts the final tiles of regions in
+    inverted_phyreg_ids, so canopy TIFF files mosaicked from them are
+    already correct and skipped. This function is only needed for canopy
+    TIFF files produced before that. Regions are processed concurrently by
+    num_threads threads.
+
     Parameters
     ----------
         config :
             CanoPy configuration object
         inverted_phyreg_ids : list
-            list of physiographic region IDs to process
+            list of physiographic region IDs to process (default
+            config.inverted_phyreg_ids)
     '''
-    phyregs_layer = config.phyregs_layer
+    if inverted_phyreg_ids is None:
+        inverted_phyreg_ids = config.inverted_phyreg_ids
     analysis_year = config.analysis_year
     results_path = config.results_path
-    snaprast_path = config.snaprast_path
 
-    arcpy.env.addOutputsToMap = False
-    arcpy.env.snapRaster = snaprast_path
+    journal = Journal(results_path)
 
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-            where_clause='PHYSIO_ID in (%s)' % ','.join(
-                map(str, inverted_phyreg_ids)))
-    with arcpy.da.SearchCursor(phyregs_layer, ['NAME', 'PHYSIO_ID']) as cur:
-        for row in cur:
-            name = row[0]
-            print(name)
-            name = name.replace(' ', '_').replace('-', '_')
-            # phyreg_id = row[1]
-            outdir_path = '%s/%s/Outputs' % (results_path, name)
-            if not os.path.exists(outdir_path):
+    def correct_region(context, region):
+        phyreg_id, name = region
+        print(name)
+        outdir_path = '%s/%s/Outputs' % (results_path, name)
+        if not os.path.exists(outdir_path):
+            return
+        canopytif_path = '%s/canopy_%d_%s.tif' % (outdir_path,
+                analysis_year, name)
+        # name of corrected regions just add corrected_ as prefix
+        corrected_path = '%s/corrected_canopy_%d_%s.tif' % (
+            outdir_path, analysis_year, name)
+        if not os.path.exists(canopytif_path):
+            return
+        if os.path.exists(corrected_path):
+            return
+        if (journal.get(canopytif_path) or {}).get('inverted', False):
+            print('Already corrected during conversion')
+            return
+        # switch 1 and 0
+        corrected = 1 - arcpy.Raster(canopytif_path)
+        # copy raster is used as arcpy.save does not give bit options.
+        with atomic_output(corrected_path) as tmp_path:
+            __save_canopy_raster(corrected, tmp_path,
+                    check_pixel_type(config.bit_depth))
+        journal.record('correct', corrected_path)
+
+    with ExecutionContext(name='regions') as context:
+        regions = __region_names(context, config, inverted_phyreg_ids)
+    list(run_concurrently(correct_region, regions, __stage_env(config),
+                          config.num_threads))
+
+    print('Completed')
+
+def detect_inverted_regions(config, phyreg_ids=None, nlcd=None,
+                            expected_fraction=None, num_windows=64,
+                            window_size=8, seed=None, update=False,
+                            min_confidence=0.95,
+                            forest_classes=(41, 42, 43, 90)):
+    '''
+    This function detects regions whose trained model produced an inverted
+    result by sampling num_windows small windows of cells per region from
+    the cfr tiles, or the canopy TIFF if no cfr tiles exist. Each tile is
+    opened only once and only the windows are read, so a region takes
+    seconds.
+
+    If an NLCD raster is given, each window is compared with the NLCD cell
+    at its center, where forest classes are expected to be canopy.
+    Otherwise, the canopy fraction is compared with expected_fraction. A
+    region is likely inverted if it agrees with the reference in less than
+    half of the cells. The confidence of each decision accounts for the
+    number of windows sampled.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    phyreg_ids : list
+        list of physiographic region IDs to check (default config.phyreg_ids)
+    nlcd : str
+        path to an NLCD land cover raster
+    expected_fraction : float
+        expected canopy fraction of regions if nlcd is not given, e.g., 0.65
+    num_windows : int
+        number of windows per region
+    window_size : int
+        window size in cells
+    seed : int
+        seed for reproducible samples
+    update : bool
+        whether to write the result to inverted_phyreg_ids in the
+        configuration file
+    min_confidence : float
+        minimum confidence to change inverted_phyreg_ids
+    forest_classes : tuple
+        NLCD classes expected to be canopy
+
+    Returns
+    -------
+    list
+        dictionaries of phyreg_id, name, canopy_fraction, agreement,
+        inverted, and confidence per region
+    '''
+    if nlcd is None and expected_fraction is None:
+        raise ValueError('nlcd or expected_fraction is required')
+    if nlcd is None and expected_fraction == 0.5:
+        raise ValueError('expected_fraction of 0.5 cannot detect inversions')
+
+    plan = plan_work(config, phyreg_ids)
+    nlcd_ras = None if nlcd is None else arcpy.Raster(nlcd)
+    results = []
+    for region in plan:
+        sources = ['cfr%s.tif' % x[1] for x in region.tiles
+                   if 'cfr%s.tif' % x[1] in region.outputs]
+        if not sources and region.canopytif_filename in region.outputs:
+            sources = [region.canopytif_filename]
+        # sources inverted during conversion are flipped back, so the raw
+        # model output is checked
+        flipped = [region.inversion_applied(x) for x in sources]
+        sources = ['%s/%s' % (region.outputs_path, x) for x in sources]
+        if not sources:
+            print('%s: no cfr tiles or canopy TIFF' % region.name)
+            continue
+        rng = np.random.default_rng(None if seed is None else
+                                    [seed, region.phyreg_id])
+        picks = rng.integers(0, len(sources), num_windows)
+
+        # canopy fraction, number of valid cells, and center of each window
+        fractions = []
+        cells = []
+        centers = []
+        for i in np.unique(picks):
+            ras = arcpy.Raster(sources[i])
+            ext = ras.extent
+            w = ras.meanCellWidth
+            h = ras.meanCellHeight
+            count = (picks == i).sum()
+            rows = rng.integers(0, max(1, ras.height - window_size + 1),
+                                count)
+            cols = rng.integers(0, max(1, ras.width - window_size + 1),
+                                count)
+            for row, col in zip(rows, cols):
+                # window centered on the center of its middle cell
+                x = ext.XMin + (col + window_size // 2 + 0.5) * w
+                y = ext.YMax - (row + window_size // 2 + 0.5) * h
+                arr = __read_window(ras, x, y, window_size, 3)[0][0]
+                valid = arr <= 1
+                fraction = arr[valid].mean() if valid.any() else 0.
+                cells.append(valid.sum())
+                fractions.append(1 - fraction if flipped[i] else fraction)
+                centers.append((x, y))
+        fractions = np.array(fractions)
+        cells = np.array(cells)
+        canopy_fraction = ((fractions * cells).sum() / cells.sum()
+                           if cells.sum() else np.nan)
+
+        if nlcd_ras is None:
+            # agreement with the class expected to be the majority
+            agreement = fractions if expected_fraction > 0.5 \
+                    else 1 - fractions
+        else:
+            forest = np.isin(__nlcd_values(nlcd_ras, centers,
+                                           config.spatref_wkid),
+                             forest_classes)
+            agreement = np.where(forest, fractions, 1 - fractions)
+        agreement, inverted, confidence = inversion_confidence(agreement,
+                                                               cells)
+        print('%s: canopy fraction=%.3f, agreement=%.3f, %s (confidence '
+              '%.3f)' % (region.name, canopy_fraction, agreement,
+                         'inverted' if inverted else 'not inverted',
+                         confidence))
+        results.append({'phyreg_id': region.phyreg_id, 'name': region.name,
+                        'canopy_fraction': canopy_fraction,
+                        'agreement': agreement, 'inverted': inverted,
+                        'confidence': confidence})
+
+    if update:
+        inverted_phyreg_ids = set(config.inverted_phyreg_ids)
+        for result in results:
+            if result['confidence'] < min_confidence:
+                continue
+            if result['inverted']:
+                inverted_phyreg_ids.add(result['phyreg_id'])
+            else:
+                inverted_phyreg_ids.discard(result['phyreg_id'])
+        config.update_config(inverted_phyreg_ids=', '.join(
+                map(str, sorted(inverted_phyreg_ids))))
+        print('inverted_phyreg_ids = %s' %
+              ', '.join(map(str, config.inverted_phyreg_ids)))
+
+    print('Completed')
+    return results
+
+def __nlcd_values(nlcd_ras, centers, spatref_wkid):
+    # Reads the NLCD cells at points given in spatref_wkid
+    if nlcd_ras.spatialReference.factoryCode == spatref_wkid:
+        xy = centers
+    else:
+        points = arcpy.Array([arcpy.Point(*p) for p in centers])
+        multipoint = arcpy.Multipoint(points,
+                arcpy.SpatialReference(spatref_wkid)).projectAs(
+                        nlcd_ras.spatialReference)
+        xy = [(p.X, p.Y) for p in multipoint]
+    return np.array([__read_window(nlcd_ras, x, y, 1, 0)[0][0, 0, 0]
+                     for x, y in xy])
+
+def estimate_canopy_cover(config, phyreg_ids=None, zones=None,
+                          zone_field=None, error=0.01, confidence=0.95,
+                          window_size=8, max_windows=5000, seed=None,
+                          csv_path=None):
+    '''
+    This function estimates the canopy cover of physiographic regions or of
+    zones such as counties without reading whole rasters. Small windows of
+    cells are sampled at random, stratified by source raster, until the
+    half-width of the confidence interval is at most error. Only the
+    sampled windows are read, so a region takes about a second.
+
+    A region is sampled from its canopy TIFF or, before mosaicking, from
+    its cfr tiles masked to the region polygon. Zones are sampled from the
+    canopy TIFFs of the selected regions masked to each zone polygon.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    phyreg_ids : list
+        list of physiographic region IDs (default config.phyreg_ids)
+    zones : str
+        polygon feature class of zones, e.g., counties; regions are
+        estimated if None
+    zone_field : str
+        field of zone names
+    error : float
+        target half-width of the confidence intervals, e.g., 0.01 for plus
+        or minus one percentage point
+    confidence : float
+        confidence level of the intervals
+    window_size : int
+        window size in cells
+    max_windows : int
+        maximum number of windows per region or zone
+    seed : int
+        seed for reproducible estimates
+    csv_path : str
+        path to a CSV file for the results (default no file)
+
+    Returns
+    -------
+    list
+        dictionaries of name, canopy_cover, lower, upper, se, windows,
+        converged, and seconds per region or zone
+    '''
+    spatref = arcpy.SpatialReference(config.spatref_wkid)
+    if phyreg_ids is None:
+        phyreg_ids = config.phyreg_ids
+    plan = plan_work(config, phyreg_ids)
+
+    # (name, seed key, sources, rings) of each region or zone
+    queries = []
+    if zones is None:
+        region_rings = __region_rings(config, phyreg_ids)
+        for region in plan:
+            if region.canopytif_filename in region.outputs:
+                # the canopy TIFF is already masked to the region
+                queries.append((region.name, region.phyreg_id,
+                                ['%s/%s' % (region.outputs_path,
+                                            region.canopytif_filename)],
+                                None))
                 continue
-            canopytif_path = '%s/canopy_%d_%s.tif' % (outdir_path,
-                    analysis_year, name)
-            # name of corrected regions just add corrected_ as prefix
-            corrected_path = '%s/corrected_canopy_%d_%s.tif' % (
-                outdir_path, analysis_year, name)
-            if not os.path.exists(canopytif_path):
+            sources = ['%s/cfr%s.tif' % (region.outputs_path, x[1])
+                       for x in region.tiles
+                       if 'cfr%s.tif' % x[1] in region.outputs]
+            if sources:
+                queries.append((region.name, region.phyreg_id, sources,
+                                region_rings[region.phyreg_id]))
+            else:
+                print('%s: no canopy TIFF or cfr tiles' % region.name)
+    else:
+        canopy_paths = ['%s/%s' % (x.outputs_path, x.canopytif_filename)
+                        for x in plan if x.canopytif_filename in x.outputs]
+        with arcpy.da.SearchCursor(zones, [zone_field, 'SHAPE@'],
+                                   spatial_reference=spatref) as cur:
+            for i, row in enumerate(cur):
+                if row[1] is None:
+                    continue
+                queries.append((str(row[0]), i, canopy_paths,
+                                geometry_rings(row[1].__geo_interface__)))
+
+    rasters = {}
+    results = []
+    for name, key, sources, rings in queries:
+        start_time = time.time()
+        sizes, draw = __window_sampler(sources, rasters, window_size, rings)
+        if sum(sizes) == 0:
+            print('%s: no canopy data' % name)
+            continue
+        result = adaptive_estimate(draw, sizes, error, confidence,
+                max_units=max_windows,
+                seed=None if seed is None else [seed, key])
+        result = {'name': name, 'canopy_cover': result['estimate'],
+                  'lower': result['lower'], 'upper': result['upper'],
+                  'se': result['se'], 'windows': result['units'],
+                  'converged': result['converged'],
+                  'seconds': time.time() - start_time}
+        print('%s: canopy cover=%.2f%% (%.2f%%-%.2f%%), %d windows, '
+              '%.1f s%s' % (name, result['canopy_cover'] * 100,
+                            result['lower'] * 100, result['upper'] * 100,
+                            result['windows'], result['seconds'],
+                            '' if result['converged'] else
+                            ', error bound not met'))
+        results.append(result)
+
+    if csv_path is not None:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, ['name', 'canopy_cover', 'lower',
+                                        'upper', 'se', 'windows',
+                                        'converged', 'seconds'])
+            writer.writeheader()
+            writer.writerows(results)
+    print('Completed')
+    return results
+
+def __region_rings(config, phyreg_ids):
+    # Returns the rings of the selected physiographic regions in
+    # config.spatref_wkid by region ID
+    spatref = arcpy.SpatialReference(config.spatref_wkid)
+    region_rings = {}
+    with ExecutionContext(name='rings') as context, \
+            arcpy.da.SearchCursor(context.view(config.phyregs_layer,
+                'PHYSIO_ID in (%s)' % ','.join(map(str, phyreg_ids))),
+                ['PHYSIO_ID', 'SHAPE@'], spatial_reference=spatref) as cur:
+        for row in cur:
+            region_rings[row[0]] = geometry_rings(row[1].__geo_interface__)
+    return region_rings
+
+def zonal_statistics(config, zone_layers, phyreg_ids=None, block_size=4096,
+                     csv_path=None):
+    '''
+    This function counts the canopy, noncanopy, and nodata cells of each
+    zone of one or more polygon layers, e.g., counties, city limits, and
+    census tracts. It replaces Tabulate Area runs per layer. The canopy
+    TIFF of each region is read once in blocks of block_size cells; the
+    zones of all layers are rasterized onto each block on the snap grid of
+    the canopy TIFF and counted with np.bincount(). Cells outside the
+    region polygon are not counted, so zones that span regions are not
+    counted twice and nodata counts are gaps inside regions.
+
+    Corrected canopy TIFFs are used where convert_canopy_tif_to_shp() would
+    use them.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    zone_layers : list
+        list of (feature class, zone name field) tuples
+    phyreg_ids : list
+        list of physiographic region IDs (default config.phyreg_ids)
+    block_size : int
+        block width and height in cells
+    csv_path : str
+        path to a CSV file for the table (default no file)
+
+    Returns
+    -------
+    list
+        ZoneLayer objects with the counts of each zone
+    '''
+    spatref = arcpy.SpatialReference(config.spatref_wkid)
+    if phyreg_ids is None:
+        phyreg_ids = config.phyreg_ids
+    plan = plan_work(config, phyreg_ids)
+    journal = Journal(config.results_path)
+
+    layers = []
+    for fc, field in zone_layers:
+        polygons = []
+        zone_names = []
+        with arcpy.da.SearchCursor(fc, [field, 'SHAPE@'],
+                                   spatial_reference=spatref) as cur:
+            for row in cur:
+                if row[1] is None:
+                    continue
+                polygons.append(geometry_rings(row[1].__geo_interface__))
+                zone_names.append(str(row[0]))
+        layers.append(ZoneLayer(os.path.splitext(os.path.basename(fc))[0],
+                                polygons, zone_names))
+
+    region_rings = __region_rings(config, phyreg_ids)
+    cell_area = 0.
+    for region in plan:
+        print(region.name)
+        intif_path = __canopy_source(region.outputs_path,
+                                     config.analysis_year, region.name,
+                                     journal)
+        if intif_path is None:
+            print('No canopy TIFF')
+            continue
+        ras = arcpy.Raster(intif_path)
+        ext = ras.extent
+        cellsize = (ras.meanCellWidth, ras.meanCellHeight)
+        cell_area = cellsize[0] * cellsize[1]
+        for row, col, nrows, ncols in raster_blocks(ras.height, ras.width,
+                                                    block_size):
+            arr = __read_block(ras, row, col, nrows, ncols, 3)
+            xmin = ext.XMin + col * cellsize[0]
+            ymax = ext.YMax - row * cellsize[1]
+            inside = burn_polygons([region_rings[region.phyreg_id]], [1],
+                                   xmin, ymax, cellsize, nrows, ncols, 0,
+                                   bool)
+            if not inside.any():
                 continue
-            if os.path.exists(corrected_path):
+            for layer in layers:
+                layer.accumulate(arr, xmin, ymax, cellsize, inside)
+        del ras
+
+    for layer in layers:
+        cover = layer.canopy_cover()
+        print('%s: %d zones, %d with canopy data' % (layer.name,
+              len(layer.zone_names), (~np.isnan(cover[1:])).sum()))
+    if csv_path is not None:
+        write_zonal_table(csv_path, layers, cell_area)
+    print('Completed')
+    return layers
+
+def __read_block(ras, row, col, nrows, ncols, fill):
+    # Reads a block of cells from an open single-band raster; cells outside
+    # the raster, e.g., in the halo of an edge block, get fill
+    ext = ras.extent
+    w = ras.meanCellWidth
+    h = ras.meanCellHeight
+    out = np.full((nrows, ncols), fill, dtype=np.uint8)
+    r0 = max(row, 0)
+    r1 = min(row + nrows, ras.height)
+    c0 = max(col, 0)
+    c1 = min(col + ncols, ras.width)
+    if r1 > r0 and c1 > c0:
+        out[r0 - row:r1 - row, c0 - col:c1 - col] = \
+                arcpy.RasterToNumPyArray(ras,
+                        arcpy.Point(ext.XMin + c0 * w, ext.YMax - r1 * h),
+                        c1 - c0, r1 - r0, fill).reshape(r1 - r0, c1 - c0)
+    return out
+
+def __canopy_source(outdir_path, analysis_year, name, journal):
+    # Returns the path to the corrected canopy TIFF of a region unless the
+    # canopy TIFF was produced from inverted tiles, the canopy TIFF, or None
+    # if neither exists
+    canopytif_path = '%s/canopy_%d_%s.tif' % (outdir_path, analysis_year,
+                                              name)
+    corrected_path = '%s/corrected_canopy_%d_%s.tif' % (outdir_path,
+                                                        analysis_year, name)
+    if os.path.exists(corrected_path) and not (journal.get(
+            canopytif_path) or {}).get('inverted', False):
+        return corrected_path
+    if os.path.exists(canopytif_path):
+        return canopytif_path
+    return None
+
+def __window_sampler(sources, rasters, window_size, rings=None):
+    # Returns the number of windows of each source raster that may overlap
+    # the rings and a draw function for adaptive_estimate() that reads
+    # random windows and returns the numbers of canopy and valid cells in
+    # them; cells outside the rings are not valid. rasters caches open
+    # rasters across calls.
+    if rings is not None:
+        coords = np.vstack(rings)
+        bbox = coords.min(axis=0).tolist() + coords.max(axis=0).tolist()
+    frames = []
+    for path in sources:
+        if path not in rasters:
+            rasters[path] = arcpy.Raster(path)
+        ras = rasters[path]
+        ext = ras.extent
+        w = ras.meanCellWidth
+        h = ras.meanCellHeight
+        # window rows and columns of the raster
+        r0, r1 = 0, int(math.ceil(ras.height / window_size))
+        c0, c1 = 0, int(math.ceil(ras.width / window_size))
+        if rings is not None:
+            c0 = max(c0, int((bbox[0] - ext.XMin) // (w * window_size)))
+            c1 = min(c1, int((bbox[2] - ext.XMin) // (w * window_size)) + 1)
+            r0 = max(r0, int((ext.YMax - bbox[3]) // (h * window_size)))
+            r1 = min(r1, int((ext.YMax - bbox[1]) // (h * window_size)) + 1)
+        frames.append((ras, r0, max(r1 - r0, 0), c0, max(c1 - c0, 0)))
+    sizes = [x[2] * x[4] for x in frames]
+    offsets = np.arange(window_size) + 0.5
+
+    def draw(i, n, rng):
+        ras, r0, nrows, c0, ncols = frames[i]
+        ext = ras.extent
+        w = ras.meanCellWidth
+        h = ras.meanCellHeight
+        rows = r0 + rng.integers(0, nrows, n)
+        cols = c0 + rng.integers(0, ncols, n)
+        canopy = np.empty(n, dtype=np.int64)
+        valid_cells = np.empty(n, dtype=np.int64)
+        for j, (row, col) in enumerate(zip(rows, cols)):
+            arr, xmin, ymax = __read_window(ras,
+                    ext.XMin + (col * window_size + window_size // 2 + 0.5) *
+                    w,
+                    ext.YMax - (row * window_size + window_size // 2 + 0.5) *
+                    h, window_size, 3)[:3]
+            valid = arr[0] <= 1
+            if rings is not None and valid.any():
+                x, y = np.meshgrid(xmin + offsets * w, ymax - offsets * h)
+                valid &= points_in_polygon(x.ravel(), y.ravel(),
+                                           rings).reshape(valid.shape)
+            canopy[j] = (arr[0][valid] == 1).sum()
+            valid_cells[j] = valid.sum()
+        return canopy, valid_cells
+
+    return sizes, draw
+
+def __write_block(ras, arr, row, col, blocks_path, pixel_type):
+    # Writes a block of a canopy raster as a separate TIFF in blocks_path
+    # and returns its path
+    ext = ras.extent
+    w = ras.meanCellWidth
+    h = ras.meanCellHeight
+    os.makedirs(blocks_path, exist_ok=True)
+    block_path = '%s/block_%d_%d.tif' % (blocks_path, row, col)
+    block = arcpy.NumPyArrayToRaster(arr, arcpy.Point(ext.XMin + col * w,
+            ext.YMax - (row + arr.shape[0]) * h), w, h, 3)
+    __save_canopy_raster(block, block_path, pixel_type)
+    del block
+    arcpy.DefineProjection_management(block_path, ras.spatialReference)
+    return block_path
+
+def __patch_raster(intif_path, outtif_path, block_paths, blocks_path,
+                   pixel_type):
+    # Writes a copy of a canopy raster with changed blocks mosaicked over it
+    # and removes the blocks; outtif_path may be intif_path, which is then
+    # replaced only when the patched copy is complete
+    with atomic_output(outtif_path) as tmp_path:
+        __save_canopy_raster(intif_path, tmp_path, pixel_type)
+        if block_paths:
+            arcpy.Mosaic_management(block_paths, tmp_path, 'LAST')
+    for block_path in block_paths:
+        remove_dataset(block_path)
+    if os.path.exists(blocks_path):
+        os.rmdir(blocks_path)
+
+def fill_canopy_gaps(config, phyreg_ids=None, max_distance=16,
+                     block_size=4096, csv_path=None):
+    '''
+    This function fills nodata gaps inside the regions of canopy TIFF
+    files, e.g., seams left between mosaicked tiles, where Check_gaps only
+    reports them. Nodata cells whose centers are inside the region polygon
+    are gaps; nodata outside the region is kept. Gaps are filled with the
+    majority class of their valid neighbors and wider gaps from their
+    edges inward with the nearest valid classes up to max_distance cells
+    from valid data. Farther cells, e.g., missing imagery, stay nodata and
+    are reported as unfilled.
+
+    Each canopy TIFF is read once in blocks with a halo of max_distance
+    cells, and only blocks with gaps are written over a copy that replaces
+    the canopy TIFF. Filled canopy TIFFs are recorded in the journal and
+    skipped later. Regions are processed concurrently by num_threads
+    threads.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    phyreg_ids : list
+        list of physiographic region IDs (default config.phyreg_ids)
+    max_distance : int
+        maximum distance in cells from valid data up to which gaps are
+        filled
+    block_size : int
+        block width and height in cells
+    csv_path : str
+        path to a CSV file for the report (default no file)
+
+    Returns
+    -------
+    list
+        dictionaries of name, gap_cells, filled_cells, and unfilled_cells
+        per region
+    '''
+    if phyreg_ids is None:
+        phyreg_ids = config.phyreg_ids
+    plan = plan_work(config, phyreg_ids)
+    journal = Journal(config.results_path)
+    pixel_type = check_pixel_type(config.bit_depth)
+
+    region_rings = __region_rings(config, phyreg_ids)
+
+    def fill_region(context, region):
+        print(region.name)
+        canopytif_path = '%s/%s' % (region.outputs_path,
+                                    region.canopytif_filename)
+        if region.canopytif_filename not in region.outputs:
+            print('No canopy TIFF')
+            return None
+        entry = journal.get(canopytif_path) or {}
+        if entry.get('stage') == 'fill' and journal.is_complete(
+                canopytif_path, os.path.getsize(canopytif_path)):
+            print('Gaps already filled')
+            result = dict((k, entry[k]) for k in ('gap_cells',
+                          'filled_cells', 'unfilled_cells'))
+            result['name'] = region.name
+            return result
+
+        ras = arcpy.Raster(canopytif_path)
+        ext = ras.extent
+        cellsize = (ras.meanCellWidth, ras.meanCellHeight)
+        blocks_path = '%s_blocks' % os.path.splitext(canopytif_path)[0]
+        block_paths = []
+        counts = [0, 0]
+        for row, col, nrows, ncols in raster_blocks(ras.height, ras.width,
+                                                    block_size):
+            arr = __read_block(ras, row - max_distance, col - max_distance,
+                               nrows + 2 * max_distance,
+                               ncols + 2 * max_distance, 3)
+            inside = burn_polygons([region_rings[region.phyreg_id]], [1],
+                                   ext.XMin + (col - max_distance) *
+                                   cellsize[0],
+                                   ext.YMax - (row - max_distance) *
+                                   cellsize[1], cellsize, *arr.shape, 0,
+                                   bool)
+            core = (slice(max_distance, max_distance + nrows),
+                    slice(max_distance, max_distance + ncols))
+            if not (inside[core] & (arr[core] > 1)).any():
                 continue
-            if not os.path.exists(corrected_path):
-                # switch 1 and 0
-                corrected = 1 - arcpy.Raster(canopytif_path)
-                # copy raster is used as arcpy.save does not give bit
-                # options.
-                arcpy.CopyRaster_management(corrected, corrected_path,
-                                            nodata_value='3',
-                                            pixel_type='2_BIT')
-
-    # clear selection
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-                                            'CLEAR_SELECTION')
+            out, gaps, unfilled = fill_gaps(arr, inside, max_distance)
+            counts[0] += gaps[core].sum()
+            counts[1] += unfilled[core].sum()
+            if (gaps[core] & ~unfilled[core]).any():
+                block_paths.append(__write_block(ras, out[core], row, col,
+                                                 blocks_path, pixel_type))
+        del ras
+
+        result = {'gap_cells': int(counts[0]),
+                  'filled_cells': int(counts[0] - counts[1]),
+                  'unfilled_cells': int(counts[1])}
+        if block_paths:
+            __patch_raster(canopytif_path, canopytif_path, block_paths,
+                           blocks_path, pixel_type)
+        # keep the inversion flag of the mosaic for the planner
+        journal.record('fill', canopytif_path,
+                       inverted=entry.get('inverted', False), **result)
+        print('%d gap cells, %d filled, %d unfilled' % (
+              result['gap_cells'], result['filled_cells'],
+              result['unfilled_cells']))
+        result['name'] = region.name
+        return result
+
+    report = [x for x in run_concurrently(fill_region, plan.regions,
+                                          __stage_env(config),
+                                          config.num_threads)
+              if x is not None]
+
+    if csv_path is not None:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, ['name', 'gap_cells', 'filled_cells',
+                                        'unfilled_cells'])
+            writer.writeheader()
+            writer.writerows(report)
+    print('Completed')
+    return report
+
+@__timed
+def clean_canopy_tif(config, block_size=4096):
+    '''
+    This function cleans the canopy TIFF files of the selected regions
+    before polygonization with the majority filter, minimum mapping unit
+    sieve, and small-hole fill configured by cleanup_majority_size,
+    cleanup_min_cells, and cleanup_max_hole_cells. Each block is read with
+    a halo wide enough that the result does not depend on block
+    boundaries. Only blocks that change are written over a copy of the
+    canopy TIFF. The cleaned TIFF is saved with cleaned_ as prefix and
+    convert_canopy_tif_to_shp() uses it. It also runs this stage for
+    regions without an up-to-date cleaned TIFF, so calling this function
+    first is only needed to review the cleanup. Regions are processed
+    concurrently by num_threads threads.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    block_size : int
+        block width and height in cells
+
+    Returns
+    -------
+    dict
+        region name => (changed cells, valid cells)
+    '''
+    analysis_year = config.analysis_year
+    results_path = config.results_path
+
+    if not __cleanup_params(config):
+        print('Cleanup is disabled')
+        return {}
+
+    journal = Journal(results_path)
+
+    def clean_region(context, region):
+        phyreg_id, name = region
+        print(name)
+        outdir_path = '%s/%s/Outputs' % (results_path, name)
+        intif_path = __canopy_source(outdir_path, analysis_year, name,
+                                     journal)
+        if intif_path is None:
+            return None
+        cleaned_path = __clean_canopy_raster(config, intif_path, journal,
+                                             block_size)
+        entry = journal.get(cleaned_path)
+        return name, (entry['changed'], entry['cells'])
+
+    with ExecutionContext(name='regions') as context:
+        regions = __region_names(context, config, config.phyreg_ids)
+    changes = dict(x for x in run_concurrently(clean_region, regions,
+                                               __stage_env(config),
+                                               config.num_threads)
+                   if x is not None)
 
     print('Completed')
+    return changes
+
+def __cleanup_params(config):
+    # Returns the cleanup parameters or None if the cleanup is disabled
+    params = {'majority_size': config.cleanup_majority_size,
+              'min_cells': config.cleanup_min_cells,
+              'max_hole_cells': config.cleanup_max_hole_cells}
+    if not (params['majority_size'] > 1 or params['min_cells'] > 1 or
+            params['max_hole_cells'] > 0):
+        return None
+    return params
+
+def __clean_canopy_raster(config, intif_path, journal, block_size=4096):
+    # Cleans a canopy TIFF block by block and returns the path to the
+    # cleaned TIFF; an existing cleaned TIFF is reused if it was made from
+    # the same version of the input with the same parameters
+    params = __cleanup_params(config)
+    cleaned_path = '%s/cleaned_%s' % (os.path.dirname(intif_path),
+                                      os.path.basename(intif_path))
+    source_mtime = os.path.getmtime(intif_path)
+    entry = journal.get(cleaned_path) or {}
+    if (os.path.exists(cleaned_path) and entry.get('source') == intif_path
+            and entry.get('source_mtime') == source_mtime
+            and entry.get('params') == params):
+        print('%s: %d of %d cells changed (done)' % (
+              os.path.basename(cleaned_path), entry['changed'],
+              entry['cells']))
+        return cleaned_path
+
+    halo = cleanup_halo(**params)
+    pixel_type = check_pixel_type(config.bit_depth)
+    ras = arcpy.Raster(intif_path)
+    blocks_path = '%s_blocks' % os.path.splitext(cleaned_path)[0]
+    block_paths = []
+    changed = 0
+    cells = 0
+    for row, col, nrows, ncols in raster_blocks(ras.height, ras.width,
+                                                block_size):
+        arr = __read_block(ras, row - halo, col - halo, nrows + 2 * halo,
+                           ncols + 2 * halo, 3)
+        core = arr[halo:halo + nrows, halo:halo + ncols]
+        cells += (core <= 1).sum()
+        out = clean_canopy(arr, **params)[halo:halo + nrows,
+                                          halo:halo + ncols]
+        num_changed = (out != core).sum()
+        if num_changed == 0:
+            continue
+        changed += num_changed
+        block_paths.append(__write_block(ras, out, row, col, blocks_path,
+                                         pixel_type))
+    del ras
+
+    __patch_raster(intif_path, cleaned_path, block_paths, blocks_path,
+                   pixel_type)
+    journal.record('clean', cleaned_path, source=intif_path,
+                   source_mtime=source_mtime, params=params,
+                   changed=int(changed), cells=int(cells))
+    print('%s: %d of %d cells changed' % (os.path.basename(cleaned_path),
+                                          changed, cells))
+    return cleaned_path
 
 @__timed
 def convert_canopy_tif_to_shp(config):
@@ -522,69 +2188,66 @@ def convert_canopy_tif_to_shp(config):
     has been corrected for inverted values the function will convert the
     corrected TIFF to shapefile instead of the original canopy TIFF. If no
     corrected TIFF exists for a region then the original canopy TIFF will be
-    converted.
+    converted. If a cleanup is configured, the TIFF is cleaned first by
+    clean_canopy_tif() and the cleaned TIFF is converted. Regions are
+    processed concurrently by num_threads threads.
     '''
-    phyregs_layer = config.phyregs_layer
     analysis_year = config.analysis_year
-    snaprast_path = config.snaprast_path
     results_path = config.results_path
 
-    arcpy.env.addOutputsToMap = False
-    arcpy.env.snapRaster = snaprast_path
-
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-            where_clause='PHYSIO_ID in (%s)' % ','.join(
-                map(str, config.phyreg_ids)))
-    with arcpy.da.SearchCursor(phyregs_layer, ['NAME', 'PHYSIO_ID']) as cur:
-        for row in cur:
-            name = row[0]
-            print(name)
-            name = name.replace(' ', '_').replace('-', '_')
-            # phyreg_id = row[1]
-            outdir_path = '%s/%s/Outputs' % (results_path, name)
-            if not os.path.exists(outdir_path):
-                continue
-            canopytif_path = '%s/canopy_%d_%s.tif' % (outdir_path,
-                                                      analysis_year, name)
-            corrected_path = '%s/corrected_canopy_%d_%s.tif' % (
-                outdir_path, analysis_year, name)
-            # Add shp_ as prefix to output shapefile
-            canopyshp_path = '%s/shp_canopy_%d_%s.shp' % (
-                outdir_path, analysis_year, name)
-            if os.path.exists(canopyshp_path):
-                continue
-            if not os.path.exists(canopyshp_path):
-                # Check for corrected inverted TIFF first
-                if os.path.exists(corrected_path):
-                    # Do not simplify polygons, keep cell extents
-                    arcpy.RasterToPolygon_conversion(corrected_path,
-                            canopyshp_path, 'NO_SIMPLIFY', 'Value')
-                # If no corrected inverted TIFF use orginial canopy TIFF
-                elif os.path.exists(canopytif_path):
-                    # Do not simplify polygons, keep cell extents
-                    arcpy.RasterToPolygon_conversion(canopytif_path,
-                            canopyshp_path, 'NO_SIMPLIFY', 'Value')
-                # Add 'Canopy' field
-                arcpy.AddField_management(canopyshp_path, 'Canopy', 'SHORT',
-                                          field_length='1')
-                # Calculate 'Canopy' field
-                arcpy.CalculateField_management(canopyshp_path, 'Canopy',
-                                                '!gridcode!')
-                # Remove Id and gridcode fields
-                arcpy.DeleteField_management(canopyshp_path, ['Id',
-                                                              'gridcode'])
-
-    # clear selection
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-                                            'CLEAR_SELECTION')
+    journal = Journal(results_path)
+
+    def convert_region(context, region):
+        phyreg_id, name = region
+        print(name)
+        outdir_path = '%s/%s/Outputs' % (results_path, name)
+        if not os.path.exists(outdir_path):
+            return
+        # Add shp_ as prefix to output shapefile
+        canopyshp_path = '%s/shp_canopy_%d_%s.shp' % (
+            outdir_path, analysis_year, name)
+        if os.path.exists(canopyshp_path):
+            return
+        # Check for corrected inverted TIFF first unless the canopy TIFF was
+        # produced from inverted tiles; if no corrected inverted TIFF use
+        # orginial canopy TIFF
+        intif_path = __canopy_source(outdir_path, analysis_year, name,
+                                     journal)
+        if intif_path is None:
+            return
+        # Polygonize the cleaned TIFF if a cleanup is configured
+        if __cleanup_params(config):
+            intif_path = __clean_canopy_raster(config, intif_path, journal)
+        with atomic_output(canopyshp_path) as tmp_path:
+            # Do not simplify polygons, keep cell extents
+            arcpy.RasterToPolygon_conversion(intif_path, tmp_path,
+                                             'NO_SIMPLIFY', 'Value')
+            # Add 'Canopy' field
+            arcpy.AddField_management(tmp_path, 'Canopy', 'SHORT',
+                                      field_length='1')
+            # Calculate 'Canopy' field
+            arcpy.CalculateField_management(tmp_path, 'Canopy',
+                                            '!gridcode!')
+            # Remove Id and gridcode fields
+            arcpy.DeleteField_management(tmp_path, ['Id', 'gridcode'])
+        journal.record('polygonize', canopyshp_path)
+
+    with ExecutionContext(name='regions') as context:
+        regions = __region_names(context, config, config.phyreg_ids)
+    list(run_concurrently(convert_region, regions, __stage_env(config),
+                          config.num_threads))
 
     print('Completed')
 
 def generate_gtpoints(config, phyreg_ids, min_area_sqkm, max_area_sqkm,
-                      min_points, max_points):
+                      min_points, max_points, seed=None, stratify=None):
     '''
     This function generates randomized points for ground truthing. It create
-    the GT field in the output shapefile.
+    the GT field in the output shapefile. Points are sampled inside each
+    physiographic region with vectorized rejection sampling and assigned to
+    NAIP tiles arithmetically using the NAIP QQ grid, so no temporary
+    shapefile or spatial join is needed. The output shapefile is written in
+    one pass.
 
     Parameters
     ----------
@@ -600,6 +2263,12 @@ def generate_gtpoints(config, phyreg_ids, min_area_sqkm, max_area_sqkm,
         minimum number of points allowed
     max_points : int
         maximum number of points allowed
+    seed : int
+        seed for reproducible points; each region combines it with its
+        physiographic region ID
+    stratify : str
+        None for simple random sampling, 'canopy' to sample canopy and
+        non-canopy points equally, or 'tile' to sample NAIP tiles equally
     '''
     # fix user errors, if any
     if min_area_sqkm > max_area_sqkm:
@@ -612,134 +2281,158 @@ def generate_gtpoints(config, phyreg_ids, min_area_sqkm, max_area_sqkm,
         min_points = max_points
         max_points = tmp
 
+    if stratify not in (None, 'canopy', 'tile'):
+        raise ValueError("stratify must be None, 'canopy', or 'tile'")
+
     phyregs_layer = config.phyregs_layer
     phyregs_area_sqkm_field = config.phyregs_area_sqkm_field
-    naipqq_layer = config.naipqq_layer
-    spatref_wkid = config.spatref_wkid
+    spatref = arcpy.SpatialReference(config.spatref_wkid)
     analysis_year = config.analysis_year
-    results_path = config.results_path
 
     arcpy.env.overwriteOutput = True
     arcpy.env.addOutputsToMap = False
-    arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(spatref_wkid)
 
-    # use configparser converter to read list
-    conf = ConfigParser(converters={'list': lambda x: [int(i.strip())
-                                                for i in x.split(',')]})
-    conf.read(config.config)
-    inverted_reg = conf.getlist('config', 'inverted_phyreg_ids')
+    inverted_reg = config.inverted_phyreg_ids
 
-    # make sure to clear selection because most geoprocessing tools use
-    # selected features, if any
-    arcpy.SelectLayerByAttribute_management(naipqq_layer, 'CLEAR_SELECTION')
+    plan = plan_work(config, phyreg_ids)
+    journal = Journal(config.results_path)
 
-    # select phyregs features to process
+    # read region polygons in the output spatial reference
     arcpy.SelectLayerByAttribute_management(phyregs_layer,
             where_clause='PHYSIO_ID in (%s)' % ','.join(map(str,
                                                             phyreg_ids)))
+    regions = {}
     with arcpy.da.SearchCursor(phyregs_layer,
-            ['NAME', 'PHYSIO_ID', phyregs_area_sqkm_field]) as cur:
+            ['PHYSIO_ID', phyregs_area_sqkm_field, 'SHAPE@'],
+            spatial_reference=spatref) as cur:
         for row in cur:
-            name = row[0]
-            print(name)
-            # CreateRandomPoints cannot create a shapefile with - in its
-            # filename
-
-            name = name.replace(' ', '_').replace('-', '_')
-            phyreg_id = row[1]
-            area_sqkm = row[2]
-
-            # Check if region is inverted
-            if row[1] in inverted_reg:
-                inverted = True
-            else:
-                inverted = False
-
-            # +1 to count partial points; e.g., 0.1 requires one point
-            point_count = int(min_points + (max_points - min_points) /
-                    (max_area_sqkm - min_area_sqkm) *
-                    (area_sqkm - min_area_sqkm) + 1)
-            print('Raw point count: %d' % point_count)
-            if point_count < min_points:
-                point_count = min_points
-            elif point_count > max_points:
-                point_count = max_points
-            print('Final point count: %d' % point_count)
-
-            outdir_path = '%s/%s/Outputs' % (results_path, name)
-            shp_filename = 'gtpoints_%d_%s.shp' % (analysis_year, name)
-
-            tmp_shp_filename = 'tmp_%s' % shp_filename
-            tmp_shp_path = '%s/%s' % (outdir_path, tmp_shp_filename)
-
-            # create random points
-            arcpy.SelectLayerByAttribute_management(phyregs_layer,
-                    where_clause='PHYSIO_ID=%d' % phyreg_id)
-            arcpy.CreateRandomPoints_management(outdir_path,
-                    tmp_shp_filename, phyregs_layer, '', point_count)
-
-            # create a new field to store data for ground truthing
-            gt_field = 'GT'
-            arcpy.AddField_management(tmp_shp_path, gt_field, 'SHORT')
-
-            # spatially join the naip qq layer to random points to find
-            # output tile filenames
-            shp_path = '%s/%s' % (outdir_path, shp_filename)
-            arcpy.SpatialJoin_analysis(tmp_shp_path, naipqq_layer, shp_path)
-
-            # delete temporary point shapefile
-            arcpy.Delete_management(tmp_shp_path)
-
-            # get required fields from spatially joined point layer
-            with arcpy.da.UpdateCursor(shp_path, ['SHAPE@XY', gt_field,
-                'FileName']) as cur2:
-                for row2 in cur2:
-                    # read filename
-                    filename = row2[2][:-13]
-                    # construct the final output tile path
-                    cfrtiffile_path = '%s/cfr%s.tif' % (outdir_path,
-                                                        filename)
-                    # read the output tile as raster
-                    ras = arcpy.sa.Raster(cfrtiffile_path)
-                    # resolution
-                    res = (ras.meanCellWidth, ras.meanCellHeight)
-                    # convert raster to numpy array to read cell values
-                    ras_a = arcpy.RasterToNumPyArray(ras)
-                    # get xy values of point
-                    xy = row2[0]
-                    # perform calculate_row_column to get the row and column
-                    # of the point
-                    rc = config.__calculate_row_column(xy, ras.extent, res)
-                    # update the point, correct inverted region points
-                    if inverted is True:
-                        row2[1] = 1 - ras_a[rc]
-                        cur2.updateRow(row2)
-                    else:
-                        row2[1] = ras_a[rc]
-                        cur.updateRow(row2)
-
-            # delete all fields except only those required
-            shp_desc = arcpy.Describe(shp_path)
-            oid_field = shp_desc.OIDFieldName
-            shape_field = shp_desc.shapeFieldName
-
-            all_fields = arcpy.ListFields(shp_path)
-            required_fields = [oid_field, shape_field, gt_field]
-            extra_fields = [x.name for x in all_fields
-                    if x.name not in required_fields]
-            arcpy.DeleteField_management(shp_path, extra_fields)
-
-    # clear selection again
+            regions[row[0]] = (row[1],
+                               geometry_rings(row[2].__geo_interface__))
     arcpy.SelectLayerByAttribute_management(phyregs_layer,
                                             'CLEAR_SELECTION')
 
+    for region in plan:
+        name = region.name
+        print(name)
+        area_sqkm, rings = regions[region.phyreg_id]
+        inverted = region.phyreg_id in inverted_reg
+
+        # +1 to count partial points; e.g., 0.1 requires one point
+        point_count = int(min_points + (max_points - min_points) /
+                (max_area_sqkm - min_area_sqkm) *
+                (area_sqkm - min_area_sqkm) + 1)
+        print('Raw point count: %d' % point_count)
+        if point_count < min_points:
+            point_count = min_points
+        elif point_count > max_points:
+            point_count = max_points
+        print('Final point count: %d' % point_count)
+
+        index = QQIndex(tile[1] for tile in region.tiles)
+
+        def classify(x, y):
+            # finds the tile and GT value of points; points outside the
+            # region's tiles or on nodata cells get -1 and are rejected
+            return __gt_values(config, region, index, x, y, inverted)
+
+        x, y, attrs = sample_points(rings, point_count,
+                seed=None if seed is None else [seed, region.phyreg_id],
+                classify=classify,
+                stratify={'canopy': 'gt', 'tile': 'tile'}.get(stratify),
+                strata=[0, 1] if stratify == 'canopy' else None)
+        if len(x) == 0:
+            print('No points sampled; missing cfr tiles?')
+            continue
+
+        # write only the required fields in one pass
+        shp_path = '%s/gtpoints_%d_%s.shp' % (region.outputs_path,
+                                               analysis_year, name)
+        __write_points(shp_path, spatref, x, y, 'GT', attrs['gt'])
+        journal.record('gtpoints', shp_path, points=len(x), seed=seed,
+                       stratify=stratify)
+
     print('Completed')
 
+def __to_lonlat(x, y, spatref_wkid):
+    # Converts projected coordinates to NAD83 longitude and latitude; uses
+    # one projectAs() call for all the points if qqgrid does not support the
+    # coordinate system
+    try:
+        return projected_to_lonlat(x, y, spatref_wkid)
+    except ValueError:
+        pass
+    points = arcpy.Array([arcpy.Point(*xy) for xy in zip(x, y)])
+    multipoint = arcpy.Multipoint(points,
+            arcpy.SpatialReference(spatref_wkid)).projectAs(
+                    arcpy.SpatialReference(4269))
+    lonlat = np.array([(p.X, p.Y) for p in multipoint], dtype=float)
+    return lonlat[:, 0], lonlat[:, 1]
+
+def __gt_values(config, region, index, x, y, inverted):
+    # Finds the tile of points arithmetically from their QQ codes and reads
+    # their GT values from the cfr tiles of a region, each tile only once;
+    # returns {'tile': ..., 'gt': ...} where -1 means no tile or no value
+    codes = lonlat_to_qq(*__to_lonlat(x, y, config.spatref_wkid))
+    tile = index.lookup(codes)
+    gt = np.full(len(x), -1, dtype=np.int64)
+    for i in np.unique(tile[tile >= 0]):
+        sel = np.flatnonzero(tile == i)
+        cfr_path = '%s/cfr%s.tif' % (region.outputs_path, index.names[i])
+        gt[sel] = __raster_values(cfr_path, x[sel], y[sel],
+                                  array_cache(config))
+        if inverted and not region.inversion_applied('cfr%s.tif' %
+                                                     index.names[i]):
+            # correct inverted region points unless the tile was inverted
+            # during conversion
+            values = gt[sel]
+            gt[sel] = np.where((values >= 0) & (values <= 1), 1 - values,
+                               values)
+    gt[gt > 1] = -1
+    return {'tile': tile, 'gt': gt}
+
+def __write_points(shp_path, spatref, x, y, field, values):
+    # Writes a point shapefile with only one SHORT field in one pass
+    with atomic_output(shp_path) as tmp_path:
+        arcpy.CreateFeatureclass_management(os.path.dirname(tmp_path),
+                os.path.basename(tmp_path), 'POINT',
+                spatial_reference=spatref)
+        arcpy.AddField_management(tmp_path, field, 'SHORT')
+        # new shapefiles have an Id field
+        arcpy.DeleteField_management(tmp_path, 'Id')
+        with arcpy.da.InsertCursor(tmp_path, ['SHAPE@XY', field]) as cur:
+            for row in zip(zip(x.tolist(), y.tolist()), values.tolist()):
+                cur.insertRow(row)
+
+def __raster_values(raster_path, x, y, cache=None):
+    # Reads a raster once, through the array cache if any, and returns its
+    # values at points as an int64 array; points outside the raster or on
+    # nodata cells get -1
+    values = np.full(len(x), -1, dtype=np.int64)
+    if not os.path.exists(raster_path):
+        return values
+    ras = arcpy.Raster(raster_path)
+    arr = __cached_array(cache, raster_path,
+                         lambda: arcpy.RasterToNumPyArray(ras))
+    rows = np.floor((ras.extent.YMax - y) /
+                    ras.meanCellHeight).astype(np.int64)
+    cols = np.floor((x - ras.extent.XMin) /
+                    ras.meanCellWidth).astype(np.int64)
+    inside = ((rows >= 0) & (rows < arr.shape[0]) &
+              (cols >= 0) & (cols < arr.shape[1]))
+    cell_values = arr[rows[inside], cols[inside]].astype(np.int64)
+    if ras.noDataValue is not None:
+        cell_values[cell_values == ras.noDataValue] = -1
+    values[inside] = cell_values
+    return values
+
 def update_gtpoints(config, old_points, phyreg_ids):
     '''
     This function copies a previous years GT points and copies the
     points but with the new years GT values. It addtionally corrects the
-    values if they are within an inverted region.
+    values if they are within an inverted region. The tile of each point is
+    computed from its coordinates using the NAIP QQ grid instead of a
+    spatial join. Points without a GT value, e.g., outside the tiles of a
+    region, get -1.
 
     Parameters
     ----------
@@ -750,110 +2443,38 @@ def update_gtpoints(config, old_points, phyreg_ids):
     phyreg_ids : list
         list of physiographic region IDs to process
     '''
-    phyregs_layer = config.phyregs_layer
-    naipqq_layer = config.naipqq_layer
-    spatref_wkid = config.spatref_wkid
+    spatref = arcpy.SpatialReference(config.spatref_wkid)
     analysis_year = config.analysis_year
-    results_path = config.results_path
 
     arcpy.env.overwriteOutput = True
     arcpy.env.addOutputsToMap = False
-    arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(spatref_wkid)
-
-    # use configparser converter to read list
-    conf = ConfigParser(converters={'list': lambda x: [int(i.strip())
-                                                for i in x.split(',')]})
-    conf.read(config.config)
-    inverted_reg = conf.getlist('config', 'inverted_phyreg_ids')
 
-    # make sure to clear selection because most geoprocessing tools use
-    # selected features, if any
-    arcpy.SelectLayerByAttribute_management(naipqq_layer, 'CLEAR_SELECTION')
-
-    # select phyregs features to process
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-        where_clause='PHYSIO_ID in (%s)' % ','.join(map(str,
-            phyreg_ids)))
-    with arcpy.da.SearchCursor(phyregs_layer,
-            ['NAME', 'PHYSIO_ID']) as cur:
-        for row in cur:
-            name = row[0]
-            print(name)
-            # CreateRandomPoints cannot create a shapefile with - in its
-            # filename
-            name = name.replace(' ', '_').replace('-', '_')
-            phyreg_id = row[1]
-            # Check if region is inverted
-            if row[1] in inverted_reg:
-                inverted = True
-            else:
-                inverted = False
-
-            outdir_path = '%s/%s/Outputs' % (results_path, name)
-            shp_filename = 'gtpoints_%d_%s.shp' % (analysis_year, name)
-
-            tmp_shp_filename = 'tmp_%s' % shp_filename
-            tmp_shp_path = '%s/%s' % (outdir_path, tmp_shp_filename)
-
-            # create random points
-            arcpy.SelectLayerByAttribute_management(phyregs_layer,
-                    where_clause='PHYSIO_ID=%d' % phyreg_id)
-
-            # create a new field to store data for ground truthing
-            gt_field = 'GT_%s' % analysis_year
-            arcpy.CopyFeatures_management(old_points, tmp_shp_path)
-            arcpy.AddField_management(tmp_shp_path, gt_field, 'SHORT')
-
-            # spatially join the naip qq layer to random points to find
-            # output tile filenames
-            shp_path = '%s/%s' % (outdir_path, shp_filename)
-            arcpy.SpatialJoin_analysis(tmp_shp_path, naipqq_layer, shp_path)
-
-            # delete temporary point shapefile
-            arcpy.Delete_management(tmp_shp_path)
-
-            # get required fields from spatially joined point layer
-            with arcpy.da.UpdateCursor(shp_path, ['SHAPE@XY', gt_field,
-                                                  'FileName']) as cur2:
-                for row2 in cur2:
-                    # read filename
-                    filename = row2[2][:-13]
-                    # construct the final output tile path
-                    cfrtiffile_path = '%s/cfr%s.tif' % (outdir_path,
-                                                        filename)
-                    # read the output tile as raster
-                    ras = arcpy.sa.Raster(cfrtiffile_path)
-                    # resolution
-                    res = (ras.meanCellWidth, ras.meanCellHeight)
-                    # convert raster to numpy array to read cell values
-                    ras_a = arcpy.RasterToNumPyArray(ras)
-                    # get xy values of point
-                    xy = row2[0]
-                    # perform calculate_row_column to get the row and column
-                    # of the point
-                    rc = __calculate_row_column(xy, ras.extent, res)
-                    # update the point, correct inverted region points
-                    if inverted is True:
-                        row2[1] = 1 - ras_a[rc]
-                        cur2.updateRow(row2)
-                    else:
-                        row2[1] = ras_a[rc]
-                        cur2.updateRow(row2)
-
-            # delete all fields except only those required
-            shp_desc = arcpy.Describe(shp_path)
-            oid_field = shp_desc.OIDFieldName
-            shape_field = shp_desc.shapeFieldName
-
-            all_fields = arcpy.ListFields(shp_path)
-            required_fields = [oid_field, shape_field, gt_field]
-            extra_fields = [x.name for x in all_fields
-                            if x.name not in required_fields]
-            arcpy.DeleteField_management(shp_path, extra_fields)
-
-    # clear selection again
-    arcpy.SelectLayerByAttribute_management(phyregs_layer,
-                                            'CLEAR_SELECTION')
+    inverted_reg = config.inverted_phyreg_ids
+
+    # read the old points once in the output spatial reference
+    with arcpy.da.SearchCursor(old_points, ['SHAPE@XY'],
+                               spatial_reference=spatref) as cur:
+        xy = np.array([row[0] for row in cur], dtype=float).reshape(-1, 2)
+    x = xy[:, 0]
+    y = xy[:, 1]
+
+    plan = plan_work(config, phyreg_ids)
+    journal = Journal(config.results_path)
+    gt_field = 'GT_%s' % analysis_year
+    for region in plan:
+        name = region.name
+        print(name)
+        inverted = region.phyreg_id in inverted_reg
+
+        index = QQIndex(tile[1] for tile in region.tiles)
+        gt = __gt_values(config, region, index, x, y, inverted)['gt']
+        if (gt < 0).any():
+            print('%d points without a GT value' % (gt < 0).sum())
+
+        shp_path = '%s/gtpoints_%d_%s.shp' % (region.outputs_path,
+                                               analysis_year, name)
+        __write_points(shp_path, spatref, x, y, gt_field, gt)
+        journal.record('gtpoints', shp_path, points=len(x))
 
     print('Completed')
 
@@ -871,7 +2492,6 @@ def add_naip_tiles_for_gt(config, gtpoints):
         name of ground truthing points shapefile to add NAIP based off
     '''
     naipqq_layer = config.naipqq_layer
-    naip_path = config.naip_path
 
     arcpy.SelectLayerByAttribute_management(naipqq_layer,
                                             'CLEAR_SELECTION')
@@ -881,14 +2501,264 @@ def add_naip_tiles_for_gt(config, gtpoints):
     with arcpy.da.SearchCursor(naipqq_layer, ['FileName']) as cur:
         for row in sorted(cur):
             filename = '%s.tif' % row[0][:-13]
-            folder = filename[2:7]
-            infile_path = '%s/%s/%s' % (naip_path, folder, filename)
+            infile_path = naip_tile_path(config, filename, True)
             tmp = 'in_memory/%s' % filename
             arcpy.MakeRasterLayer_management(infile_path, tmp)
 
     arcpy.SelectLayerByAttribute_management(naipqq_layer, 'CLEAR_SELECTION')
 
+    __report_naip_cache(config)
+    print('Completed')
+
+def assess_gt_accuracy(config, phyreg_ids=None, truth_field='TRUTH',
+                       gt_field='GT', num_resamples=2000, confidence=0.95,
+                       seed=None):
+    '''
+    This function assesses the accuracy of the canopy maps using the
+    ground truthing points of all the regions. GT values are compared with
+    the reviewer-labeled truth_field to compute the confusion matrix,
+    overall, user's, and producer's accuracy, and kappa per region and
+    statewide, with bootstrap confidence intervals computed by num_workers
+    processes. The results are written to accuracy_<year>.csv in the results
+    folder. Points without a GT or truth value are skipped.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    phyreg_ids : list
+        list of physiographic region IDs to assess (default
+        config.phyreg_ids)
+    truth_field : str
+        field of reviewer-labeled classes (0: non-canopy, 1: canopy)
+    gt_field : str
+        field of mapped classes, e.g., GT or GT_<year>
+    num_resamples : int
+        number of bootstrap resamples; 0 to skip confidence intervals
+    confidence : float
+        confidence level of the intervals
+    seed : int
+        seed for reproducible intervals
+
+    Returns
+    -------
+    dict
+        output of accuracy.assess_accuracy()
+    '''
+    analysis_year = config.analysis_year
+    plan = plan_work(config, phyreg_ids)
+
+    names = []
+    regions = []
+    truth = []
+    predicted = []
+    for region in plan:
+        shp_path = '%s/gtpoints_%d_%s.shp' % (region.outputs_path,
+                                               analysis_year, region.name)
+        if not os.path.exists(shp_path):
+            print('Missing GT points: %s' % shp_path)
+            continue
+        with arcpy.da.SearchCursor(shp_path, [gt_field, truth_field]) as cur:
+            rows = np.array([row for row in cur
+                             if None not in row and min(row) >= 0],
+                            dtype=np.int64).reshape(-1, 2)
+        regions.append(np.full(len(rows), len(names), dtype=np.int64))
+        predicted.append(rows[:, 0])
+        truth.append(rows[:, 1])
+        names.append(region.name)
+    if not names:
+        print('No GT points to assess')
+        return None
+
+    predicted = np.concatenate(predicted)
+    truth = np.concatenate(truth)
+    num_classes = int(max(predicted.max(initial=1), truth.max(initial=1))) + 1
+    result = assess_accuracy(np.concatenate(regions), truth, predicted,
+                             len(names), num_classes, num_resamples,
+                             confidence, seed, config.num_workers)
+
+    for i, name in enumerate(names + ['Statewide']):
+        line = '%s: n=%d, overall=%.3f, kappa=%.3f' % (name,
+                result['n'][i], result['overall'][i], result['kappa'][i])
+        if 'overall_ci' in result:
+            line += ', overall %d%% CI=[%.3f, %.3f]' % ((confidence * 100,) +
+                    tuple(result['overall_ci'][i]))
+        print(line)
+
+    report_path = '%s/accuracy_%d.csv' % (config.results_path, analysis_year)
+    with atomic_output(report_path) as tmp_path:
+        write_accuracy_report(tmp_path, names, result)
+
+    print('Completed')
+    return result
+
+def extract_gt_chips(config, gtpoints, chip_size=64, chips_path=None,
+                     phyreg_ids=None):
+    '''
+    This function extracts a small window (chip) of NAIP imagery around each
+    ground truthing point together with the matching window of canopy values
+    from the cfr tiles, so that points can be reviewed without loading whole
+    NAIP tiles. Points are grouped by NAIP tile, which is found arithmetically
+    from the NAIP QQ grid, and each tile is opened only once by one of
+    num_workers processes that read only the windows.
+
+    The chips are saved in one compressed NumPy file with the following
+    arrays:
+        ids : OIDs of the points
+        valid : whether the point is in a NAIP tile of the regions
+        filenames : NAIP tile filename of each point
+        chips : (n, bands, chip_size, chip_size) NAIP windows
+        chip_geo : (n, 4) xmin, ymax, cell width, and cell height of chips
+        chip_wkid : (n,) WKID of each NAIP tile
+        canopy : (n, chip_size, chip_size) cfr windows; 3 is nodata
+        canopy_geo : (n, 4) xmin, ymax, cell width, and cell height of canopy
+        canopy_wkid : spatref_wkid
+    Parts of windows outside a tile are 0 in chips and 3 in canopy. cfr tiles
+    have the cell size of their NAIP tiles, so both windows cover the same
+    area.
+
+    Parameters
+    ----------
+    config :
+        CanoPy configuration object
+    gtpoints : str
+        name of ground truthing points shapefile
+    chip_size : int
+        window size in cells
+    chips_path : str
+        output .npz path (default results_path/<gtpoints>_chips.npz)
+    phyreg_ids : list
+        list of physiographic region IDs whose tiles to use (default
+        config.phyreg_ids)
+
+    Returns
+    -------
+    str
+        chips_path
+    '''
+    spatref_wkid = config.spatref_wkid
+    if chips_path is None:
+        chips_path = '%s/%s_chips.npz' % (config.results_path,
+                os.path.splitext(os.path.basename(gtpoints))[0])
+
+    # read the points once in the output spatial reference
+    with arcpy.da.SearchCursor(gtpoints, ['OID@', 'SHAPE@XY'],
+            spatial_reference=arcpy.SpatialReference(spatref_wkid)) as cur:
+        rows = [(row[0], row[1][0], row[1][1]) for row in cur]
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    x = np.array([row[1] for row in rows], dtype=float)
+    y = np.array([row[2] for row in rows], dtype=float)
+
+    # cfr tiles of the regions by NAIP tile filename
+    plan = plan_work(config, phyreg_ids)
+    cfr_paths = {}
+    for region in plan:
+        for oid, filename in region.tiles:
+            cfr_filename = 'cfr%s.tif' % filename
+            if filename not in cfr_paths and cfr_filename in region.outputs:
+                cfr_paths[filename] = '%s/%s' % (region.outputs_path,
+                                                 cfr_filename)
+    index = QQIndex(set(tile[1] for region in plan for tile in region.tiles))
+    tile = index.lookup(lonlat_to_qq(*__to_lonlat(x, y, spatref_wkid)))
+    if (tile < 0).any():
+        print('%d points outside the NAIP tiles of the regions' %
+              (tile < 0).sum())
+
+    jobs = []
+    selections = []
+    for i in np.unique(tile[tile >= 0]):
+        sel = np.flatnonzero(tile == i)
+        filename = index.names[i]
+        jobs.append((naip_tile_path(config, '%s.tif' % filename),
+                     cfr_paths.get(filename), x[sel], y[sel], chip_size,
+                     spatref_wkid))
+        selections.append(sel)
+
+    n = len(ids)
+    results = []
+    with ProcessPoolExecutor(max_workers=config.num_workers) as executor:
+        for sel, job, result in zip(selections, jobs,
+                executor.map(__extract_tile_chips, jobs)):
+            print(os.path.basename(job[0]))
+            results.append((sel, result))
+
+    # some years have 3-band tiles; pad chips to the most bands
+    bands = max([r[0].shape[1] for sel, r in results] or [0])
+    chips = np.zeros((n, bands, chip_size, chip_size), dtype=np.uint8)
+    chip_geo = np.full((n, 4), np.nan)
+    chip_wkid = np.zeros(n, dtype=np.int64)
+    canopy = np.full((n, chip_size, chip_size), 3, dtype=np.uint8)
+    canopy_geo = np.full((n, 4), np.nan)
+    for sel, (tile_chips, tile_chip_geo, wkid, tile_canopy,
+              tile_canopy_geo) in results:
+        chips[sel, :tile_chips.shape[1]] = tile_chips
+        chip_geo[sel] = tile_chip_geo
+        chip_wkid[sel] = wkid
+        if tile_canopy is not None:
+            canopy[sel] = tile_canopy
+            canopy_geo[sel] = tile_canopy_geo
+    filenames = np.array([index.names[i] if i >= 0 else '' for i in tile])
+
+    with atomic_output(chips_path) as tmp_path:
+        np.savez_compressed(tmp_path, ids=ids, valid=tile >= 0,
+                            filenames=filenames, chips=chips,
+                            chip_geo=chip_geo, chip_wkid=chip_wkid,
+                            canopy=canopy, canopy_geo=canopy_geo,
+                            canopy_wkid=spatref_wkid)
+
     print('Completed')
+    return chips_path
+
+def __extract_tile_chips(job):
+    # Worker function for extract_gt_chips(); it must be a module-level
+    # function so that the process pool can pickle it. Each raster is opened
+    # once and only the windows around the points are read.
+    naip_path, cfr_path, x, y, chip_size, spatref_wkid = job
+    naip = arcpy.Raster(naip_path)
+    # NAIP tiles are in UTM; project the points once
+    if naip.spatialReference.factoryCode == spatref_wkid:
+        naip_xy = list(zip(x, y))
+    else:
+        points = arcpy.Array([arcpy.Point(*xy) for xy in zip(x, y)])
+        multipoint = arcpy.Multipoint(points,
+                arcpy.SpatialReference(spatref_wkid)).projectAs(
+                        naip.spatialReference)
+        naip_xy = [(p.X, p.Y) for p in multipoint]
+    windows = [__read_window(naip, px, py, chip_size, 0)
+               for px, py in naip_xy]
+    chips = np.stack([w[0] for w in windows])
+    chip_geo = np.array([w[1:] for w in windows])
+    canopy = canopy_geo = None
+    if cfr_path is not None:
+        cfr = arcpy.Raster(cfr_path)
+        windows = [__read_window(cfr, px, py, chip_size, 3)
+                   for px, py in zip(x, y)]
+        canopy = np.stack([w[0][0] for w in windows])
+        canopy_geo = np.array([w[1:] for w in windows])
+    return (chips, chip_geo, naip.spatialReference.factoryCode, canopy,
+            canopy_geo)
+
+def __read_window(ras, x, y, size, fill):
+    # Reads a size x size window centered on (x, y) from an open raster;
+    # cells outside the raster get fill. Returns ((bands, size, size) array,
+    # xmin, ymax, cell width, cell height)
+    w = ras.meanCellWidth
+    h = ras.meanCellHeight
+    ext = ras.extent
+    col = int(math.floor((x - ext.XMin) / w)) - size // 2
+    row = int(math.floor((ext.YMax - y) / h)) - size // 2
+    out = np.full((ras.bandCount, size, size), fill, dtype=np.uint8)
+    r0 = max(row, 0)
+    r1 = min(row + size, ras.height)
+    c0 = max(col, 0)
+    c1 = min(col + size, ras.width)
+    if r1 > r0 and c1 > c0:
+        arr = arcpy.RasterToNumPyArray(ras,
+                arcpy.Point(ext.XMin + c0 * w, ext.YMax - r1 * h),
+                c1 - c0, r1 - r0, fill)
+        out[:, r0 - row:r1 - row, c0 - col:c1 - col] = \
+                arr.reshape(-1, r1 - r0, c1 - c0)
+    return out, ext.XMin + col * w, ext.YMax - row * h, w, h
 
 def objective_function(config, phy_id, nlcd, method="unweighted"):
     '''
@@ -903,10 +2773,15 @@ def objective_function(config, phy_id, nlcd, method="unweighted"):
     L_ij is the local percentage of land cover j in tile I, L_i is the
     number of classes in tile I and w is the weight for the number of
     classes in the tile.
+
+    The masked NLCD arrays of the district and its tiles are decoded through
+    the array cache if array_cache_path is configured, so repeated runs do
+    not extract and decode them again.
     '''
 
     phy_reg = config.phyregs_layer
     naip = config.naipqq_layer
+    cache = array_cache(config)
 
     arcpy.env.overwriteOutput = True
 
@@ -923,17 +2798,17 @@ def objective_function(config, phy_id, nlcd, method="unweighted"):
     arcpy.FeatureClassToFeatureClass_conversion(naip,
         os.path.dirname(naip_sub), os.path.basename(naip_sub))
 
-    # Create NLCD subset for entire district.
-    nlcd_region = arcpy.sa.ExtractByMask(nlcd, phy_reg)
-    # Convert to numpy array
-    region_arr = arcpy.RasterToNumPyArray(nlcd_region)
+    def region_array():
+        # Create NLCD subset for entire district.
+        nlcd_region = arcpy.sa.ExtractByMask(nlcd, phy_reg)
+        # Convert to numpy array; nodata becomes 0, which is not an NLCD
+        # class
+        return arcpy.RasterToNumPyArray(nlcd_region, nodata_to_value=0)
+
+    region_arr = __cached_array(cache, nlcd, region_array, mask=phy_reg,
+                                phyreg_id=phy_id)
     # Get global values and counts of lancover within district.
-    reg_unique, reg_counts = np.unique(region_arr, return_counts=True)
-    region_lc = dict(zip(reg_unique, reg_counts))
-    # Remove nodata
-    ras = arcpy.Raster(nlcd_region)
-    nan = ras.noDataValue
-    del region_lc[nan]
+    region_lc = class_counts(region_arr)
 
     # Get list of all naip tile names.
     name_list = []
@@ -942,54 +2817,39 @@ def objective_function(config, phy_id, nlcd, method="unweighted"):
             name_list.append(row[0])
     # Choose between weighted or unweighted function.
     if method == "unweighted":
-        __unweighted_ob(name_list, naip, nlcd_region, region_lc)
+        return __unweighted_ob(name_list, naip, nlcd, region_lc, cache)
     elif method == "weighted":
-        __weighted_ob(name_list, naip, nlcd_region, region_lc)
+        return __weighted_ob(name_list, naip, nlcd, region_lc, cache)
     else:
         raise ValueError("Not an option.")
 
-def __unweighted_ob(name_list, naip, nlcd_region, region_lc):
+def __nlcd_tile_counts(naip, nlcd, oid, cache):
+    # Returns the NLCD class counts of a NAIP tile within the district. The
+    # tiles are fully within the district, so masking the NLCD by a tile
+    # gives the same cells as masking the district subset.
+    def tile_array():
+        # Selcect tile i
+        arcpy.SelectLayerByAttribute_management(naip, "NEW_SELECTION",
+                                                f"OBJECTID = {oid}")
+        # Get local NLCD
+        nlcd_tile = arcpy.sa.ExtractByMask(nlcd, naip)
+        # Convert to numpy array; nodata becomes 0
+        return arcpy.RasterToNumPyArray(nlcd_tile, nodata_to_value=0)
+
+    tile_arr = __cached_array(cache, nlcd, tile_array, mask=naip, oid=oid)
+    # Get counts of values.
+    return class_counts(tile_arr)
+
+def __unweighted_ob(name_list, naip, nlcd, region_lc, cache=None):
     '''
     Removes weight which will penalize for missing classes. Reduces compute
     time as it will remove class iterations.
     '''
-    # Initialize dictonary for tile scores and id.
-    out_index = {}
-    for i in name_list:
-        # Selcect tile i
-        arcpy.SelectLayerByAttribute_management(naip, "NEW_SELECTION",
-                                                f"OBJECTID = {i}")
-        # Get local NLCD
-        nlcd_tile = arcpy.sa.ExtractByMask(nlcd_region, naip)
-        # Convert to numpy array and get counts of values.
-        tile_arr = arcpy.RasterToNumPyArray(nlcd_tile)
-        tile_unique, tile_counts = np.unique(tile_arr, return_counts=True)
-        tile_lc = dict(zip(tile_unique, tile_counts))
-        # Remove nodata
-        ras = arcpy.Raster(nlcd_tile)
-        nan = ras.noDataValue
-        del tile_lc[nan]
-        # Compute minimization value.
-        d = []
-        for j in region_lc.keys():
-            # If class is not in local values then local value is 0.
-            if j not in tile_unique:
-                G = region_lc.get(j) / sum(region_lc.values())
-                c = (G - 0) ** 2
-                d.append(c)
-            else:
-                G = region_lc.get(j) / sum(region_lc.values())
-                L = tile_lc.get(j) / sum(tile_lc.values())
-                c = (G - L) ** 2
-                d.append(c)
-        # For each class value it is added to list 'd' and then summed at
-        # the of each iteration.
-        out_index.update({i: math.fsum(d)})
-    training_tile = {k: v for k, v in sorted(out_index.items(),
-        key=lambda item: item[1])}
-    return training_tile
-
-def __weighted_ob(name_list, naip, nlcd_region, region_lc):
+    tiles_lc = dict((i, __nlcd_tile_counts(naip, nlcd, i, cache))
+                    for i in name_list)
+    return rank_tiles(region_lc, tiles_lc)
+
+def __weighted_ob(name_list, naip, nlcd, region_lc, cache=None):
     '''
     Weighted function as described in docstring of objective_function.
     Will have longer computational time as it will iterate over each tile 20
@@ -1006,104 +2866,38 @@ def __weighted_ob(name_list, naip, nlcd_region, region_lc):
     # value.
     #######################################################################
 
-    # Initialize dictionary for all weighted tiles.
-    weighted_tiles = {}
+    # Class counts do not depend on the weight, so each tile is read once
+    tiles_lc = dict((i, __nlcd_tile_counts(naip, nlcd, i, cache))
+                    for i in sorted(name_list))
     # 20 iterations for 20 NLCD classes.
-    for weight in range(21):
-        # Index dictonary for iteration weight_i
-        out_index = {}
-        for i in sorted(name_list):
-            # Select tile i
-            arcpy.SelectLayerByAttribute_management(naip, "NEW_SELECTION",
-                                                    f"OBJECTID = {i}")
-            # Get local NLCD
-            nlcd_tile = arcpy.sa.ExtractByMask(nlcd_region, naip)
-            # Convert to numpy array and get counts of values.
-            tile_arr = arcpy.RasterToNumPyArray(nlcd_tile)
-            tile_unique, tile_counts = np.unique(tile_arr,
-                                                 return_counts=True)
-            tile_lc = dict(zip(tile_unique, tile_counts))
-            # Remove nodata
-            ras = arcpy.Raster(nlcd_tile)
-            nan = ras.noDataValue
-            del tile_lc[nan]
-            # Compute weighted minimization value
-            d = []
-            for j in region_lc.keys():
-                if j in tile_unique:
-                    G = region_lc.get(j) / sum(region_lc.values())
-                    L = tile_lc.get(j) / sum(tile_lc.values())
-                    c = (G - L) ** 2 + weight * (len(region_lc) /
-                                                20 - len(tile_lc) / 20) ** 2
-                    d.append(c)
-                else:
-                    G = region_lc.get(j) / sum(region_lc.values())
-                    c = (G - 0) ** 2 + weight * (len(region_lc) /
-                                                20 - len(tile_lc) / 20) ** 2
-                    d.append(c)
-
-            # For each class value it is added to list 'd' and then summed at
-            # the of each iteration.
-            out_index.update({i: math.fsum(d)})
-        # Sort out dictonary
-        sort_func = {k: v for k, v in sorted(out_index.items(),
-            key=lambda item: item[1])}
-        # Add the tile with the lowest function value to a new list.
-        weighted_tiles.update({weight: [list(sort_func.items())[0][0],
-            list(sort_func.items())[0][1]]})
-    training_tile = weighted_tiles
-    return training_tile
+    return weighted_best_tiles(region_lc, tiles_lc, 20)
 
 
 class Check_gaps:
     '''
-    Object to check if gaps within in raster array are present.
+    Object to check if gaps within in raster array are present. If an
+    ArrayCache is given, e.g., array_cache(config), the raster is decoded
+    only once and mapped read-only by later checks. fill_canopy_gaps() finds
+    and fills gaps of any width.
     '''
-    def __init__(self, arc_raster, nodata=3):
-        self.region_array = arcpy.RasterToNumPyArray(arc_raster,
-                                                     nodata_to_value=nodata)
+    def __init__(self, arc_raster, nodata=3, cache=None):
+        def decode():
+            return arcpy.RasterToNumPyArray(arc_raster,
+                                            nodata_to_value=nodata)
+
+        if cache is None:
+            self.region_array = decode()
+        else:
+            self.region_array = cache.get(
+                    arcpy.Describe(arc_raster).catalogPath, decode,
+                    nodata_to_value=nodata)
         self.nodata = nodata
         self.check(self.region_array)
 
-    def __neighbors(self, arr, i, j, d=1):
-        # Neighbors function adapted from ocsmit/mwinpy.git
-        neighbors = arr[max(i - d, 0):min(i + d + 1, arr.shape[0]),
-            max(j - d, 0):min(j + d + 1, arr.shape[1])].flatten()
-        return neighbors
-
     def check(self, arr):
-        # Get array i,j indices only where the value is equal to nodata.
-        index_i, index_j = np.where(arr >= self.nodata)
-        for i in range(len(index_i)):
-            # Get 8 neighbors of cell
-            n = self.__neighbors(arr, index_i[i], index_j[i])
-            # Get count of values in cell
-            u, c = np.unique(n, return_counts=True)
-            val_dict = dict(zip(u, c))
-            # If number of nodata cells is less than or equal to 2, then it
-            # is a gap in the mosaic. Here, we assume single-cell-wide gaps
-            # only. For example, see
-            #   XXXXXX    XXXXXX    XXXXXX
-            #   X....X or X..X.X or X.X..X
-            #   XXXXXX    XXXXXX    X.XX.X
-            #                       XXXXXX
-            # where X and . are non-nodata and nodata cells, respectively.
-            # These nodata cells (....) are a nodata gap within non-nodata
-            # cells. However, in the following case,
-            #   ......
-            #   ....XX
-            #   ..XXXX
-            # the nodata cells are just outside the region boundary. Depending
-            # on their locations, this check will fail to flag wider gaps such
-            # as the following cases though:
-            #   XXXXXX    XXXXXX
-            #   X....X or X.X..X
-            #   XX...X    X..X.X
-            #   XXXXXX    XXXXXX
-            #   6 right   2 middle nodata cells unflagged
-            if val_dict.get(self.nodata) <= 2:
-                print("Gaps are present in mosaic")
-                break
+        # See has_gaps() for the gaps that are flagged
+        if has_gaps(arr, self.nodata):
+            print("Gaps are present in mosaic")
 
 class check_snap:
 
@@ -36,6 +36,63 @@ class Config:
         Folder which will contain all outputs.
     analysis_year : int
         Specifies which year is being analyzed.
+    num_workers : int
+        Number of worker processes for parallel tile processing.
+    num_threads : int
+        Number of regions processed concurrently in threads.
+    service_address : str
+        host:port or socket or pipe path of the worker service.
+    service_workers : int
+        Number of warm worker processes of the worker service.
+    scratch_path : str
+        Local folder for prefetched NAIP tiles; None disables prefetching.
+    prefetch_tiles : int
+        Maximum number of NAIP tiles prefetched ahead.
+    prefetch_max_mb : int
+        Maximum number of megabytes of prefetched NAIP tiles.
+    naip_cache_path : str
+        Persistent local cache folder for NAIP tiles; None disables caching.
+    naip_cache_max_mb : int
+        Maximum number of megabytes of cached NAIP tiles.
+    result_cache_path : str
+        Persistent cache folder for final and clipped final tiles; None
+        disables caching.
+    result_cache_max_mb : int
+        Maximum number of megabytes of cached tile products.
+    array_cache_path : str
+        Persistent cache folder for rasters decoded into NumPy arrays; None
+        disables caching.
+    array_cache_max_mb : int
+        Maximum number of megabytes of decoded rasters.
+    compression : str
+        Compression codec of raster outputs (NONE, DEFLATE, LZW, ZSTD, or
+        PACKBITS); None keeps the arcpy default.
+    tile_size : int
+        Internal tile size of raster outputs in cells; 0 keeps the arcpy
+        default.
+    bit_depth : str
+        Pixel type of canopy raster outputs (2_BIT, 4_BIT, or
+        8_BIT_UNSIGNED).
+    cleanup_majority_size : int
+        Neighborhood width of the majority filter applied before
+        polygonization; 0 disables it.
+    cleanup_min_cells : int
+        Minimum mapping unit in cells; smaller canopy patches are removed
+        before polygonization. 0 disables it.
+    cleanup_max_hole_cells : int
+        Noncanopy holes of at most this many cells are filled before
+        polygonization; 0 disables it.
+    prefilter_ndvi_threshold : float
+        NDVI at or above which a sampled NAIP cell is vegetated; None
+        disables the vegetation prefilter.
+    prefilter_max_vegetated_fraction : float
+        Tiles with at most this fraction of vegetated cells are written as
+        noncanopy without classification.
+    prefilter_windows : int
+        Number of sample windows per tile side read by the prefilter.
+    inverted_phyreg_ids : list
+        Physiographic region IDs whose trained model produces an inverted
+        result.
     phyreg_ids : list
         List of phyreg ids to process.
 
@@ -48,9 +105,6 @@ class Config:
         file.
     regions(phyregs):
         Adds the desired regions to self.phyreg_ids
-    calculate_row_column(xy, rast_ext, rast_res):
-        Calculates array row and column using x, y, extent, and
-        resolution.
     assign_phyregs_to_naipqq():
         Adds the phyregs field to the NAIP QQ shapefile and
         populates it with physiographic region IDs that intersect each NAIP
@@ -145,6 +199,54 @@ class Config:
         self.snaprast_path = str.strip(conf.get('config', 'snaprast_path'))
         self.results_path = str.strip(conf.get('config', 'results_path'))
         self.analysis_year = int(conf.get('config', 'analysis_year'))
+        self.num_workers = int(conf.get('config', 'num_workers',
+                                        fallback=os.cpu_count()))
+        self.num_threads = int(conf.get('config', 'num_threads', fallback=1))
+        self.service_address = str.strip(conf.get('config',
+                'service_address', fallback='localhost:6011'))
+        self.service_workers = int(conf.get('config', 'service_workers',
+                                            fallback=2))
+        self.scratch_path = str.strip(conf.get('config', 'scratch_path',
+                                               fallback='')) or None
+        self.prefetch_tiles = int(conf.get('config', 'prefetch_tiles',
+                                           fallback=4))
+        self.prefetch_max_mb = int(conf.get('config', 'prefetch_max_mb',
+                                            fallback=2048))
+        self.naip_cache_path = str.strip(conf.get('config', 'naip_cache_path',
+                                                  fallback='')) or None
+        self.naip_cache_max_mb = int(conf.get('config', 'naip_cache_max_mb',
+                                              fallback=20480))
+        self.result_cache_path = str.strip(conf.get('config',
+                'result_cache_path', fallback='')) or None
+        self.result_cache_max_mb = int(conf.get('config',
+                'result_cache_max_mb', fallback=20480))
+        self.array_cache_path = str.strip(conf.get('config',
+                'array_cache_path', fallback='')) or None
+        self.array_cache_max_mb = int(conf.get('config',
+                'array_cache_max_mb', fallback=10240))
+        self.compression = str.strip(conf.get('config', 'compression',
+                                              fallback='')).upper() or None
+        self.tile_size = int(conf.get('config', 'tile_size', fallback=0))
+        self.bit_depth = str.strip(conf.get('config', 'bit_depth',
+                                            fallback='2_BIT')).upper()
+        self.cleanup_majority_size = int(conf.get('config',
+                'cleanup_majority_size', fallback=0))
+        self.cleanup_min_cells = int(conf.get('config', 'cleanup_min_cells',
+                                              fallback=0))
+        self.cleanup_max_hole_cells = int(conf.get('config',
+                'cleanup_max_hole_cells', fallback=0))
+        threshold = str.strip(conf.get('config', 'prefilter_ndvi_threshold',
+                                       fallback=''))
+        self.prefilter_ndvi_threshold = float(threshold) if threshold \
+                else None
+        self.prefilter_max_vegetated_fraction = float(conf.get('config',
+                'prefilter_max_vegetated_fraction', fallback=0.001))
+        self.prefilter_windows = int(conf.get('config', 'prefilter_windows',
+                                              fallback=32))
+        # parse the list only once; it may be written as 5, 21 or [5, 21]
+        self.inverted_phyreg_ids = [int(x) for x in
+                conf.get('config', 'inverted_phyreg_ids',
+                         fallback='').strip('[] ').split(',') if x.strip()]
 
     def update_config(self, **parameters):
         '''
@@ -214,6 +316,90 @@ class Config:
             NAIP tile so that reproject_input_tiles() can automatically create
             it based on the folder structure of the NAIP imagery data
             (naip_path).
+        num_workers: int
+            This variable specifies the number of worker processes for
+            parallel tile processing.
+        num_threads: int
+            This variable specifies the number of regions processed
+            concurrently in threads by the clip, mosaic, correction, and
+            polygonization stages.
+        service_address: str
+            This variable specifies the address of the worker service, i.e.,
+            host:port or the path to a Unix domain socket or a Windows named
+            pipe.
+        service_workers: int
+            This variable specifies the number of worker processes that the
+            worker service keeps with arcpy already imported.
+        scratch_path: str
+            This local folder is used to prefetch NAIP tiles from slow
+            storage (naip_path) while other tiles are processed. Leave it
+            empty to read NAIP tiles directly.
+        prefetch_tiles: int
+            This variable specifies the maximum number of NAIP tiles to
+            prefetch ahead.
+        prefetch_max_mb: int
+            This variable specifies the maximum size of prefetched NAIP
+            tiles in megabytes.
+        naip_cache_path: str
+            This local folder persistently caches NAIP tiles read from
+            naip_path across stages and runs. Leave it empty to disable the
+            cache.
+        naip_cache_max_mb: int
+            This variable specifies the maximum size of the NAIP tile cache
+            in megabytes. Least recently used tiles are removed first.
+        result_cache_path: str
+            This folder caches final and clipped final tiles by the contents
+            of their inputs and their parameters, so identical computations
+            are not repeated across regions, runs, and years. Leave it empty
+            to disable the cache.
+        result_cache_max_mb: int
+            This variable specifies the maximum size of the result cache in
+            megabytes. Least recently used results are removed first.
+        array_cache_path: str
+            This local folder caches rasters decoded into NumPy arrays as
+            memory-mapped .npy files for NumPy analyses such as Check_gaps,
+            objective_function(), and GT sampling. Leave it empty to disable
+            the cache.
+        array_cache_max_mb: int
+            This variable specifies the maximum size of the array cache in
+            megabytes. Least recently used arrays are removed first.
+        compression: str
+            This variable specifies the compression codec of raster outputs
+            (NONE, DEFLATE, LZW, ZSTD, or PACKBITS). Leave it empty to use
+            the arcpy default.
+        tile_size: int
+            This variable specifies the internal tile size of raster outputs
+            in cells. 0 uses the arcpy default.
+        bit_depth: str
+            This variable specifies the pixel type of canopy raster outputs
+            (2_BIT, 4_BIT, or 8_BIT_UNSIGNED).
+        cleanup_majority_size: int
+            This variable specifies the odd neighborhood width of the
+            majority filter applied to canopy TIFF files before
+            polygonization. 0 disables the filter.
+        cleanup_min_cells: int
+            This variable specifies the minimum mapping unit in cells.
+            Smaller canopy patches are removed before polygonization. 0
+            disables the sieve.
+        cleanup_max_hole_cells: int
+            This variable specifies the maximum size in cells of noncanopy
+            holes filled before polygonization. 0 disables the fill.
+        prefilter_ndvi_threshold: float
+            This variable specifies the NDVI at or above which a sampled
+            NAIP cell is vegetated. Leave it empty to disable the vegetation
+            prefilter.
+        prefilter_max_vegetated_fraction: float
+            This variable specifies the maximum fraction of vegetated cells
+            of a NAIP tile that cannot contain canopy. Such tiles are
+            written as noncanopy clipped final tiles and skip reprojection,
+            classification, conversion, and clipping.
+        prefilter_windows: int
+            This variable specifies the number of sample windows per tile
+            side that the prefilter reads.
+        inverted_phyreg_ids: list
+            This list contains physiographic region IDs whose trained model
+            produces an inverted result. detect_inverted_regions() can
+            update it.
         '''
 
         # Read the configuration file
@@ -223,7 +409,16 @@ class Config:
         # List of parameters which can be edited by user.
         params = ["phyregs_layer", "naipqq_layer", "naipqq_phyregs_field",
                   "naip_path", "spatref_wkid", "project_path", "analysis_year",
-                  "snaprast_path"]
+                  "snaprast_path", "num_workers", "num_threads",
+                  "service_address", "service_workers",
+                  "scratch_path", "prefetch_tiles", "prefetch_max_mb",
+                  "naip_cache_path", "naip_cache_max_mb", "result_cache_path",
+                  "result_cache_max_mb", "array_cache_path",
+                  "array_cache_max_mb", "compression", "tile_size",
+                  "bit_depth", "cleanup_majority_size", "cleanup_min_cells",
+                  "cleanup_max_hole_cells", "prefilter_ndvi_threshold",
+                  "prefilter_max_vegetated_fraction", "prefilter_windows",
+                  "inverted_phyreg_ids"]
 
         # iterate over key word parameters and if present, overwrite entry in
         # config file.
@@ -0,0 +1,181 @@
+import arcpy
+import itertools
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+Classes
+-------
+    ExecutionContext(env, name):
+        Scopes arcpy environment settings and private layer views to a task
+        and restores them on exit.
+
+Functions
+---------
+    run_concurrently(func, items, env, max_workers):
+        Runs a task per item in its own execution context in a thread pool.
+'''
+
+# arcpy.env is shared by all the threads of a process, so execution contexts
+# coordinate through a condition variable. Contexts whose settings agree with
+# the settings in effect run concurrently; other contexts wait until all the
+# running contexts exit. _frames holds (number of contexts entered before,
+# previous settings, previous values) of each change to arcpy.env.
+_cond = threading.Condition()
+_active = None
+_holders = Counter()
+_frames = []
+_view_ids = itertools.count(1)
+
+
+class ExecutionContext:
+    '''
+    Execution context of a task that scopes arcpy environment settings and
+    works on private layer views or lists of feature IDs instead of
+    selections on shared layers, which other tasks may change at the same
+    time. On exit, the views are deleted and the environment settings in
+    effect before are restored.
+
+    Contexts can be nested and run concurrently in threads as long as their
+    settings agree; a context whose settings conflict with those of a
+    context running in another thread waits until it exits.
+
+    Attributes
+    ----------
+    env : dict
+        arcpy.env attribute => value
+    name : str
+        Prefix of the names of private layer views.
+    '''
+    def __init__(self, env=None, name='ctx'):
+        self.env = dict(env or {})
+        self.name = name
+        self.views = []
+
+    def __enter__(self):
+        global _active
+        me = threading.get_ident()
+        with _cond:
+            while _active is not None and not self.__agrees(_active):
+                if not sum(n for t, n in _holders.items() if t != me):
+                    break
+                if _holders[me]:
+                    raise RuntimeError('%s: arcpy.env settings conflict with '
+                                       'a context running in another '
+                                       'thread' % self.name)
+                _cond.wait()
+            if _active is None or not self.__agrees(_active):
+                settings = dict(_active or {})
+                settings.update(self.env)
+                saved = dict((x, getattr(arcpy.env, x)) for x in self.env)
+                _frames.append((sum(_holders.values()), _active, saved))
+                for name, value in self.env.items():
+                    setattr(arcpy.env, name, value)
+                _active = settings
+            _holders[me] += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active
+        try:
+            for view in self.views:
+                arcpy.Delete_management(view)
+            self.views = []
+        finally:
+            me = threading.get_ident()
+            with _cond:
+                _holders[me] -= 1
+                if not _holders[me]:
+                    del _holders[me]
+                # the settings of a context stay in effect until all the
+                # contexts entered after it exit
+                total = sum(_holders.values())
+                while _frames and total <= _frames[-1][0]:
+                    count, previous, saved = _frames.pop()
+                    for name, value in saved.items():
+                        setattr(arcpy.env, name, value)
+                    _active = previous
+                _cond.notify_all()
+        return False
+
+    def __agrees(self, settings):
+        # Returns True if the settings of this context are already in effect
+        return all(x in settings and settings[x] == y
+                   for x, y in self.env.items())
+
+    def view(self, layer, where_clause=None):
+        '''
+        Creates a private layer view of the data source of a layer that is
+        deleted on exit. Selections on the layer are ignored and do not
+        change, so other tasks can use it at the same time.
+
+        Parameters
+        ----------
+            layer : str
+                layer name or path to a feature class
+            where_clause : str
+                SQL expression that defines the features of the view
+
+        Returns
+        -------
+            str
+                name of the view
+        '''
+        source = arcpy.Describe(layer).catalogPath or layer
+        view = '%s_%d' % (self.name, next(_view_ids))
+        arcpy.MakeFeatureLayer_management(source, view, where_clause)
+        self.views.append(view)
+        return view
+
+    def oids(self, layer, where_clause=None):
+        '''
+        Returns the list of feature IDs of a layer that match a where
+        clause. Pass them to oid_where() instead of selecting the features.
+        '''
+        with arcpy.da.SearchCursor(self.view(layer), ['OID@'],
+                                   where_clause) as cur:
+            return [row[0] for row in cur]
+
+    def oid_where(self, layer, oids):
+        '''
+        Returns a where clause for the features of a layer with the given
+        feature IDs.
+        '''
+        return '%s IN (%s)' % (arcpy.Describe(layer).OIDFieldName,
+                               ','.join(map(str, oids)) or 'NULL')
+
+
+def run_concurrently(func, items, env=None, max_workers=1):
+    '''
+    This function runs func(context, item) for each item in its own
+    ExecutionContext in a thread pool, e.g., the region-level tasks of a
+    stage. Tasks must write only their own outputs; geoprocessing tools
+    release the global interpreter lock while they run.
+
+    Parameters
+    ----------
+        func : function
+            task function that takes an ExecutionContext and an item
+        items : list
+            items to process
+        env : dict
+            arcpy.env settings of the tasks
+        max_workers : int
+            maximum number of concurrent tasks; tasks run in the calling
+            thread if it is 1
+
+    Yields
+    ------
+        result of each task in the order of items
+    '''
+    def task(args):
+        i, item = args
+        with ExecutionContext(env, 'task%d' % i) as context:
+            return func(context, item)
+
+    if max_workers <= 1:
+        yield from map(task, enumerate(items))
+        return
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(task, enumerate(items))
@@ -0,0 +1,152 @@
+import math
+import numpy as np
+from statistics import NormalDist
+
+'''
+Functions
+---------
+    ratio_estimate(y, x, strata, sizes):
+        Estimates a ratio such as the canopy fraction from a stratified
+        random sample of units and its standard error.
+    confidence_interval(estimate, se, confidence):
+        Returns the normal confidence interval of an estimate.
+    adaptive_estimate(draw, sizes, error, confidence, initial_units,
+                      max_units, seed):
+        Samples units in batches until the confidence interval of a ratio
+        estimate is narrow enough.
+'''
+
+def ratio_estimate(y, x, strata, sizes):
+    '''
+    This function estimates the ratio of two totals, e.g., canopy cells over
+    valid cells, from a stratified random sample of units drawn with
+    replacement. Each unit is, e.g., a small window of cells, so nodata
+    cells and cells outside a zone only reduce x. The standard error uses
+    the linearized variance of the combined ratio estimator.
+
+    Parameters
+    ----------
+        y, x : array
+            numerator and denominator of each sampled unit, e.g., numbers of
+            canopy and valid cells
+        strata : array
+            stratum index of each sampled unit
+        sizes : array
+            number of units in the population of each stratum
+
+    Returns
+    -------
+        ratio, se
+            NaN if no valid cell was sampled; the standard error is NaN if a
+            stratum with units in the population has less than two samples
+    '''
+    y = np.asarray(y, dtype=float)
+    x = np.asarray(x, dtype=float)
+    strata = np.asarray(strata, dtype=np.int64)
+    sizes = np.asarray(sizes, dtype=float)
+    num_strata = len(sizes)
+    n = np.bincount(strata, minlength=num_strata).astype(float)
+    sampled = n > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        y_mean = np.bincount(strata, y, num_strata) / n
+        x_mean = np.bincount(strata, x, num_strata) / n
+    # strata without samples do not contribute; the estimate then covers
+    # the sampled strata only
+    y_total = (sizes * y_mean)[sampled].sum()
+    x_total = (sizes * x_mean)[sampled].sum()
+    if x_total == 0:
+        return math.nan, math.nan
+    ratio = float(y_total / x_total)
+    if np.any(sampled & (n < 2) & (sizes > 0)):
+        return ratio, math.nan
+    # residuals of the ratio and their within-stratum variances
+    d = y - ratio * x
+    d_mean = np.bincount(strata, d, num_strata)[sampled] / n[sampled]
+    ss = np.bincount(strata, d**2, num_strata)[sampled] - \
+            n[sampled] * d_mean**2
+    var = (sizes[sampled]**2 * ss / (n[sampled] - 1) / n[sampled]).sum()
+    return ratio, math.sqrt(max(var, 0.)) / float(x_total)
+
+def confidence_interval(estimate, se, confidence=0.95):
+    '''
+    This function returns the lower and upper bounds of the normal
+    confidence interval of an estimate clipped to [0, 1] for fractions.
+    '''
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    return max(estimate - z * se, 0.), min(estimate + z * se, 1.)
+
+def adaptive_estimate(draw, sizes, error=0.01, confidence=0.95,
+                      initial_units=100, max_units=5000, seed=None):
+    '''
+    This function estimates a ratio from a stratified random sample and
+    keeps sampling until the half-width of its confidence interval is at
+    most error. Units are allocated to strata in proportion to their sizes.
+    Each batch is sized from the current standard error assuming that the
+    variance decreases in proportion to the number of units.
+
+    Parameters
+    ----------
+        draw : function
+            Function that takes a stratum index, a number of units, and a
+            numpy random Generator and returns y and x arrays of that many
+            randomly drawn units.
+        sizes : array
+            number of units in the population of each stratum
+        error : float
+            target half-width of the confidence interval, e.g., 0.01 for
+            plus or minus one percentage point
+        confidence : float
+            confidence level of the interval
+        initial_units : int
+            number of units in the first batch
+        max_units : int
+            maximum number of units to sample
+        seed : int, list
+            seed of the random number generator for reproducibility
+
+    Returns
+    -------
+        dict
+            estimate, se, lower, upper, half_width, units, and converged,
+            i.e., whether the target error was met
+    '''
+    rng = np.random.default_rng(seed)
+    sizes = np.asarray(sizes, dtype=float)
+    share = sizes / sizes.sum()
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    ys = []
+    xs = []
+    strata = []
+    total = 0
+    batch = min(initial_units, max_units)
+    while True:
+        # at least two units per stratum for a variance estimate
+        counts = np.maximum(np.round(share * batch).astype(np.int64),
+                            2 if total == 0 else 0)
+        counts[sizes == 0] = 0
+        if counts.sum() == 0:
+            counts[np.argmax(sizes)] = max(batch, 1)
+        for h in np.flatnonzero(counts):
+            y, x = draw(h, int(counts[h]), rng)
+            ys.append(np.asarray(y, dtype=float))
+            xs.append(np.asarray(x, dtype=float))
+            strata.append(np.full(len(y), h, dtype=np.int64))
+        total += int(counts.sum())
+        estimate, se = ratio_estimate(np.concatenate(ys), np.concatenate(xs),
+                                      np.concatenate(strata), sizes)
+        half_width = z * se
+        converged = not math.isnan(half_width) and half_width <= error
+        if converged or total >= max_units or math.isnan(estimate):
+            break
+        if math.isnan(half_width) or half_width == 0:
+            batch = total
+        else:
+            batch = int(math.ceil(total * ((half_width / error)**2 - 1)))
+        # grow at least by a tenth and at most to max_units
+        batch = min(max(batch, total // 10, 1), max_units - total)
+    lower, upper = confidence_interval(estimate, se, confidence) \
+            if not math.isnan(se) else (math.nan, math.nan)
+    return {'estimate': float(estimate), 'se': float(se),
+            'lower': float(lower), 'upper': float(upper),
+            'half_width': float(half_width), 'units': total,
+            'converged': bool(converged)}
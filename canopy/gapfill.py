@@ -0,0 +1,96 @@
+from .morphology import box_sum
+
+'''
+Functions
+---------
+    fill_gaps(arr, inside, max_distance):
+        Fills nodata gaps inside a region by iterative neighbor voting.
+    has_gaps(arr, nodata):
+        Checks if a mosaic has single-cell-wide nodata gaps.
+'''
+
+def fill_gaps(arr, inside, max_distance=16):
+    '''
+    This function fills nodata cells inside a region, e.g., seams between
+    mosaicked tiles, with the majority class of their valid 8 neighbors.
+    Cells filled in one round vote in the next round, so wider gaps are
+    filled from their edges inward with the classes of the nearest valid
+    cells. After max_distance rounds, cells farther from valid data, e.g.,
+    missing imagery, are left as nodata. Ties become noncanopy.
+
+    A cell depends only on cells within max_distance cells, so a block read
+    with a halo of max_distance cells gives the same result as the whole
+    raster.
+
+    Parameters
+    ----------
+        arr : array
+            canopy raster block with noncanopy (0), canopy (1), and nodata
+            (any other value) cells
+        inside : array
+            boolean mask of cells inside the region; nodata outside is not a
+            gap
+        max_distance : int
+            maximum number of rounds, i.e., the distance in cells from valid
+            data up to which gaps are filled
+
+    Returns
+    -------
+        filled, gaps, unfilled
+            filled copy of arr and boolean masks of the gap cells and the
+            gap cells that were not filled
+    '''
+    out = arr.copy()
+    gaps = (arr > 1) & inside
+    unfilled = gaps.copy()
+    for i in range(max_distance):
+        if not unfilled.any():
+            break
+        canopy = box_sum(out == 1, 1)
+        cells = box_sum(out <= 1, 1)
+        ready = unfilled & (cells > 0)
+        if not ready.any():
+            break
+        out[ready] = 2 * canopy[ready] > cells[ready]
+        unfilled &= ~ready
+    return out, gaps, unfilled
+
+def has_gaps(arr, nodata=3):
+    '''
+    This function checks if a mosaic has single-cell-wide nodata gaps, i.e.,
+    nodata cells with at most 2 nodata cells, including themselves, in their
+    3 x 3 neighborhoods. For example, see
+      XXXXXX    XXXXXX    XXXXXX
+      X....X or X..X.X or X.X..X
+      XXXXXX    XXXXXX    X.XX.X
+                          XXXXXX
+    where X and . are non-nodata and nodata cells, respectively. These
+    nodata cells (....) are a nodata gap within non-nodata cells. However, in
+    the following case,
+      ......
+      ....XX
+      ..XXXX
+    the nodata cells are just outside the region boundary. Depending on
+    their locations, this check will fail to flag wider gaps such as the
+    following cases though:
+      XXXXXX    XXXXXX
+      X....X or X.X..X
+      XX...X    X..X.X
+      XXXXXX    XXXXXX
+      6 right   2 middle nodata cells unflagged
+    fill_gaps() finds and fills gaps of any width.
+
+    Parameters
+    ----------
+        arr : array
+            mosaic with nodata cells
+        nodata : int
+            nodata value; cells with larger values are also checked
+
+    Returns
+    -------
+        bool
+            True if gaps are present
+    '''
+    counts = box_sum(arr == nodata, 1)
+    return bool(((arr >= nodata) & (counts <= 2)).any())
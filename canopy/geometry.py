@@ -0,0 +1,305 @@
+import math
+import numpy as np
+
+'''
+Classes
+-------
+    PolygonIndex(polygons):
+        Finds the polygon that contains each point.
+
+Functions
+---------
+    snap_grid(extent, snap_origin, cellsize):
+        Expands an extent outward to the snap grid and returns its origin and
+        dimensions.
+    geometry_rings(geo_interface):
+        Converts a polygon's __geo_interface__ to a list of NumPy rings.
+    polygon_mask(rings, xmin, ymax, cellsize, nrows, ncols):
+        Computes the cells whose centers are inside a polygon using a
+        vectorized scanline even-odd fill.
+    burn_polygons(polygons, values, xmin, ymax, cellsize, nrows, ncols,
+                  nodata, dtype):
+        Burns polygon values onto a raster grid.
+    ring_edges(rings):
+        Returns the closed edges of polygon rings as coordinate arrays.
+    points_in_polygon(x, y, rings):
+        Tests which points are inside a polygon using the even-odd rule.
+'''
+
+def snap_grid(extent, snap_origin, cellsize):
+    '''
+    This function expands an extent outward so that its edges fall on the
+    snap grid.
+
+    Parameters
+    ----------
+        extent : list, tuple
+            (xmin, ymin, xmax, ymax)
+        snap_origin : list, tuple
+            (x, y) of any grid corner of the snap raster, e.g., its upper
+            left corner
+        cellsize : list, tuple
+            (width, height) cell size
+
+    Returns
+    -------
+        xmin, ymax, nrows, ncols
+    '''
+    w, h = cellsize
+    sx, sy = snap_origin
+    # a small tolerance keeps edges already on the grid from moving one cell
+    # because of floating point errors
+    eps = 1e-6
+    xmin = sx + math.floor((extent[0] - sx) / w + eps) * w
+    ymin = sy + math.floor((extent[1] - sy) / h + eps) * h
+    xmax = sx + math.ceil((extent[2] - sx) / w - eps) * w
+    ymax = sy + math.ceil((extent[3] - sy) / h - eps) * h
+    nrows = int(round((ymax - ymin) / h))
+    ncols = int(round((xmax - xmin) / w))
+    return xmin, ymax, nrows, ncols
+
+def geometry_rings(geo_interface):
+    '''
+    This function converts a polygon's __geo_interface__ dictionary to a list
+    of rings. Interior rings need no special treatment because the even-odd
+    rule fills holes correctly.
+
+    Parameters
+    ----------
+        geo_interface : dict
+            GeoJSON-like dictionary of a Polygon or MultiPolygon
+
+    Returns
+    -------
+        list of (n, 2) float arrays
+    '''
+    coords = geo_interface['coordinates']
+    if geo_interface['type'] == 'Polygon':
+        coords = [coords]
+    rings = []
+    for polygon in coords:
+        for ring in polygon:
+            ring = np.asarray(ring, dtype=float)[:, :2]
+            if len(ring) > 2:
+                rings.append(ring)
+    return rings
+
+def polygon_mask(rings, xmin, ymax, cellsize, nrows, ncols):
+    '''
+    This function computes the cells whose centers are inside a polygon
+    using the even-odd rule. For each scanline through cell centers, every
+    edge crossing toggles all the cells to its right; the cumulative sum of
+    toggles modulo 2 is the inside mask. All crossings are computed at once
+    without any Python loop over edges or rows.
+
+    Parameters
+    ----------
+        rings : list
+            list of (n, 2) arrays of polygon rings
+        xmin, ymax : float
+            upper left corner of the grid
+        cellsize : list, tuple
+            (width, height) cell size
+        nrows, ncols : int
+            grid dimensions
+
+    Returns
+    -------
+        row, col, mask
+            upper left row and column of the mask within the grid and a
+            boolean mask array; mask is None if the polygon does not cover
+            any cell center
+    '''
+    w, h = cellsize
+    x0, y0, x1, y1 = ring_edges(rings)
+    if len(x0) == 0:
+        return 0, 0, None
+    # convert to cell coordinates where cell centers are at integers
+    fx0 = (x0 - xmin) / w - 0.5
+    fx1 = (x1 - xmin) / w - 0.5
+    fy0 = (ymax - y0) / h - 0.5
+    fy1 = (ymax - y1) / h - 0.5
+
+    # rows crossed by each edge; the half-open interval [lo, hi) counts a
+    # vertex shared by two edges only once and skips horizontal edges
+    lo = np.clip(np.ceil(np.minimum(fy0, fy1)), 0, nrows).astype(np.int64)
+    hi = np.clip(np.ceil(np.maximum(fy0, fy1)), 0, nrows).astype(np.int64)
+    n = hi - lo
+    keep = n > 0
+    if not keep.any():
+        return 0, 0, None
+    fx0, fx1, fy0, fy1, lo, n = (fx0[keep], fx1[keep], fy0[keep], fy1[keep],
+                                 lo[keep], n[keep])
+
+    # expand edges to one crossing per row
+    edge = np.repeat(np.arange(len(n)), n)
+    rows = lo[edge] + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+    t = (rows - fy0[edge]) / (fy1[edge] - fy0[edge])
+    fx = fx0[edge] + t * (fx1[edge] - fx0[edge])
+    # first cell center to the right of the crossing
+    cols = np.clip(np.ceil(fx), 0, ncols).astype(np.int64)
+
+    r0 = rows.min()
+    c0 = cols.min()
+    height = rows.max() - r0 + 1
+    width = cols.max() - c0 + 1
+    toggles = np.bincount((rows - r0) * width + (cols - c0),
+                          minlength=height * width).reshape(height, width)
+    mask = (np.cumsum(toggles, axis=1) & 1).astype(bool)
+    # the last column only holds toggles at or beyond the grid edge
+    width = min(width, ncols - c0)
+    mask = mask[:, :width]
+    if not mask.any():
+        # e.g., a polygon to the left of the grid
+        return 0, 0, None
+    return r0, c0, mask
+
+def burn_polygons(polygons, values, xmin, ymax, cellsize, nrows, ncols,
+                  nodata, dtype=np.uint8):
+    '''
+    This function burns polygon values onto a raster grid. A cell gets the
+    value of the polygon that contains its center; later polygons overwrite
+    earlier ones.
+
+    Parameters
+    ----------
+        polygons : list
+            list of polygons where each polygon is a list of rings
+        values : list
+            value of each polygon
+        xmin, ymax : float
+            upper left corner of the grid
+        cellsize : list, tuple
+            (width, height) cell size
+        nrows, ncols : int
+            grid dimensions
+        nodata : int
+            value of cells not covered by any polygon
+        dtype : data-type
+            output data type
+
+    Returns
+    -------
+        (nrows, ncols) array
+    '''
+    out = np.full((nrows, ncols), nodata, dtype=dtype)
+    for rings, value in zip(polygons, values):
+        r, c, mask = polygon_mask(rings, xmin, ymax, cellsize, nrows, ncols)
+        if mask is None:
+            continue
+        out[r:r + mask.shape[0], c:c + mask.shape[1]][mask] = value
+    return out
+
+def ring_edges(rings):
+    '''
+    This function closes polygon rings and concatenates their edges.
+
+    Parameters
+    ----------
+        rings : list
+            list of (n, 2) arrays of polygon rings
+
+    Returns
+    -------
+        x0, y0, x1, y1
+            arrays of the start and end coordinates of all edges
+    '''
+    x0 = []
+    y0 = []
+    x1 = []
+    y1 = []
+    for ring in rings:
+        if not np.array_equal(ring[0], ring[-1]):
+            ring = np.vstack((ring, ring[:1]))
+        x0.append(ring[:-1, 0])
+        y0.append(ring[:-1, 1])
+        x1.append(ring[1:, 0])
+        y1.append(ring[1:, 1])
+    if not x0:
+        empty = np.empty(0)
+        return empty, empty, empty, empty
+    return (np.concatenate(x0), np.concatenate(y0), np.concatenate(x1),
+            np.concatenate(y1))
+
+def points_in_polygon(x, y, rings, chunk_size=2**22):
+    '''
+    This function tests which points are inside a polygon using the even-odd
+    rule. Crossings of a ray to the right of each point are counted for all
+    points and edges at once, in chunks of points that keep the temporary
+    arrays under chunk_size elements.
+
+    Parameters
+    ----------
+        x, y : array
+            point coordinates
+        rings : list
+            list of (n, 2) arrays of polygon rings
+        chunk_size : int
+            maximum number of point-edge pairs per chunk
+
+    Returns
+    -------
+        boolean array
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    inside = np.zeros(len(x), dtype=bool)
+    x0, y0, x1, y1 = ring_edges(rings)
+    # horizontal edges are never crossed
+    keep = y0 != y1
+    x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+    if len(x0) == 0:
+        return inside
+    slope = (x1 - x0) / (y1 - y0)
+    step = max(1, chunk_size // len(x0))
+    for i in range(0, len(x), step):
+        px = x[i:i + step, None]
+        py = y[i:i + step, None]
+        # the half-open test counts a vertex shared by two edges only once
+        crosses = ((y0 > py) != (y1 > py)) & (px < x0 + (py - y0) * slope)
+        inside[i:i + step] = np.count_nonzero(crosses, axis=1) & 1
+    return inside
+
+
+class PolygonIndex:
+    '''
+    Finds the polygon that contains each point, e.g., the NAIP tile of each
+    ground truthing point. Bounding boxes are tested first so that only
+    candidate points are tested against each polygon.
+
+    Attributes
+    ----------
+    polygons : list
+        list of polygons where each polygon is a list of rings
+    bounds : (n, 4) array
+        (xmin, ymin, xmax, ymax) of each polygon
+    '''
+    def __init__(self, polygons):
+        self.polygons = polygons
+        bounds = []
+        for rings in polygons:
+            if rings:
+                coords = np.vstack(rings)
+                bounds.append((coords[:, 0].min(), coords[:, 1].min(),
+                               coords[:, 0].max(), coords[:, 1].max()))
+            else:
+                bounds.append((np.inf, np.inf, -np.inf, -np.inf))
+        self.bounds = np.array(bounds, dtype=float).reshape(-1, 4)
+
+    def lookup(self, x, y):
+        '''
+        Returns the index of the polygon that contains each point or -1 if
+        no polygon does. If polygons overlap, the first one wins.
+        '''
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        index = np.full(len(x), -1, dtype=np.int64)
+        for i, (rings, bounds) in enumerate(zip(self.polygons, self.bounds)):
+            todo = np.flatnonzero((index < 0) &
+                                  (x >= bounds[0]) & (x <= bounds[2]) &
+                                  (y >= bounds[1]) & (y <= bounds[3]))
+            if len(todo) == 0:
+                continue
+            inside = points_in_polygon(x[todo], y[todo], rings)
+            index[todo[inside]] = i
+        return index
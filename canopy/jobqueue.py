@@ -0,0 +1,336 @@
+import os
+import re
+import json
+import time
+import socket
+import threading
+import traceback
+
+'''
+Classes
+-------
+    JobQueue(queue_path, lease_seconds, max_attempts):
+        Job queue stored on a shared file system that any number of worker
+        processes on any host can consume.
+
+Functions
+---------
+    worker_name():
+        Returns a name unique to this process across hosts.
+'''
+
+def worker_name():
+    '''
+    This function returns a name unique to this process across hosts.
+    '''
+    return '%s-%d' % (socket.gethostname(), os.getpid())
+
+
+class JobQueue:
+    '''
+    Job queue stored on a shared file system. It uses only operations that
+    are atomic on SMB and NFS shares, i.e., exclusive file creation and
+    rename, so no server process or database is needed.
+
+    The queue folder has the following structure:
+        queue_path/
+            jobs/<job_id>.json      job specifications
+            leases/<job_id>.lease   jobs claimed by a worker
+            done/<job_id>.json      results of finished jobs
+            failed/<job_id>.json    last error and number of attempts
+
+    A worker claims a job by exclusively creating its lease file and renews
+    the lease while the job runs. If a worker crashes, its lease expires
+    after lease_seconds and another worker takes over the job. Two workers
+    may rarely run the same job when a lease expires while its owner is
+    still alive, so jobs must be idempotent; CanoPy jobs write their outputs
+    atomically, so running one twice only wastes time. A worker that lost
+    its lease stops renewing it and leaves the lease of the new holder
+    alone.
+
+    Attributes
+    ----------
+    queue_path : str
+        Queue folder.
+    lease_seconds : float
+        Seconds after which an unrenewed lease expires.
+    max_attempts : int
+        Number of failed attempts after which a job is not retried.
+    '''
+    def __init__(self, queue_path, lease_seconds=300, max_attempts=3):
+        self.queue_path = queue_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        for folder in ('jobs', 'leases', 'done', 'failed'):
+            os.makedirs('%s/%s' % (queue_path, folder), exist_ok=True)
+
+    def __path(self, folder, job_id, ext='json'):
+        return '%s/%s/%s.%s' % (self.queue_path, folder, job_id, ext)
+
+    def __names(self, folder, ext):
+        # Returns job IDs in a folder with one os.scandir() call
+        ext = '.%s' % ext
+        with os.scandir('%s/%s' % (self.queue_path, folder)) as it:
+            return {x.name[:-len(ext)] for x in it if x.name.endswith(ext)}
+
+    @staticmethod
+    def job_id(stage, unit):
+        # Returns a file name safe job ID
+        return re.sub(r'[^\w.-]', '_', '%s-%s' % (stage, unit))
+
+    def __write(self, path, data):
+        # Writes JSON atomically
+        tmp_path = '%s.%s.tmp' % (path, worker_name())
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def __read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, stage, unit, **params):
+        '''
+        Adds a job to the queue. A job that has already finished or failed is
+        queued again because its stage planned it as work again.
+
+        Parameters
+        ----------
+            stage : str
+                Stage name.
+            unit : str
+                Tile or region name that identifies the job within the stage.
+            params : dict
+                Parameters of the job.
+
+        Returns
+        -------
+            str
+                job ID
+        '''
+        job_id = self.job_id(stage, unit)
+        self.__write(self.__path('jobs', job_id),
+                     {'id': job_id, 'stage': stage, 'unit': unit,
+                      'params': params})
+        for folder in ('done', 'failed'):
+            try:
+                os.remove(self.__path(folder, job_id))
+            except FileNotFoundError:
+                pass
+        return job_id
+
+    def __try_lease(self, job_id, worker):
+        # Exclusively creates a lease file; returns True on success
+        lease_path = self.__path('leases', job_id, 'lease')
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'worker': worker,
+                       'expires': time.time() + self.lease_seconds}, f)
+        return True
+
+    def __break_lease(self, job_id, worker):
+        # Removes an expired lease. The lease is first renamed to a name
+        # unique to this worker, which only one worker can do, and removed
+        # only if it is still expired.
+        lease_path = self.__path('leases', job_id, 'lease')
+        lease = self.__read(lease_path)
+        if lease is None or lease['expires'] > time.time():
+            return False
+        broken_path = '%s.%s.broken' % (lease_path, worker)
+        try:
+            os.rename(lease_path, broken_path)
+        except (FileNotFoundError, FileExistsError, PermissionError):
+            return False
+        broken = self.__read(broken_path)
+        if broken is not None and broken['expires'] > time.time():
+            # another worker renewed or took over the lease in the meantime;
+            # put it back
+            try:
+                os.link(broken_path, lease_path)
+            except OSError:
+                pass
+            os.remove(broken_path)
+            return False
+        os.remove(broken_path)
+        print('Lease of %s by %s expired' % (job_id, lease['worker']))
+        return True
+
+    def claim(self, worker, stages=None):
+        '''
+        Claims the next available job.
+
+        Parameters
+        ----------
+            worker : str
+                Worker name.
+            stages : list
+                Stages to claim jobs from; all stages if None.
+
+        Returns
+        -------
+            dict
+                job or None if no job is available right now
+        '''
+        jobs = self.__names('jobs', 'json')
+        done = self.__names('done', 'json')
+        leases = self.__names('leases', 'lease')
+        failed = self.__names('failed', 'json')
+        for job_id in sorted(jobs - done):
+            # job IDs start with the stage name
+            if stages and not any(job_id.startswith('%s-' % x)
+                                  for x in stages):
+                continue
+            if job_id in leases and not self.__break_lease(job_id, worker):
+                continue
+            if job_id in failed:
+                failure = self.__read(self.__path('failed', job_id))
+                if failure is not None and \
+                        failure['attempts'] >= self.max_attempts:
+                    continue
+            job = self.__read(self.__path('jobs', job_id))
+            if job is None:
+                continue
+            if self.__try_lease(job_id, worker):
+                # the job may have finished between listing and leasing
+                if os.path.exists(self.__path('done', job_id)):
+                    self.release(job_id, worker)
+                    continue
+                return job
+        return None
+
+    def renew(self, job_id, worker):
+        # Extends a lease held by worker; returns False if the lease expired
+        # and was broken or taken over by another worker
+        lease_path = self.__path('leases', job_id, 'lease')
+        lease = self.__read(lease_path)
+        if lease is None or lease['worker'] != worker:
+            return False
+        self.__write(lease_path,
+                     {'worker': worker,
+                      'expires': time.time() + self.lease_seconds})
+        return True
+
+    def release(self, job_id, worker):
+        # Removes a lease held by worker. Like in __break_lease(), the lease
+        # is first renamed to a name unique to this worker, so a lease that
+        # another worker took over in the meantime is put back.
+        lease_path = self.__path('leases', job_id, 'lease')
+        released_path = '%s.%s.released' % (lease_path, worker)
+        try:
+            os.rename(lease_path, released_path)
+        except (FileNotFoundError, FileExistsError, PermissionError):
+            return False
+        lease = self.__read(released_path)
+        if lease is None or lease['worker'] != worker:
+            try:
+                os.link(released_path, lease_path)
+            except OSError:
+                pass
+            os.remove(released_path)
+            return False
+        os.remove(released_path)
+        return True
+
+    def complete(self, job_id, worker, result=None, seconds=None):
+        # Marks a job as done and releases its lease
+        self.__write(self.__path('done', job_id),
+                     {'worker': worker, 'result': result,
+                      'seconds': seconds, 'time': time.time()})
+        self.release(job_id, worker)
+
+    def fail(self, job_id, worker, error):
+        # Records a failed attempt and releases the lease
+        failed = self.__read(self.__path('failed', job_id)) or \
+                {'attempts': 0}
+        self.__write(self.__path('failed', job_id),
+                     {'worker': worker, 'error': error,
+                      'attempts': failed['attempts'] + 1,
+                      'time': time.time()})
+        self.release(job_id, worker)
+
+    def status(self):
+        '''
+        Returns the number of jobs that are pending, running, done, and
+        failed for good.
+        '''
+        jobs = self.__names('jobs', 'json')
+        done = self.__names('done', 'json')
+        leases = self.__names('leases', 'lease')
+        failed = 0
+        for job_id in self.__names('failed', 'json') - done:
+            attempts = (self.__read(self.__path('failed', job_id)) or
+                        {'attempts': 0})['attempts']
+            if attempts >= self.max_attempts:
+                failed += 1
+        running = len((leases & jobs) - done)
+        return {'pending': len(jobs - done) - running - failed,
+                'running': running, 'done': len(done & jobs),
+                'failed': failed}
+
+    def work(self, handler, worker=None, stages=None, wait=True,
+             poll_seconds=10):
+        '''
+        Claims and runs jobs until the queue is drained.
+
+        Parameters
+        ----------
+            handler : function
+                Function that takes a job dictionary and returns a JSON
+                serializable result.
+            worker : str
+                Worker name; a name unique to this process if None.
+            stages : list
+                Stages to claim jobs from; all stages if None.
+            wait : bool
+                Whether to keep polling while other workers hold leases that
+                may expire.
+            poll_seconds : float
+                Seconds between polls.
+
+        Returns
+        -------
+            int
+                number of jobs completed by this worker
+        '''
+        if worker is None:
+            worker = worker_name()
+        count = 0
+        while True:
+            job = self.claim(worker, stages)
+            if job is None:
+                status = self.status()
+                if not wait or status['running'] == 0:
+                    break
+                time.sleep(poll_seconds)
+                continue
+            job_id = job['id']
+            print('%s: %s' % (worker, job_id))
+            # renew the lease in the background while the job runs
+            stop = threading.Event()
+            def heartbeat():
+                while not stop.wait(self.lease_seconds / 3):
+                    if not self.renew(job_id, worker):
+                        print('%s: lost the lease of %s' % (worker, job_id))
+                        break
+            thread = threading.Thread(target=heartbeat, daemon=True)
+            thread.start()
+            start_time = time.time()
+            try:
+                result = handler(job)
+            except Exception:
+                stop.set()
+                thread.join()
+                self.fail(job_id, worker, traceback.format_exc())
+                print('%s: %s failed' % (worker, job_id))
+                continue
+            stop.set()
+            thread.join()
+            self.complete(job_id, worker, result, time.time() - start_time)
+            count += 1
+        return count
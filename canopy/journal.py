@@ -0,0 +1,287 @@
+import os
+import json
+import shutil
+import time
+import threading
+from contextlib import contextmanager
+
+'''
+Classes
+-------
+    Journal(results_path, writer):
+        Append-only journal of completed tile and region artifacts.
+
+Functions
+---------
+    atomic_output(path):
+        Context manager that yields a temporary path and renames it to path
+        only if the block completes.
+    remove_dataset(path):
+        Removes a raster or shapefile dataset including its sidecar files.
+    replace_dataset(src_path, dst_path):
+        Renames a dataset including its sidecar files.
+    dataset_size(path):
+        Returns the number of bytes of a dataset including its sidecar files.
+    link_dataset(src_path, dst_path):
+        Hard links a dataset including its sidecar files.
+'''
+
+# Prefix of temporary outputs; stages never pick up files with this prefix
+TMP_PREFIX = 'tmp_'
+
+
+class Journal:
+    '''
+    Append-only journal of completed tile and region artifacts. Each line is
+    a JSON object with the stage, the artifact path relative to the results
+    folder, its size, and the completion time. An artifact is complete only
+    if it is in the journal with the same size as on disk, so a truncated
+    output left by a crash is never mistaken for a finished one.
+
+    Each process appends only to its own journal file, canopy_journal.jsonl
+    or canopy_journal.<writer>.jsonl, because appends from several hosts to
+    one file on a network share are not atomic. All the journal files are
+    read when the journal is loaded. Threads of a process can share a
+    journal.
+
+    Attributes
+    ----------
+    path : str
+        Path to the journal file of this process.
+    exists : bool
+        True if any journal file existed when the journal was loaded.
+    entries : dict
+        Artifact => journal entry.
+    folders : set
+        Top-level folders, e.g., region folders, with recorded or adopted
+        artifacts.
+    '''
+    def __init__(self, results_path, writer=None):
+        self.root = results_path
+        self.writer = writer
+        if writer is None:
+            filename = 'canopy_journal.jsonl'
+        else:
+            filename = 'canopy_journal.%s.jsonl' % writer
+        self.path = '%s/%s' % (results_path, filename)
+        self.entries = {}
+        self.folders = set()
+        # a crash while appending may leave a partial last line
+        self.__partial = False
+        self.__lock = threading.Lock()
+        journal_paths = []
+        try:
+            with os.scandir(results_path) as it:
+                for entry in it:
+                    if entry.name.startswith('canopy_journal.') and \
+                            entry.name.endswith('.jsonl'):
+                        journal_paths.append(entry.path)
+        except FileNotFoundError:
+            pass
+        self.exists = len(journal_paths) > 0
+        for journal_path in sorted(journal_paths):
+            self.__load(journal_path)
+
+    def __load(self, journal_path):
+        with open(journal_path) as f:
+            for line in f:
+                if os.path.basename(journal_path) == \
+                        os.path.basename(self.path):
+                    self.__partial = not line.endswith('\n')
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a partial last line from a crash while appending
+                    continue
+                old = self.entries.get(entry['artifact'])
+                if old is None or old['time'] <= entry['time']:
+                    self.entries[entry['artifact']] = entry
+                self.folders.add(entry['artifact'].split('/', 1)[0])
+
+    def reload(self):
+        # Reads entries appended by other processes since loading
+        self.__init__(self.root, self.writer)
+
+    def artifact(self, path):
+        # Returns the journal key of a path under the results folder
+        return os.path.relpath(path, self.root).replace('\\', '/')
+
+    def get(self, path):
+        return self.entries.get(self.artifact(path))
+
+    def adopted(self, folder):
+        # Returns True if the artifacts of a top-level folder were adopted or
+        # any artifact under it was recorded
+        return self.artifact(folder).split('/', 1)[0] in self.folders
+
+    def is_complete(self, path, size):
+        # Predicate function for whether a file of the given size on disk is
+        # a completed artifact
+        entry = self.get(path)
+        return entry is not None and entry['size'] == size
+
+    def __append(self, entries):
+        # Appends entries and flushes them to disk before returning so that a
+        # crash right after this call does not lose them
+        with self.__lock:
+            if not os.path.exists(self.root):
+                os.makedirs(self.root, exist_ok=True)
+            with open(self.path, 'a') as f:
+                if self.__partial:
+                    f.write('\n')
+                    self.__partial = False
+                for entry in entries:
+                    f.write('%s\n' % json.dumps(entry))
+                f.flush()
+                os.fsync(f.fileno())
+            self.exists = True
+            for entry in entries:
+                self.entries[entry['artifact']] = entry
+                self.folders.add(entry['artifact'].split('/', 1)[0])
+
+    def record(self, stage, path, **info):
+        '''
+        Appends a completed artifact to the journal.
+
+        Parameters
+        ----------
+            stage : str
+                Stage name.
+            path : str
+                Path to the completed artifact.
+            info : dict
+                Additional information to store with the artifact.
+        '''
+        entry = {'stage': stage, 'artifact': self.artifact(path),
+                 'size': os.path.getsize(path), 'time': time.time()}
+        entry.update(info)
+        self.__append([entry])
+        return entry
+
+    def adopt(self, artifacts, folder=None):
+        '''
+        Records existing artifacts created before the journal was introduced
+        as complete in one write.
+
+        Parameters
+        ----------
+            artifacts : list
+                list of (stage, path, size) tuples
+            folder : str
+                top-level folder whose artifacts these are; a marker entry
+                is recorded so that adopted() is True even without any
+                artifacts
+        '''
+        now = time.time()
+        entries = [{'stage': stage, 'artifact': self.artifact(path),
+                    'size': size, 'time': now, 'adopted': True}
+                   for stage, path, size in artifacts]
+        if folder is not None:
+            entries.append({'stage': 'adopt',
+                            'artifact': self.artifact(folder), 'size': 0,
+                            'time': now, 'adopted': True})
+        self.__append(entries)
+
+
+def __sidecars(path):
+    # Returns the names of all the files of a dataset, e.g., x.tif,
+    # x.tif.aux.xml, x.tfw, and x.tif.ovr, or x.shp, x.dbf, and x.shx, with
+    # the main file last
+    dirname, filename = os.path.split(path)
+    stem = os.path.splitext(filename)[0]
+    names = []
+    try:
+        with os.scandir(dirname or '.') as it:
+            for entry in it:
+                if entry.name != filename and \
+                        entry.name.startswith('%s.' % stem):
+                    names.append(entry.name)
+    except FileNotFoundError:
+        return names
+    if os.path.exists(path):
+        names.append(filename)
+    return names
+
+def remove_dataset(path):
+    '''
+    This function removes a raster or shapefile dataset including its
+    sidecar files.
+    '''
+    dirname = os.path.dirname(path)
+    for name in __sidecars(path):
+        os.remove(os.path.join(dirname, name))
+
+def dataset_size(path):
+    '''
+    This function returns the number of bytes of a raster or shapefile
+    dataset including its sidecar files, e.g., to compare output formats.
+    '''
+    dirname = os.path.dirname(path)
+    return sum(os.path.getsize(os.path.join(dirname, name))
+               for name in __sidecars(path))
+
+def link_dataset(src_path, dst_path):
+    '''
+    This function creates hard links to a dataset including its sidecar
+    files, so several folders share one copy on disk. Files are copied
+    instead if the file system cannot link them, e.g., across volumes. The
+    main file is linked last.
+    '''
+    src_dir, src_file = os.path.split(src_path)
+    dst_dir, dst_file = os.path.split(dst_path)
+    src_stem = os.path.splitext(src_file)[0]
+    dst_stem = os.path.splitext(dst_file)[0]
+    for name in __sidecars(src_path):
+        src = os.path.join(src_dir, name)
+        dst = os.path.join(dst_dir, '%s%s' % (dst_stem, name[len(src_stem):]))
+        if os.path.exists(dst):
+            os.remove(dst)
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+
+def replace_dataset(src_path, dst_path):
+    '''
+    This function renames a dataset including its sidecar files. The main
+    file is renamed last, so the existence of dst_path implies that the
+    whole dataset has been replaced. Each rename is atomic within the same
+    file system.
+    '''
+    src_dir, src_file = os.path.split(src_path)
+    dst_dir, dst_file = os.path.split(dst_path)
+    src_stem = os.path.splitext(src_file)[0]
+    dst_stem = os.path.splitext(dst_file)[0]
+    names = __sidecars(src_path)
+    # remove old sidecars, e.g., pyramids, that no longer match the new data
+    new_names = set('%s%s' % (dst_stem, x[len(src_stem):]) for x in names)
+    for name in __sidecars(dst_path):
+        if name != dst_file and name not in new_names:
+            os.remove(os.path.join(dst_dir, name))
+    for name in names:
+        os.replace(os.path.join(src_dir, name),
+                   os.path.join(dst_dir, '%s%s' % (dst_stem,
+                                                  name[len(src_stem):])))
+
+@contextmanager
+def atomic_output(path):
+    '''
+    This context manager yields a temporary path in the same folder as path
+    and renames it to path only if the block completes. Leftovers of a
+    previous crash are removed first. Raster objects holding the temporary
+    file should be deleted before the block ends.
+
+    Parameters
+    ----------
+        path : str
+            Final output path.
+    '''
+    dirname, filename = os.path.split(path)
+    tmp_path = os.path.join(dirname, '%s%s' % (TMP_PREFIX, filename))
+    remove_dataset(tmp_path)
+    try:
+        yield tmp_path
+    except BaseException:
+        remove_dataset(tmp_path)
+        raise
+    replace_dataset(tmp_path, path)
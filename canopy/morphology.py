@@ -0,0 +1,192 @@
+import numpy as np
+
+'''
+Canopy raster blocks hold noncanopy (0) and canopy (1) cells; any other value
+is nodata.
+
+Functions
+---------
+    box_sum(arr, radius):
+        Sums the values of a square neighborhood of each cell.
+    majority_filter(arr, size):
+        Replaces each valid cell with the majority class of its valid
+        neighbors.
+    label_components(mask):
+        Labels the 4-connected components of a mask.
+    sieve(arr, value, min_cells):
+        Replaces small connected components of a class with the other class.
+    cleanup_halo(majority_size, min_cells, max_hole_cells):
+        Returns the halo width for exact blockwise cleanup.
+    clean_canopy(arr, majority_size, min_cells, max_hole_cells):
+        Applies the majority filter, minimum mapping unit sieve, and
+        small-hole fill to a canopy block.
+'''
+
+def box_sum(arr, radius):
+    '''
+    This function sums the values of the (2 * radius + 1) square
+    neighborhood of each cell using a summed-area table. Cells outside the
+    array count as 0.
+    '''
+    size = 2 * radius + 1
+    padded = np.pad(arr.astype(np.int32), radius + 1)[1:, 1:]
+    sat = padded.cumsum(axis=0).cumsum(axis=1)
+    sat = np.pad(sat, ((1, 0), (1, 0)))
+    return (sat[size:, size:] - sat[:-size, size:] - sat[size:, :-size] +
+            sat[:-size, :-size])[:arr.shape[0], :arr.shape[1]]
+
+def majority_filter(arr, size=3):
+    '''
+    This function replaces each noncanopy (0) or canopy (1) cell with the
+    majority class of the valid cells in its size x size neighborhood. Ties
+    keep the original class and nodata cells are not changed.
+
+    Parameters
+    ----------
+        arr : array
+            canopy raster block
+        size : int
+            odd neighborhood width in cells
+
+    Returns
+    -------
+        array
+            filtered copy of arr
+    '''
+    radius = size // 2
+    valid = arr <= 1
+    canopy = box_sum(arr == 1, radius)
+    cells = box_sum(valid, radius)
+    out = arr.copy()
+    out[valid & (2 * canopy > cells)] = 1
+    out[valid & (2 * canopy < cells)] = 0
+    return out
+
+def label_components(mask):
+    '''
+    This function labels the 4-connected components of a mask without any
+    Python loop over cells. Each cell starts as its own tree; trees of
+    neighboring cells are hooked to the smaller root and paths are
+    compressed by pointer jumping until no edge joins two trees, which takes
+    a few rounds per doubling of the component diameter.
+
+    Parameters
+    ----------
+        mask : (nrows, ncols) boolean array
+
+    Returns
+    -------
+        (nrows, ncols) int64 array
+            flat index of the root cell of each cell's component; cells
+            outside the mask are their own roots
+    '''
+    nrows, ncols = mask.shape
+    index = np.arange(mask.size).reshape(mask.shape)
+    right = mask[:, :-1] & mask[:, 1:]
+    down = mask[:-1] & mask[1:]
+    a = np.concatenate((index[:, :-1][right], index[:-1][down]))
+    b = np.concatenate((a[:right.sum()] + 1, a[right.sum():] + ncols))
+    parent = np.arange(mask.size)
+    while len(a):
+        ra = parent[a]
+        rb = parent[b]
+        joined = ra != rb
+        if not joined.any():
+            break
+        a, b, ra, rb = a[joined], b[joined], ra[joined], rb[joined]
+        # hook the larger root to the smaller one; roots only decrease, so
+        # no cycles can form
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+    return parent.reshape(mask.shape)
+
+def sieve(arr, value, min_cells):
+    '''
+    This function replaces 4-connected components of value with fewer than
+    min_cells cells with the other class, e.g., small canopy patches with
+    noncanopy for a minimum mapping unit or small noncanopy holes with
+    canopy. Components that touch nodata or the edge of the array are kept
+    because their full extent is unknown.
+
+    Parameters
+    ----------
+        arr : array
+            canopy raster block
+        value : int
+            class to sieve (0 or 1)
+        min_cells : int
+            components smaller than this are replaced
+
+    Returns
+    -------
+        array
+            sieved copy of arr
+    '''
+    out = arr.copy()
+    mask = arr == value
+    if min_cells <= 1 or not mask.any():
+        return out
+    roots = label_components(mask)
+    sizes = np.bincount(roots[mask], minlength=arr.size)
+    # components next to nodata or the array edge
+    edge = np.zeros(arr.shape, dtype=bool)
+    edge[[0, -1], :] = True
+    edge[:, [0, -1]] = True
+    invalid = arr > 1
+    near = invalid.copy()
+    near[1:] |= invalid[:-1]
+    near[:-1] |= invalid[1:]
+    near[:, 1:] |= invalid[:, :-1]
+    near[:, :-1] |= invalid[:, 1:]
+    kept = np.zeros(arr.size, dtype=bool)
+    kept[roots[mask & (edge | near)]] = True
+    small = mask & (sizes[roots] < min_cells) & ~kept[roots]
+    out[small] = 1 - value
+    return out
+
+def cleanup_halo(majority_size=0, min_cells=0, max_hole_cells=0):
+    '''
+    This function returns the number of cells to read around a block so
+    that clean_canopy() gives the same result for the block as for the
+    whole raster. A component with fewer than n cells spans fewer than n
+    cells, so a halo of that size contains any component that may be
+    sieved.
+    '''
+    return majority_size // 2 + max(min_cells, max_hole_cells + 1)
+
+def clean_canopy(arr, majority_size=0, min_cells=0, max_hole_cells=0):
+    '''
+    This function cleans a canopy raster block before polygonization by
+    applying, in order, a majority filter, a minimum mapping unit sieve
+    that removes canopy patches smaller than min_cells cells, and a
+    small-hole fill that fills noncanopy holes of at most max_hole_cells
+    cells. A step is skipped if its parameter is 0.
+
+    Parameters
+    ----------
+        arr : array
+            canopy raster block including a halo of cleanup_halo() cells
+        majority_size : int
+            odd neighborhood width of the majority filter
+        min_cells : int
+            minimum mapping unit in cells
+        max_hole_cells : int
+            maximum size of filled holes in cells
+
+    Returns
+    -------
+        array
+            cleaned copy of arr
+    '''
+    out = arr
+    if majority_size > 1:
+        out = majority_filter(out, majority_size)
+    if min_cells > 1:
+        out = sieve(out, 1, min_cells)
+    if max_hole_cells > 0:
+        out = sieve(out, 0, max_hole_cells + 1)
+    return out.copy() if out is arr else out
@@ -0,0 +1,127 @@
+import math
+import numpy as np
+
+'''
+Scores of the objective function that chooses training NAIP tiles whose NLCD
+land cover best represents a physiographic region. These functions only need
+NumPy, so they can be used and tested without ArcGIS.
+
+Functions
+---------
+    class_counts(arr, nodata):
+        Counts the cells of each class in an NLCD array.
+    objective_value(region_lc, tile_lc, weight):
+        Computes the objective function value of a tile.
+    rank_tiles(region_lc, tiles_lc):
+        Sorts tiles by their unweighted objective function values.
+    weighted_best_tiles(region_lc, tiles_lc, max_weight):
+        Finds the tile with the lowest objective function value for each
+        weight.
+'''
+
+def class_counts(arr, nodata=0):
+    '''
+    This function counts the cells of each class in an NLCD array. Nodata
+    cells are not counted.
+
+    Parameters
+    ----------
+        arr : array
+            NLCD array
+        nodata : int
+            nodata value, which is not an NLCD class
+
+    Returns
+    -------
+        dict
+            class => number of cells
+    '''
+    unique, counts = np.unique(arr, return_counts=True)
+    lc = dict(zip(unique, counts))
+    lc.pop(nodata, None)
+    return lc
+
+def objective_value(region_lc, tile_lc, weight=0):
+    '''
+    This function computes the objective function value of a tile, i.e., the
+    sum over the classes of the region of the squared difference between the
+    region and tile class fractions plus a weighted penalty for the classes
+    missing from the tile. A class missing from the tile has a fraction of
+    0.
+
+    Parameters
+    ----------
+        region_lc : dict
+            class => number of cells in the region
+        tile_lc : dict
+            class => number of cells in the tile
+        weight : int
+            weight of the penalty for missing classes; 0 for the unweighted
+            function
+
+    Returns
+    -------
+        float
+            objective function value; lower is more representative
+    '''
+    region_total = sum(region_lc.values())
+    tile_total = sum(tile_lc.values())
+    penalty = weight * (len(region_lc) / 20 - len(tile_lc) / 20) ** 2
+    d = []
+    for j in region_lc.keys():
+        G = region_lc.get(j) / region_total
+        L = tile_lc.get(j) / tile_total if j in tile_lc else 0
+        d.append((G - L) ** 2 + penalty)
+    return math.fsum(d)
+
+def rank_tiles(region_lc, tiles_lc):
+    '''
+    This function sorts tiles by their unweighted objective function values.
+    Tiles with the same value keep the order of tiles_lc.
+
+    Parameters
+    ----------
+        region_lc : dict
+            class => number of cells in the region
+        tiles_lc : dict
+            tile => class counts of the tile
+
+    Returns
+    -------
+        dict
+            tile => objective function value in ascending order of values
+    '''
+    out_index = dict((i, objective_value(region_lc, tile_lc))
+                     for i, tile_lc in tiles_lc.items())
+    return {k: v for k, v in sorted(out_index.items(),
+                                    key=lambda item: item[1])}
+
+def weighted_best_tiles(region_lc, tiles_lc, max_weight=20):
+    '''
+    This function finds the tile with the lowest weighted objective function
+    value for each weight from 0 to max_weight, one per NLCD class. Of tiles
+    with the same value, the first in tiles_lc is chosen.
+
+    Parameters
+    ----------
+        region_lc : dict
+            class => number of cells in the region
+        tiles_lc : dict
+            tile => class counts of the tile
+        max_weight : int
+            largest weight
+
+    Returns
+    -------
+        dict
+            weight => [tile, objective function value]
+    '''
+    weighted_tiles = {}
+    for weight in range(max_weight + 1):
+        best = None
+        for i, tile_lc in tiles_lc.items():
+            value = objective_value(region_lc, tile_lc, weight)
+            if best is None or value < best[1]:
+                best = [i, value]
+        weighted_tiles[weight] = best
+    return weighted_tiles
@@ -0,0 +1,459 @@
+import os
+
+'''
+Classes
+-------
+    DirectoryIndex(path):
+        Snapshot of the files in one folder taken with a single os.scandir()
+        call.
+    NaipIndex(naip_path):
+        Lazily scanned index of the original NAIP imagery folders.
+    StagePlan(stage):
+        Work list of one stage for one physiographic region.
+    RegionPlan(name, phyreg_id, tiles, results_path, naip_index,
+               analysis_year, journal):
+        Work lists of all stages for one physiographic region.
+    WorkPlan(regions, results_path, naip_path, analysis_year, journal):
+        Work lists of all stages for all selected physiographic regions.
+
+Functions
+---------
+    tile_store_path(results_path, analysis_year):
+        Returns the folder of reprojected NAIP tiles shared by all regions.
+'''
+
+# Processing stages in the order they are run
+STAGES = ('reproject', 'afe', 'convert', 'clip', 'mosaic')
+
+def tile_store_path(results_path, analysis_year):
+    '''
+    This function returns the folder of reprojected NAIP tiles of a year.
+    Tiles that intersect several regions are reprojected into it only once
+    and linked into the Inputs folder of each region.
+    '''
+    return '%s/Tiles_%d' % (results_path, analysis_year)
+
+
+class DirectoryIndex:
+    '''
+    Snapshot of the files in one folder. The folder is scanned only once with
+    os.scandir() so that membership, size, and modification time lookups do
+    not need a round trip to the (network) file system.
+    '''
+    def __init__(self, path):
+        self.path = path
+        # file name => (size, mtime)
+        self.entries = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_file():
+                        st = entry.stat()
+                        self.entries[entry.name] = (st.st_size, st.st_mtime)
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, filename):
+        return filename in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def size(self, filename):
+        return self.entries[filename][0]
+
+    def mtime(self, filename):
+        return self.entries[filename][1]
+
+    def names(self, prefix='', suffix=''):
+        # Returns a set of file names that start with prefix and end with
+        # suffix
+        return {x for x in self.entries
+                if x.startswith(prefix) and x.endswith(suffix)}
+
+    def add(self, filename):
+        # Records a file newly created by a stage. This costs one stat call
+        # instead of rescanning the whole folder.
+        st = os.stat('%s/%s' % (self.path, filename))
+        self.entries[filename] = (st.st_size, st.st_mtime)
+
+    def discard(self, filename):
+        self.entries.pop(filename, None)
+
+
+class NaipIndex:
+    '''
+    Lazily scanned index of the original NAIP imagery folders. Each 5-digit
+    folder under naip_path is scanned at most once.
+    '''
+    def __init__(self, naip_path):
+        self.naip_path = naip_path
+        self.folders = {}
+
+    def folder(self, folder):
+        if folder not in self.folders:
+            self.folders[folder] = DirectoryIndex('%s/%s' % (self.naip_path,
+                                                             folder))
+        return self.folders[folder]
+
+    def lookup(self, filename):
+        # Returns (size, mtime) of an original NAIP tile or None if it does
+        # not exist
+        return self.folder(filename[2:7]).entries.get(filename)
+
+
+class StagePlan:
+    '''
+    Work list of one stage for one physiographic region.
+
+    Attributes
+    ----------
+    stage : str
+        Stage name.
+    todo : list
+        Units (tile names or the region name) that have never been processed.
+    stale : list
+        Units whose output exists, but is older than its input.
+    done : list
+        Units whose output exists and is up to date.
+    missing : list
+        Units that cannot be processed because their input does not exist.
+    bytes : int
+        Estimated number of input bytes to be read for todo and stale units.
+    '''
+    def __init__(self, stage):
+        self.stage = stage
+        self.todo = []
+        self.stale = []
+        self.done = []
+        self.missing = []
+        self.bytes = 0
+
+    @property
+    def work(self):
+        # Units to process in this stage
+        return self.todo + self.stale
+
+    def classify(self, unit, in_entry, out_entry, outdated=False):
+        # Sorts a unit into the right list given the (size, mtime) tuples of
+        # its input and output; None means the file does not exist. An
+        # existing output is also stale if outdated is True.
+        if out_entry is None:
+            if in_entry is None:
+                self.missing.append(unit)
+            else:
+                self.todo.append(unit)
+                self.bytes += in_entry[0]
+        elif in_entry is not None and (outdated or
+                                       in_entry[1] > out_entry[1]):
+            self.stale.append(unit)
+            self.bytes += in_entry[0]
+        else:
+            self.done.append(unit)
+
+
+class RegionPlan:
+    '''
+    Work lists of all stages for one physiographic region. The Inputs and
+    Outputs folders of the region are scanned only once.
+
+    Attributes
+    ----------
+    name : str
+        Physiographic region name with spaces and dashes replaced.
+    phyreg_id : int
+        Physiographic region ID.
+    tiles : list
+        Sorted (oid, filename) tuples of the NAIP tiles intersecting the
+        region where filename has neither the r prefix nor the extension.
+    inputs : DirectoryIndex
+        Index of the Inputs folder.
+    outputs : DirectoryIndex
+        Index of the Outputs folder.
+    complete_inputs : dict
+        Entries of inputs that are complete according to the journal.
+    complete_outputs : dict
+        Entries of outputs that are complete according to the journal.
+    stages : dict
+        Stage name => StagePlan.
+    journal : Journal
+        Journal of completed artifacts. If given, outputs not recorded in the
+        journal, e.g., truncated files left by a crash, are processed again.
+        If None, all existing outputs are trusted.
+    inverted : bool
+        Whether the trained model of the region produces an inverted result.
+        The convert stage then inverts the values of final tiles, and final
+        tiles, clipped tiles, and the canopy TIFF are stale if the inversion
+        recorded in the journal does not match.
+    prefiltered : set
+        Tiles whose clipped final tile was written directly as noncanopy by
+        the vegetation prefilter. They are done in all tile stages.
+    '''
+    def __init__(self, name, phyreg_id, tiles, results_path, naip_index,
+                 analysis_year, journal=None, inverted=False):
+        self.name = name
+        self.phyreg_id = phyreg_id
+        self.tiles = sorted(tiles, key=lambda x: x[1])
+        self.inputs_path = '%s/%s/Inputs' % (results_path, name)
+        self.outputs_path = '%s/%s/Outputs' % (results_path, name)
+        self.inputs = DirectoryIndex(self.inputs_path)
+        self.outputs = DirectoryIndex(self.outputs_path)
+        self.naip_index = naip_index
+        self.analysis_year = analysis_year
+        self.journal = journal
+        self.inverted = inverted
+        self.oids = dict((x[1], x[0]) for x in self.tiles)
+        self.stages = {}
+        self.update()
+
+    def update(self):
+        # (Re)computes all the stage work lists from the folder indexes
+        for stage in STAGES:
+            self.stages[stage] = StagePlan(stage)
+        inputs = self.complete_inputs = self.__trusted(self.inputs)
+        # AFE outputs are created outside CanoPy, so they are always trusted
+        outputs = self.complete_outputs = self.__trusted(self.outputs, 'r')
+        cfr_bytes = 0
+        cfr_mtime = None
+        cfr_inverted = []
+        self.prefiltered = set()
+        for oid, filename in self.tiles:
+            cfrtif = outputs.get('cfr%s.tif' % filename)
+            if cfrtif is not None and self.__prefiltered(filename):
+                # no possible canopy; nothing to reproject, classify,
+                # convert, or clip
+                self.prefiltered.add(filename)
+                for stage in STAGES[:-1]:
+                    self.stages[stage].done.append(filename)
+            else:
+                # reproject original NAIP tiles
+                source = self.naip_index.lookup('%s.tif' % filename)
+                rtif = inputs.get('r%s.tif' % filename)
+                self.stages['reproject'].classify(filename, source, rtif)
+
+                # classify reprojected tiles using Feature Analyst; this is a
+                # manual step, so only report tiles without any AFE output
+                afe = outputs.get('r%s.shp' % filename) or \
+                        outputs.get('r%s.tif' % filename)
+                self.stages['afe'].classify(filename, rtif, afe)
+
+                # convert AFE outputs to final tiles
+                frtif = outputs.get('fr%s.tif' % filename)
+                fr_inverted = self.inversion_applied('fr%s.tif' % filename)
+                self.stages['convert'].classify(filename, afe, frtif,
+                                                fr_inverted != self.inverted)
+
+                # clip final tiles
+                self.stages['clip'].classify(filename, frtif, cfrtif,
+                        self.inversion_applied('cfr%s.tif' % filename) !=
+                        fr_inverted)
+            if cfrtif is not None:
+                cfr_inverted.append(self.inversion_applied('cfr%s.tif' %
+                                                           filename))
+                cfr_bytes += cfrtif[0]
+                if cfr_mtime is None or cfrtif[1] > cfr_mtime:
+                    cfr_mtime = cfrtif[1]
+
+        # mosaic clipped final tiles; the input entry is the total size of
+        # all clipped tiles and the modification time of the newest one
+        cfr = None if cfr_mtime is None else (cfr_bytes, cfr_mtime)
+        canopytif = outputs.get(self.canopytif_filename)
+        self.stages['mosaic'].classify(self.name, cfr, canopytif,
+                self.inversion_applied(self.canopytif_filename) !=
+                (len(cfr_inverted) > 0 and all(cfr_inverted)))
+
+    def inversion_applied(self, filename):
+        '''
+        Returns True if the values of an output in the Outputs folder were
+        inverted for an inverted region when it was created according to
+        the journal. Outputs of the old layout, where only the canopy TIFF
+        was corrected into a separate corrected_ file, return False.
+        '''
+        if self.journal is None:
+            return False
+        entry = self.journal.get('%s/%s' % (self.outputs_path, filename))
+        return entry is not None and entry.get('inverted', False)
+
+    def __prefiltered(self, filename):
+        # Returns True if the clipped final tile was written by the
+        # vegetation prefilter according to the journal
+        if self.journal is None:
+            return False
+        entry = self.journal.get('%s/cfr%s.tif' % (self.outputs_path,
+                                                  filename))
+        return entry is not None and entry['stage'] == 'prefilter'
+
+    def __trusted(self, index, prefix=None):
+        # Returns the entries of a folder index that are complete according
+        # to the journal or start with prefix
+        if self.journal is None:
+            return index.entries
+        entries = {}
+        for filename, entry in index.entries.items():
+            if (prefix and filename.startswith(prefix)) or \
+                    self.journal.is_complete('%s/%s' % (index.path, filename),
+                                             entry[0]):
+                entries[filename] = entry
+        return entries
+
+    def artifacts(self):
+        # Returns (stage, path, size) tuples of all existing outputs created
+        # by CanoPy
+        artifacts = []
+        for oid, filename in self.tiles:
+            for stage, index, prefix in (('reproject', self.inputs, 'r'),
+                                         ('convert', self.outputs, 'fr'),
+                                         ('clip', self.outputs, 'cfr')):
+                out = '%s%s.tif' % (prefix, filename)
+                if out in index:
+                    artifacts.append((stage, '%s/%s' % (index.path, out),
+                                      index.size(out)))
+        for out in ('mosaic_%d_%s.tif' % (self.analysis_year, self.name),
+                    self.canopytif_filename):
+            if out in self.outputs:
+                artifacts.append(('mosaic', '%s/%s' % (self.outputs_path,
+                                                       out),
+                                  self.outputs.size(out)))
+        return artifacts
+
+    @property
+    def canopytif_filename(self):
+        return 'canopy_%d_%s.tif' % (self.analysis_year, self.name)
+
+    @property
+    def missing_afe(self):
+        # Reprojected inputs without any classified output formatted the same
+        # way Feature Analyst specifies batch inputs
+        return ['r%s.tif' % x for x in self.stages['afe'].work]
+
+    def stage(self, stage):
+        return self.stages[stage]
+
+
+class WorkPlan:
+    '''
+    Work lists of all stages for all selected physiographic regions.
+
+    Attributes
+    ----------
+    regions : list
+        List of RegionPlan objects.
+    tile_store : DirectoryIndex
+        Index of the shared folder of reprojected NAIP tiles.
+    journal : Journal
+        Journal of completed artifacts or None.
+    '''
+    def __init__(self, regions, results_path, naip_path, analysis_year,
+                 journal=None, inverted_phyreg_ids=()):
+        '''
+        Parameters
+        ----------
+            regions : list
+                List of (name, phyreg_id, tiles) tuples where tiles is a list
+                of (oid, filename) tuples.
+            results_path : str
+                Folder which contains all outputs.
+            naip_path : str
+                Path to NAIP directory.
+            analysis_year : int
+                Specifies which year is being analyzed.
+            journal : Journal
+                Journal of completed artifacts or None to trust all existing
+                outputs.
+            inverted_phyreg_ids : list
+                IDs of regions whose model produces an inverted result.
+        '''
+        self.naip_index = NaipIndex(naip_path)
+        self.tile_store = DirectoryIndex(tile_store_path(results_path,
+                                                         analysis_year))
+        self.journal = journal
+        self.regions = [RegionPlan(name, phyreg_id, tiles, results_path,
+                                   self.naip_index, analysis_year, journal,
+                                   phyreg_id in inverted_phyreg_ids)
+                        for name, phyreg_id, tiles in regions]
+
+    def __iter__(self):
+        return iter(self.regions)
+
+    def stored(self, filename):
+        '''
+        Returns True if the shared tile store has a complete reprojected
+        tile that is not older than its original NAIP tile. filename has
+        neither the r prefix nor the extension. Without a journal, existing
+        tiles are trusted.
+        '''
+        entry = self.tile_store.entries.get('r%s.tif' % filename)
+        if entry is None:
+            return False
+        if self.journal is not None and self.journal.exists and \
+                not self.journal.is_complete('%s/r%s.tif' %
+                                             (self.tile_store.path, filename),
+                                             entry[0]):
+            return False
+        source = self.naip_index.lookup('%s.tif' % filename)
+        return source is None or source[1] <= entry[1]
+
+    def stored_artifacts(self, region):
+        '''
+        Returns (stage, path, size) tuples of the reprojected tiles of a
+        region in the shared tile store.
+        '''
+        return [('reproject', '%s/r%s.tif' % (self.tile_store.path, x),
+                 self.tile_store.size('r%s.tif' % x))
+                for oid, x in region.tiles
+                if 'r%s.tif' % x in self.tile_store]
+
+    def reproject_units(self):
+        '''
+        Returns the reproject work of all regions grouped by tile as a
+        dictionary of filename => list of RegionPlan objects in processing
+        order.
+        '''
+        units = {}
+        for region in self.regions:
+            for filename in region.stage('reproject').work:
+                units.setdefault(filename, []).append(region)
+        return units
+
+    def report(self):
+        '''
+        Returns a dry-run report with tile counts and estimated input bytes
+        for each stage and region.
+        '''
+        lines = []
+        fmt = '%-10s %8s %8s %8s %8s %12s'
+        totals = {}
+        for region in self.regions:
+            lines.append('%s (%d tiles)' % (region.name, len(region.tiles)))
+            lines.append(fmt % ('stage', 'todo', 'stale', 'done', 'missing',
+                                'MiB'))
+            for stage in STAGES:
+                plan = region.stages[stage]
+                lines.append(fmt % (stage, len(plan.todo), len(plan.stale),
+                                    len(plan.done), len(plan.missing),
+                                    '%.1f' % (plan.bytes / 1048576)))
+                total = totals.setdefault(stage, [0, 0, 0, 0, 0])
+                total[0] += len(plan.todo)
+                total[1] += len(plan.stale)
+                total[2] += len(plan.done)
+                total[3] += len(plan.missing)
+                total[4] += plan.bytes
+            if region.stages['afe'].work:
+                lines.append('Missing classified file: %s' %
+                             '; '.join(region.missing_afe))
+            lines.append('')
+        lines.append('Total')
+        lines.append(fmt % ('stage', 'todo', 'stale', 'done', 'missing',
+                            'MiB'))
+        for stage in STAGES:
+            total = totals.get(stage, [0, 0, 0, 0, 0])
+            lines.append(fmt % (stage, total[0], total[1], total[2],
+                                total[3], '%.1f' % (total[4] / 1048576)))
+        units = self.reproject_units()
+        if units:
+            lines.append('')
+            lines.append('Tile store: %d region tiles need %d reprojected '
+                         'tiles, %d already stored' %
+                         (sum(len(x) for x in units.values()), len(units),
+                          sum(1 for x in units if self.stored(x))))
+        return '\n'.join(lines)
@@ -0,0 +1,185 @@
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+'''
+Classes
+-------
+    Prefetcher(paths, scratch_path, max_tiles, max_bytes, num_threads,
+               sizes, fetch):
+        Copies upcoming source tiles from slow storage to a local scratch
+        folder in background threads.
+'''
+
+
+class Prefetcher:
+    '''
+    Copies upcoming source tiles from slow storage to a local scratch folder
+    in background threads while the current tile is processed. At most
+    max_tiles tiles and max_bytes bytes are copied ahead; the copy of the
+    next tile waits until the consumer has finished enough tiles to free the
+    budget. A tile larger than the byte budget is still copied when nothing
+    else is held, so the prefetcher never deadlocks.
+
+    Iterating over a Prefetcher yields a local path for each source path in
+    the same order. The local copy of a tile is removed when the next one is
+    requested. If a copy fails, the source path is yielded instead.
+
+    Usage
+    -----
+        with Prefetcher(paths, 'D:/scratch') as prefetcher:
+            for path, local_path in zip(paths, prefetcher):
+                process(local_path)
+
+    Attributes
+    ----------
+    paths : list
+        Source paths in processing order.
+    scratch_path : str
+        Local scratch folder; if None, source paths are yielded unchanged.
+    max_tiles : int
+        Maximum number of tiles copied ahead.
+    max_bytes : int
+        Maximum number of bytes held in the scratch folder.
+    '''
+    def __init__(self, paths, scratch_path, max_tiles=4,
+                 max_bytes=2 * 1024**3, num_threads=2, sizes=None,
+                 fetch=None):
+        '''
+        Parameters
+        ----------
+            paths : list
+                Source paths in processing order.
+            scratch_path : str
+                Local scratch folder; if None, nothing is prefetched.
+            max_tiles : int
+                Maximum number of tiles copied ahead.
+            max_bytes : int
+                Maximum number of bytes held in the scratch folder.
+            num_threads : int
+                Number of copy threads.
+            sizes : list
+                Sizes of the source files if already known, e.g., from a
+                folder index; they are read with os.stat() otherwise.
+            fetch : function
+                Function that takes a source path and returns a local path
+                to read, e.g., the get() method of a tile cache. Files
+                returned by fetch are owned by it and never removed by the
+                prefetcher. By default, files are copied to scratch_path.
+        '''
+        self.paths = list(paths)
+        self.scratch_path = scratch_path
+        self.max_tiles = max(1, max_tiles)
+        self.max_bytes = max_bytes
+        self.num_threads = num_threads
+        self.sizes = sizes
+        self.fetch = fetch
+        self.__cond = threading.Condition()
+        self.__held_bytes = 0
+        self.__held_tiles = 0
+        self.__closed = False
+        self.__futures = []
+        self.__executor = None
+        self.__dispatcher = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __size(self, i):
+        if self.sizes is not None:
+            return self.sizes[i]
+        try:
+            return os.path.getsize(self.paths[i])
+        except OSError:
+            return 0
+
+    def __copy(self, i, size):
+        src_path = self.paths[i]
+        local_path = '%s/%d_%s' % (self.scratch_path, i,
+                                   os.path.basename(src_path))
+        try:
+            if self.fetch is not None:
+                return self.fetch(src_path), size, None
+            part_path = '%s.part' % local_path
+            shutil.copyfile(src_path, part_path)
+            os.replace(part_path, local_path)
+            return local_path, size, local_path
+        except Exception as e:
+            print('Prefetching %s failed: %s' % (src_path, e))
+            return src_path, size, None
+
+    def __dispatch(self):
+        # Submits copies in order as long as the budget allows
+        for i in range(len(self.paths)):
+            size = self.__size(i)
+            with self.__cond:
+                while not self.__closed and self.__held_tiles > 0 and \
+                        (self.__held_tiles >= self.max_tiles or
+                         self.__held_bytes + size > self.max_bytes):
+                    self.__cond.wait()
+                if self.__closed:
+                    return
+                self.__held_tiles += 1
+                self.__held_bytes += size
+                self.__futures.append(self.__executor.submit(self.__copy, i,
+                                                             size))
+                self.__cond.notify_all()
+
+    def __release(self, size, local_path):
+        if local_path is not None:
+            try:
+                os.remove(local_path)
+            except OSError:
+                pass
+        with self.__cond:
+            self.__held_tiles -= 1
+            self.__held_bytes -= size
+            self.__cond.notify_all()
+
+    def __iter__(self):
+        if self.scratch_path is None and self.fetch is None:
+            yield from self.paths
+            return
+        if self.scratch_path is not None:
+            os.makedirs(self.scratch_path, exist_ok=True)
+        self.__executor = ThreadPoolExecutor(max_workers=self.num_threads)
+        self.__dispatcher = threading.Thread(target=self.__dispatch,
+                                             daemon=True)
+        self.__dispatcher.start()
+        for i in range(len(self.paths)):
+            with self.__cond:
+                while len(self.__futures) <= i and not self.__closed:
+                    self.__cond.wait()
+                if self.__closed:
+                    return
+                future = self.__futures[i]
+            path, size, local_path = future.result()
+            try:
+                yield path
+            finally:
+                self.__release(size, local_path)
+        self.close()
+
+    def close(self):
+        '''
+        Stops prefetching and removes local copies that were not consumed.
+        '''
+        with self.__cond:
+            if self.__closed:
+                return
+            self.__closed = True
+            self.__cond.notify_all()
+        if self.__dispatcher is not None:
+            self.__dispatcher.join()
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=True, cancel_futures=True)
+            for future in self.__futures:
+                if future.done() and not future.cancelled():
+                    local_path = future.result()[2]
+                    if local_path is not None and \
+                            os.path.exists(local_path):
+                        os.remove(local_path)
@@ -0,0 +1,278 @@
+import re
+import math
+import numpy as np
+
+'''
+NAIP quarter quadrangles (QQ's) form a regular 3.75-minute grid on NAD83
+geographic coordinates. Their identifiers are encoded in NAIP filenames,
+e.g., m_3408301_ne_17_1_20090929.tif, where
+    34083   latitude and west longitude of the southeast corner of the
+            1-degree cell
+    01      7.5-minute quadrangle number in the cell from 01 at the northwest
+            corner to 64 at the southeast corner, west to east and north to
+            south
+    ne      quarter of the quadrangle (ne, nw, se, or sw)
+The rest of the filename, i.e., the UTM zone, resolution, and acquisition
+date, depends on the year. In this module, QQ's are identified by integer
+codes that can be computed for many points at once.
+
+Classes
+-------
+    QQIndex(filenames):
+        Resolves QQ codes to the NAIP filenames of a year.
+
+Functions
+---------
+    parse_qq(name):
+        Parses a QQ identifier or NAIP filename.
+    build_qq(lat, lon, quad, quarter):
+        Builds a QQ identifier.
+    qq_code(name):
+        Returns the QQ code of a QQ identifier or NAIP filename.
+    qq_id(code):
+        Returns the QQ identifier of a QQ code.
+    lonlat_to_qq(lon, lat):
+        Computes the QQ codes of geographic coordinates.
+    projected_to_lonlat(x, y, wkid):
+        Converts projected coordinates to geographic coordinates.
+    xy_to_qq(x, y, wkid):
+        Computes the QQ codes of projected coordinates.
+'''
+
+QUARTERS = ('nw', 'ne', 'sw', 'se')
+
+# 7.5-minute quadrangles per 1-degree cell side
+QUADS = 8
+
+__qq_re = re.compile(r'(\d{2})(\d{3})(\d{2})_(nw|ne|sw|se)', re.IGNORECASE)
+
+def parse_qq(name):
+    '''
+    This function parses a QQ identifier or NAIP filename, e.g.,
+    m_3408301_ne, m_3408301_ne_17_1_20090929.tif, or an output filename
+    derived from it such as rm_3408301_ne_17_1_20090929.tif.
+
+    Parameters
+    ----------
+        name : str
+            QQ identifier or filename
+
+    Returns
+    -------
+        lat, lon, quad, quarter
+            latitude and west longitude of the 1-degree cell, quadrangle
+            number (1-64), and quarter (nw, ne, sw, or se)
+    '''
+    match = __qq_re.search(name)
+    if match is None:
+        raise ValueError('Not a NAIP QQ name: %s' % name)
+    return (int(match.group(1)), int(match.group(2)), int(match.group(3)),
+            match.group(4).lower())
+
+def build_qq(lat, lon, quad, quarter):
+    '''
+    This function builds a QQ identifier such as m_3408301_ne. NAIP
+    filenames of any year start with it.
+    '''
+    return 'm_%02d%03d%02d_%s' % (lat, lon, quad, quarter)
+
+def qq_code(name):
+    '''
+    This function returns the integer code of a QQ identifier or NAIP
+    filename.
+    '''
+    lat, lon, quad, quarter = parse_qq(name)
+    return ((lat * 1000 + lon) * 100 + quad) * 4 + QUARTERS.index(quarter)
+
+def qq_id(code):
+    '''
+    This function returns the QQ identifier of an integer QQ code.
+    '''
+    code = int(code)
+    quarter = QUARTERS[code % 4]
+    code //= 4
+    return build_qq(code // 100000, code // 100 % 1000, code % 100, quarter)
+
+def lonlat_to_qq(lon, lat):
+    '''
+    This function computes the QQ codes of geographic coordinates in the
+    western and northern hemispheres using only array arithmetic.
+
+    Parameters
+    ----------
+        lon, lat : array
+            longitude and latitude in decimal degrees on NAD83
+
+    Returns
+    -------
+        int64 array of QQ codes
+    '''
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    # 1-degree cell by its southeast corner
+    cell_lat = np.floor(lat)
+    cell_lon = np.floor(-lon)
+    # position in 1/16-degree (3.75-minute) units from the northwest corner
+    # of the cell
+    rows = np.clip(np.floor((cell_lat + 1 - lat) * QUADS * 2), 0,
+                   QUADS * 2 - 1).astype(np.int64)
+    cols = np.clip(np.floor((lon + cell_lon + 1) * QUADS * 2), 0,
+                   QUADS * 2 - 1).astype(np.int64)
+    quad = rows // 2 * QUADS + cols // 2 + 1
+    # QUARTERS is ordered nw, ne, sw, se
+    quarter = rows % 2 * 2 + cols % 2
+    return ((cell_lat.astype(np.int64) * 1000 +
+             cell_lon.astype(np.int64)) * 100 + quad) * 4 + quarter
+
+# Albers equal-area conic parameters by WKID: semi-major axis, inverse
+# flattening, standard parallels, latitude and longitude of origin, false
+# easting and northing
+ALBERS = {
+    # USA Contiguous Albers Equal Area Conic USGS version (NAD83)
+    102039: (6378137., 298.257222101, 29.5, 45.5, 23., -96., 0., 0.),
+    # NAD83 / Conus Albers
+    5070: (6378137., 298.257222101, 29.5, 45.5, 23., -96., 0., 0.),
+    # USA Contiguous Albers Equal Area Conic (NAD83)
+    102003: (6378137., 298.257222101, 29.5, 45.5, 37.5, -96., 0., 0.),
+}
+
+def projected_to_lonlat(x, y, wkid):
+    '''
+    This function converts projected coordinates to NAD83 geographic
+    coordinates with the inverse ellipsoidal Albers equal-area conic
+    projection (Snyder, 1987, pp. 101-102). Geographic coordinate systems
+    (WKIDs 4269 and 4326) are returned unchanged.
+
+    Parameters
+    ----------
+        x, y : array
+            projected coordinates
+        wkid : int
+            WKID of the coordinate system; see ALBERS
+
+    Returns
+    -------
+        lon, lat
+            arrays in decimal degrees
+
+    Raises
+    ------
+        ValueError
+            if the coordinate system is not supported
+    '''
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if wkid in (4269, 4326):
+        return x, y
+    if wkid not in ALBERS:
+        raise ValueError('Unsupported WKID: %s' % wkid)
+    a, rf, lat1, lat2, lat0, lon0, x0, y0 = ALBERS[wkid]
+    f = 1 / rf
+    e2 = 2 * f - f**2
+    e = math.sqrt(e2)
+
+    def m(lat):
+        return math.cos(lat) / math.sqrt(1 - e2 * math.sin(lat)**2)
+
+    def q(sin_lat):
+        return (1 - e2) * (sin_lat / (1 - e2 * sin_lat**2) - 1 / (2 * e) *
+                           np.log((1 - e * sin_lat) / (1 + e * sin_lat)))
+
+    lat1, lat2, lat0 = map(math.radians, (lat1, lat2, lat0))
+    m1 = m(lat1)
+    m2 = m(lat2)
+    q1 = q(math.sin(lat1))
+    q2 = q(math.sin(lat2))
+    q0 = q(math.sin(lat0))
+    n = (m1**2 - m2**2) / (q2 - q1)
+    C = m1**2 + n * q1
+    rho0 = a * math.sqrt(C - n * q0) / n
+
+    x = x - x0
+    y = rho0 - (y - y0)
+    rho = np.hypot(x, y)
+    theta = np.arctan2(x, y)
+    qq = (C - (rho * n / a)**2) / n
+    # iterate for latitude; a few iterations converge to far below a
+    # millimeter
+    lat = np.arcsin(np.clip(qq / 2, -1, 1))
+    for i in range(10):
+        sin_lat = np.sin(lat)
+        delta = ((1 - e2 * sin_lat**2)**2 / (2 * np.cos(lat)) *
+                 (qq / (1 - e2) - sin_lat / (1 - e2 * sin_lat**2) +
+                  1 / (2 * e) * np.log((1 - e * sin_lat) /
+                                       (1 + e * sin_lat))))
+        lat = lat + delta
+        if np.all(np.abs(delta) < 1e-12):
+            break
+    lon = lon0 + np.degrees(theta / n)
+    return lon, np.degrees(lat)
+
+def xy_to_qq(x, y, wkid):
+    '''
+    This function computes the QQ codes of projected coordinates. See
+    projected_to_lonlat() for supported coordinate systems.
+    '''
+    return lonlat_to_qq(*projected_to_lonlat(x, y, wkid))
+
+
+class QQIndex:
+    '''
+    Resolves QQ codes to NAIP filenames following the naming convention of
+    the year they come from, e.g., the filenames of the NAIP tiles of a
+    region. Lookups are vectorized with a binary search over the sorted
+    codes. If several files cover the same QQ, e.g., on different dates,
+    the last one in sorted order, i.e., the latest, is used.
+
+    Usage
+    -----
+        index = QQIndex(['m_3408301_ne_17_1_20090929', ...])
+        filenames = index.filenames(xy_to_qq(x, y, 102039))
+
+    Attributes
+    ----------
+    codes : array
+        sorted QQ codes
+    names : list
+        filename of each code
+    '''
+    def __init__(self, filenames):
+        names = {}
+        for filename in sorted(filenames):
+            names[qq_code(filename)] = filename
+        self.codes = np.array(sorted(names), dtype=np.int64)
+        self.names = [names[x] for x in self.codes]
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, codes):
+        '''
+        Returns the position of each QQ code in names or -1 if it has no
+        file.
+        '''
+        codes = np.asarray(codes, dtype=np.int64)
+        pos = np.searchsorted(self.codes, codes)
+        pos[pos == len(self.codes)] = 0
+        found = len(self.codes) > 0
+        if found:
+            found = self.codes[pos] == codes
+        return np.where(found, pos, -1)
+
+    def filenames(self, codes):
+        '''
+        Returns the filename of each QQ code or None if it has no file.
+        '''
+        return [self.names[x] if x >= 0 else None
+                for x in self.lookup(codes)]
+
+    def path(self, naip_path, code, ext='.tif'):
+        '''
+        Returns the path to the original NAIP tile of a QQ code under
+        naip_path or None if it has no file.
+        '''
+        pos = self.lookup([code])[0]
+        if pos < 0:
+            return None
+        filename = self.names[pos]
+        return '%s/%s/%s%s' % (naip_path, filename[2:7], filename, ext)
@@ -0,0 +1,69 @@
+'''
+Functions
+---------
+    raster_env(compression, tile_size):
+        Returns arcpy environment settings for the compression and internal
+        tiling of raster outputs.
+    check_pixel_type(pixel_type):
+        Validates the pixel type of canopy outputs.
+'''
+
+# GeoTIFF codecs and their names in arcpy.env.compression; DEFLATE is called
+# LZ77 by ArcGIS
+CODECS = {
+    'NONE': 'NONE',
+    'DEFLATE': 'LZ77',
+    'LZW': 'LZW',
+    'ZSTD': 'ZSTD',
+    'PACKBITS': 'PackBits',
+}
+
+# pixel types that can hold canopy outputs, i.e., 0, 1, and nodata 3
+PIXEL_TYPES = ('2_BIT', '4_BIT', '8_BIT_UNSIGNED')
+
+def raster_env(compression=None, tile_size=0):
+    '''
+    This function returns the arcpy environment settings for raster outputs
+    as a dictionary so that they can be passed to worker processes and
+    applied there with setattr(arcpy.env, name, value).
+
+    Parameters
+    ----------
+        compression : str
+            codec in CODECS; None keeps the arcpy default
+        tile_size : int
+            internal tile width and height in cells; 0 keeps the arcpy
+            default
+
+    Returns
+    -------
+        dict
+            arcpy.env attribute => value
+
+    Raises
+    ------
+        ValueError
+            if the codec is not supported
+    '''
+    settings = {}
+    if compression:
+        codec = compression.upper()
+        if codec not in CODECS:
+            raise ValueError('Unsupported compression: %s (choose from %s)' %
+                             (compression, ', '.join(CODECS)))
+        settings['compression'] = CODECS[codec]
+    if tile_size:
+        settings['tileSize'] = '%d %d' % (tile_size, tile_size)
+    return settings
+
+def check_pixel_type(pixel_type):
+    '''
+    This function returns a pixel type for CopyRaster_management() and
+    MosaicToNewRaster_management() or raises ValueError if it cannot hold
+    canopy outputs.
+    '''
+    pixel_type = pixel_type.upper()
+    if pixel_type not in PIXEL_TYPES:
+        raise ValueError('Unsupported bit depth: %s (choose from %s)' %
+                         (pixel_type, ', '.join(PIXEL_TYPES)))
+    return pixel_type
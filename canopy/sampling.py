@@ -0,0 +1,139 @@
+import numpy as np
+from .geometry import points_in_polygon
+
+'''
+Functions
+---------
+    sample_points(rings, count, seed, classify, stratify, strata,
+                  max_batches):
+        Samples random points inside a polygon with vectorized rejection
+        sampling, optionally stratified.
+'''
+
+def sample_points(rings, count, seed=None, classify=None, stratify=None,
+                  strata=None, max_batches=100):
+    '''
+    This function samples random points uniformly inside a polygon. Batches
+    of candidate points are drawn in the bounding box of the polygon and
+    rejected if they are outside the polygon or if classify rejects them.
+    The batch size adapts to the observed acceptance rate, so a region
+    usually needs one or two batches.
+
+    If stratify is given, the count is allocated equally to strata and each
+    stratum is filled independently, e.g., to sample canopy and non-canopy
+    points equally. Strata that are too rare to fill within max_batches are
+    returned short.
+
+    Parameters
+    ----------
+        rings : list
+            list of (n, 2) arrays of polygon rings
+        count : int
+            number of points
+        seed : int, list
+            seed of the random number generator for reproducibility
+        classify : function
+            Function that takes x and y arrays and returns a dictionary of
+            integer attribute arrays, e.g., {'tile': ..., 'canopy': ...}.
+            Points with any negative attribute are rejected.
+        stratify : str
+            attribute of classify to stratify by
+        strata : list
+            attribute values of the strata; the values found in the first
+            batch if None
+
+    Returns
+    -------
+        x, y, attrs
+            coordinate arrays and a dictionary of attribute arrays
+    '''
+    rng = np.random.default_rng(seed)
+    coords = np.vstack(rings)
+    xmin, ymin = coords.min(axis=0)
+    xmax, ymax = coords.max(axis=0)
+
+    if stratify is None:
+        quotas = {None: count}
+    elif strata is not None:
+        quotas = __allocate(strata, count)
+    else:
+        quotas = None
+    # stratum => list of (x, y, attrs) chunks and number of points
+    chunks = {}
+    counts = {}
+    drawn = 0
+    kept = 0
+    for i in range(max_batches):
+        if quotas is not None:
+            remaining = sum(quotas[k] - counts.get(k, 0) for k in quotas)
+            if remaining == 0:
+                break
+        else:
+            remaining = count
+        # oversample by the acceptance rate observed so far; the first batch
+        # assumes half of the candidates are accepted
+        rate = max(kept / drawn if drawn else 0.5, 1e-3)
+        n = int(min(max(remaining / rate * 1.2, 1000), 10**6))
+        x = rng.uniform(xmin, xmax, n)
+        y = rng.uniform(ymin, ymax, n)
+        keep = points_in_polygon(x, y, rings)
+        x = x[keep]
+        y = y[keep]
+        attrs = {}
+        if classify is not None and len(x):
+            attrs = classify(x, y)
+            keep = np.ones(len(x), dtype=bool)
+            for values in attrs.values():
+                keep &= values >= 0
+            x = x[keep]
+            y = y[keep]
+            attrs = dict((k, v[keep]) for k, v in attrs.items())
+        drawn += n
+        if stratify is None:
+            labels = None
+        else:
+            labels = attrs.get(stratify, np.empty(0, dtype=np.int64))
+            if quotas is None:
+                if len(labels) == 0:
+                    continue
+                quotas = __allocate(np.unique(labels).tolist(), count)
+        # the acceptance rate of the scarcest stratum that still needs points
+        # determines the next batch size
+        batch_rate = None
+        for key in quotas:
+            need = quotas[key] - counts.get(key, 0)
+            if need <= 0:
+                continue
+            if labels is None:
+                idx = np.arange(len(x))
+            else:
+                idx = np.flatnonzero(labels == key)
+            rate = len(idx) / n
+            batch_rate = rate if batch_rate is None else min(batch_rate, rate)
+            idx = idx[:need]
+            chunks.setdefault(key, []).append(
+                    (x[idx], y[idx], dict((k, v[idx])
+                                          for k, v in attrs.items())))
+            counts[key] = counts.get(key, 0) + len(idx)
+        if batch_rate is not None:
+            kept += batch_rate * len(quotas) * n
+    else:
+        for key in quotas or {}:
+            if counts.get(key, 0) < quotas[key]:
+                print('Only %d of %d points sampled for stratum %s' %
+                      (counts.get(key, 0), quotas[key], key))
+
+    chunks = [c for key in quotas or {} for c in chunks.get(key, [])]
+    if not chunks:
+        return np.empty(0), np.empty(0), {}
+    x = np.concatenate([c[0] for c in chunks])
+    y = np.concatenate([c[1] for c in chunks])
+    attrs = dict((k, np.concatenate([c[2][k] for c in chunks]))
+                 for k in chunks[0][2])
+    return x, y, attrs
+
+def __allocate(strata, count):
+    # Allocates count equally to strata; the first strata get the remainder
+    n = len(strata)
+    return dict((k, count // n + (1 if i < count % n else 0))
+                for i, k in enumerate(strata))
@@ -0,0 +1,293 @@
+import io
+import os
+import re
+import time
+import pickle
+import secrets
+import threading
+import traceback
+import contextlib
+import multiprocessing
+from multiprocessing.connection import Listener, Client
+from .config import Config
+from .jobqueue import worker_name
+
+'''
+Worker service that keeps processes with arcpy already imported, so short
+interactive jobs do not pay for the arcpy startup every time. For example,
+    python -m canopy serve canopy.cfg --workers 4
+    python -m canopy submit canopy.cfg --stage clip --region 8 \
+        --tile m_3408301_ne_17_1
+    python -m canopy submit canopy.cfg --function add_naip_tiles_for_gt \
+        --args '"C:/gt/gtpoints.shp"'
+
+Clients can run any public canopy function as the user of the service, so
+the service has no default key. Unless a key is given or set in the
+CANOPY_SERVICE_KEY environment variable, serve() generates a random key and
+writes it to ~/.canopy/service-<address>.key, which only the user can read,
+and submit() and shutdown() read it from there.
+
+Functions
+---------
+    parse_address(address):
+        Converts host:port or a socket or pipe path to a connection address.
+    serve(config_path, address, num_workers, authkey):
+        Starts warm worker processes and serves jobs from clients.
+    submit(jobs, address, authkey):
+        Sends jobs to the service and yields their results as they finish.
+    shutdown(address, authkey):
+        Stops the service.
+'''
+
+def parse_address(address):
+    '''
+    This function converts host:port to a TCP address on the given host and
+    returns a path, i.e., a Unix domain socket or a Windows named pipe such
+    as \\\\.\\pipe\\canopy, unchanged.
+    '''
+    host, sep, port = address.rpartition(':')
+    if sep and host and port.isdigit():
+        return host, int(port)
+    return address
+
+def __key_path(address):
+    # Returns the path to the file of the generated key of a service
+    return os.path.expanduser('~/.canopy/service-%s.key' %
+                              re.sub(r'[^\w.-]', '_', address))
+
+def __authkey(authkey, address, create=False):
+    # Returns the key that clients need to connect; if neither authkey nor
+    # the CANOPY_SERVICE_KEY environment variable is set, serve() creates a
+    # random key in a user-only file and clients read it
+    if not authkey:
+        authkey = os.environ.get('CANOPY_SERVICE_KEY')
+    if not authkey:
+        key_path = __key_path(address)
+        if create:
+            authkey = secrets.token_hex(32)
+            os.makedirs(os.path.dirname(key_path), mode=0o700,
+                        exist_ok=True)
+            # a new file so that an existing one with wider permissions is
+            # not reused; Windows ignores the mode, but the user profile is
+            # private
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(key_path)
+            fd = os.open(key_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY,
+                         0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(authkey)
+            print('Service key written to %s' % key_path)
+        else:
+            try:
+                with open(key_path) as f:
+                    authkey = f.read().strip()
+            except FileNotFoundError:
+                raise ValueError('%s: No service key; set '
+                                 'CANOPY_SERVICE_KEY or start the service '
+                                 'on this host as this user' %
+                                 address) from None
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+def serve(config_path, address='localhost:6011', num_workers=2,
+          authkey=None):
+    '''
+    This function starts num_workers worker processes that import arcpy and
+    call canopy.warm_up() once and then serves jobs from clients until a
+    client calls shutdown(). Each client sends a list of jobs, which are
+    distributed to idle workers, and receives a message for each job as
+    soon as it finishes. The configuration file is read again for every
+    job, so changes take effect without restarting the service.
+
+    Parameters
+    ----------
+    config_path : str
+        path to the CanoPy configuration file
+    address : str
+        host:port to listen on or a socket or pipe path; use localhost to
+        accept local clients only
+    num_workers : int
+        number of worker processes
+    authkey : str
+        key that clients need to connect (default CANOPY_SERVICE_KEY
+        environment variable or a random key written to
+        ~/.canopy/service-<address>.key)
+    '''
+    authkey = __authkey(authkey, address, create=True)
+    jobs = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    # workers are not daemonic because stages start their own process pools
+    workers = [multiprocessing.Process(target=__serve_worker,
+                                       args=(config_path, jobs, results))
+               for i in range(num_workers)]
+    for worker in workers:
+        worker.start()
+
+    # client ID => [connection, lock, number of pending jobs, start time]
+    clients = {}
+    clients_lock = threading.Lock()
+
+    def dispatch():
+        # Sends results to their clients
+        while True:
+            client, message = results.get()
+            if client is None:
+                if 'ready' in message:
+                    print('%s ready in %.1f seconds' % (message['worker'],
+                                                        message['ready']))
+                    continue
+                if 'error' in message:
+                    print('%s failed to start:\n%s' % (message['worker'],
+                                                       message['error']))
+                    continue
+                break
+            with clients_lock:
+                state = clients.get(client)
+            if state is None:
+                continue
+            conn, lock, pending, start = state
+            with lock:
+                try:
+                    conn.send(message)
+                    state[2] -= 1
+                    if state[2] == 0:
+                        conn.send({'done': True,
+                                   'seconds': time.time() - start})
+                except OSError:
+                    # the client went away; its jobs still finish
+                    state[2] = 0
+                if state[2] == 0:
+                    conn.close()
+                    with clients_lock:
+                        del clients[client]
+
+    def handle(client, conn):
+        # Receives the jobs of one client
+        try:
+            request = conn.recv()
+        except (EOFError, OSError):
+            conn.close()
+            return
+        if request.get('shutdown'):
+            conn.send({'done': True})
+            conn.close()
+            stop.set()
+            # unblock accept()
+            with contextlib.suppress(OSError):
+                Client(listener.address, authkey=authkey).close()
+            return
+        job_list = request.get('jobs', [])
+        if job_list:
+            with clients_lock:
+                clients[client] = [conn, threading.Lock(), len(job_list),
+                                   time.time()]
+        else:
+            conn.send({'done': True, 'seconds': 0.})
+            conn.close()
+            return
+        for index, job in enumerate(job_list):
+            jobs.put((client, index, job))
+
+    stop = threading.Event()
+    dispatcher = threading.Thread(target=dispatch, daemon=True)
+    dispatcher.start()
+    listener = Listener(parse_address(address), authkey=authkey)
+    print('Serving on %s with %d workers' % (address, num_workers))
+    try:
+        client = 0
+        while not stop.is_set():
+            try:
+                conn = listener.accept()
+            except (OSError, EOFError,
+                    multiprocessing.AuthenticationError) as e:
+                if not stop.is_set():
+                    print('Rejected connection: %s' % e)
+                continue
+            if stop.is_set():
+                conn.close()
+                break
+            client += 1
+            threading.Thread(target=handle, args=(client, conn),
+                             daemon=True).start()
+    finally:
+        listener.close()
+        for worker in workers:
+            jobs.put(None)
+        for worker in workers:
+            worker.join()
+        results.put((None, {}))
+        dispatcher.join()
+    print('Completed')
+
+def __serve_worker(config_path, jobs, results):
+    # Worker process of serve(); arcpy is imported once here
+    start = time.time()
+    name = worker_name()
+    try:
+        from . import canopy
+        canopy.warm_up(Config(config_path))
+    except Exception:
+        results.put((None, {'worker': name,
+                            'error': traceback.format_exc()}))
+        return
+    results.put((None, {'worker': name, 'ready': time.time() - start}))
+    while True:
+        item = jobs.get()
+        if item is None:
+            break
+        client, index, job = item
+        message = {'index': index, 'job': job, 'worker': name}
+        output = io.StringIO()
+        start = time.time()
+        try:
+            with contextlib.redirect_stdout(output):
+                result = canopy.run_job(Config(config_path), job)
+            try:
+                pickle.dumps(result)
+            except Exception:
+                result = repr(result)
+            message['result'] = result
+        except Exception:
+            message['error'] = traceback.format_exc()
+        message['seconds'] = time.time() - start
+        message['output'] = output.getvalue()
+        results.put((client, message))
+
+def submit(jobs, address='localhost:6011', authkey=None):
+    '''
+    This function sends jobs to the worker service and yields a message for
+    each job as soon as it finishes, which is not necessarily in the order
+    of jobs. See canopy.run_job() for the job dictionaries.
+
+    Parameters
+    ----------
+    jobs : list
+        job dictionaries
+    address : str
+        address of the service
+    authkey : str
+        key of the service (default CANOPY_SERVICE_KEY environment variable
+        or the key that serve() generated)
+
+    Yields
+    ------
+    dict
+        index and job, worker, result or error traceback, seconds the job
+        took, and its printed output
+    '''
+    authkey = __authkey(authkey, address)
+    with Client(parse_address(address), authkey=authkey) as conn:
+        conn.send({'jobs': list(jobs)})
+        while True:
+            message = conn.recv()
+            if message.get('done'):
+                return
+            yield message
+
+def shutdown(address='localhost:6011', authkey=None):
+    '''
+    This function stops the worker service after the running jobs finish.
+    '''
+    authkey = __authkey(authkey, address)
+    with Client(parse_address(address), authkey=authkey) as conn:
+        conn.send({'shutdown': True})
+        conn.recv()
@@ -123,6 +123,91 @@ snaprast_path = %(analysis_path)s/Data/rm_3408504_nw_16_1_20090824.tif
 # This folder will contain all result files.
 results_path = %(analysis_path)s/Results 
 
+# This variable specifies the number of worker processes for parallel tile
+# processing such as rasterizing AFE shapefiles.
+num_workers = 4
+
+# This variable specifies the number of regions processed concurrently in
+# threads by the clip, mosaic, correction, and polygonization stages. Each
+# region runs in its own execution context with private layer views, so
+# regions do not share selections.
+num_threads = 1
+
+# These variables configure the worker service (python -m canopy serve), which
+# keeps service_workers processes with arcpy already imported so that short
+# jobs submitted with python -m canopy submit take seconds. service_address is
+# host:port or the path to a Unix domain socket or a Windows named pipe, e.g.,
+# \\\\.\\pipe\\canopy. Use localhost to accept local clients only. Without
+# the CANOPY_SERVICE_KEY environment variable, serve writes a random key to
+# ~/.canopy that only clients of the same user on the same host can read.
+service_address = localhost:6011
+service_workers = 2
+
+# This local folder is used to prefetch NAIP tiles from slow storage
+# (naip_path) in the background while other tiles are processed. Leave it empty
+# to read NAIP tiles directly from naip_path.
+scratch_path =
+
+# These variables specify the maximum number of NAIP tiles and megabytes to
+# prefetch ahead into scratch_path.
+prefetch_tiles = 4
+prefetch_max_mb = 2048
+
+# This local folder persistently caches NAIP tiles read from naip_path so that
+# re-running regions or analyses does not read them from slow storage again.
+# Least recently used tiles are removed when the cache exceeds
+# naip_cache_max_mb megabytes. Leave it empty to disable the cache.
+naip_cache_path =
+naip_cache_max_mb = 20480
+
+# This folder caches final and clipped final tiles by the contents of their
+# inputs, the snap grid, the spatial reference, and the output format, so
+# identical computations are not repeated across regions, runs, and years.
+# Least recently used results are removed when the cache exceeds
+# result_cache_max_mb megabytes. Leave it empty to disable the cache.
+result_cache_path =
+result_cache_max_mb = 20480
+
+# This local folder caches rasters decoded into NumPy arrays as memory-mapped
+# .npy files, so NumPy analyses such as Check_gaps, objective_function(), and
+# GT sampling decode each raster only once and processes share it through the
+# page cache. Least recently used arrays are removed when the cache exceeds
+# array_cache_max_mb megabytes. Leave it empty to disable the cache.
+array_cache_path =
+array_cache_max_mb = 10240
+
+# These variables specify the format of raster outputs of all stages:
+# the compression codec (NONE, DEFLATE, LZW, ZSTD, or PACKBITS), the internal
+# tile size in cells, and the pixel type of canopy outputs (2_BIT, 4_BIT, or
+# 8_BIT_UNSIGNED). Leave compression empty or tile_size 0 to use the arcpy
+# defaults. python -m canopy benchmark compares the codecs on sample tiles.
+compression = DEFLATE
+tile_size = 256
+bit_depth = 2_BIT
+
+# These variables specify the cleanup of canopy TIFF files before
+# convert_canopy_tif_to_shp() polygonizes them: the odd neighborhood width of a
+# majority filter, the minimum mapping unit in cells below which canopy patches
+# are removed, and the maximum size in cells of noncanopy holes that are
+# filled. Salt-and-pepper cells otherwise become millions of tiny polygons.
+# Set a variable to 0 to skip its step; all 0 disables the cleanup.
+cleanup_majority_size = 0
+cleanup_min_cells = 0
+cleanup_max_hole_cells = 0
+
+# These variables configure a prefilter that skips NAIP tiles without possible
+# canopy, e.g., open water, reservoirs, or dense urban cores. It samples
+# prefilter_windows x prefilter_windows small windows of the red and near
+# infrared bands of each tile. If at most prefilter_max_vegetated_fraction of
+# the sampled cells have an NDVI of prefilter_ndvi_threshold or higher, the
+# clipped final tile is written as noncanopy directly, and reprojection,
+# classification, conversion, and clipping are skipped. Evaluated tiles are
+# listed in prefilter_<analysis_year>.csv in results_path. Leave
+# prefilter_ndvi_threshold empty to disable the prefilter.
+prefilter_ndvi_threshold =
+prefilter_max_vegetated_fraction = 0.001
+prefilter_windows = 32
+
 # This list contains all physiographic region IDs, but it is not used at all.
 # reproject_input_tiles(), convert_afe_to_final_tiles(), clip_final_tiles(),
 # and mosaic_clipped_final_tiles() take a list of physiographic region IDs (a
@@ -0,0 +1,52 @@
+import numpy as np
+
+'''
+Functions
+---------
+    ndvi(red, nir):
+        Computes the normalized difference vegetation index.
+    ndvi_summary(red, nir, threshold):
+        Summarizes the NDVI of sampled cells of a tile.
+'''
+
+def ndvi(red, nir):
+    '''
+    This function computes the normalized difference vegetation index
+    (NIR - red) / (NIR + red) of cells. Cells where both bands are 0, e.g.,
+    nodata, are NaN.
+    '''
+    red = np.asarray(red, dtype=float)
+    nir = np.asarray(nir, dtype=float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (nir - red) / (nir + red)
+
+def ndvi_summary(red, nir, threshold=0.2):
+    '''
+    This function summarizes the NDVI of sampled cells of a tile to decide
+    whether the tile can contain any canopy, e.g., open water or dense urban
+    cores cannot.
+
+    Parameters
+    ----------
+        red, nir : array
+            red and near infrared values of the sampled cells
+        threshold : float
+            NDVI at or above which a cell is vegetated
+
+    Returns
+    -------
+        dict
+            valid_cells : number of cells with an NDVI
+            ndvi_mean : mean NDVI of valid cells (NaN if none)
+            ndvi_p99 : 99th percentile of the NDVI of valid cells
+            vegetated_fraction : fraction of valid cells at or above
+                threshold (NaN if no valid cell)
+    '''
+    values = ndvi(red, nir).ravel()
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {'valid_cells': 0, 'ndvi_mean': np.nan, 'ndvi_p99': np.nan,
+                'vegetated_fraction': np.nan}
+    return {'valid_cells': len(values), 'ndvi_mean': float(values.mean()),
+            'ndvi_p99': float(np.percentile(values, 99)),
+            'vegetated_fraction': float((values >= threshold).mean())}
@@ -0,0 +1,136 @@
+import csv
+import numpy as np
+from .geometry import PolygonIndex, burn_polygons
+
+'''
+Classes
+-------
+    ZoneLayer(name, polygons, zone_names):
+        Rasterizes the polygons of a zone layer block by block and
+        accumulates canopy counts per zone.
+
+Functions
+---------
+    canopy_classes(arr):
+        Maps canopy raster values to class indices for counting.
+    write_zonal_table(path, layers, cell_area):
+        Writes the canopy counts of zone layers to a CSV file.
+'''
+
+# class indices of counts; any value other than 0 and 1 is nodata
+CLASSES = ('noncanopy', 'canopy', 'nodata')
+
+def canopy_classes(arr):
+    '''
+    This function maps noncanopy (0) and canopy (1) cells to class indices 0
+    and 1 and any other value, e.g., nodata 3, to 2.
+    '''
+    return np.minimum(arr, 2).astype(np.int64)
+
+def write_zonal_table(path, layers, cell_area=1.):
+    '''
+    This function writes the canopy counts of zone layers to a CSV file with
+    one row per zone. Zones that no canopy raster covers have zero counts.
+
+    Parameters
+    ----------
+        path : str
+            CSV file path
+        layers : list
+            list of ZoneLayer objects
+        cell_area : float
+            area of a cell in square units of the coordinate system
+    '''
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['layer', 'zone'] + ['%s_cells' % x for x in CLASSES]
+                        + ['canopy_area', 'canopy_cover'])
+        for layer in layers:
+            for zone, counts, cover in zip(layer.zone_names, layer.counts[1:],
+                                           layer.canopy_cover()[1:]):
+                writer.writerow([layer.name, zone] + counts.tolist() +
+                                [counts[1] * cell_area,
+                                 '' if np.isnan(cover) else cover])
+
+
+class ZoneLayer(PolygonIndex):
+    '''
+    Rasterizes the polygons of a zone layer, e.g., counties or census
+    tracts, onto blocks of a canopy raster and accumulates the numbers of
+    noncanopy, canopy, and nodata cells of each zone with np.bincount().
+    Only polygons whose bounding boxes overlap a block are burned, so each
+    polygon is rasterized once per pass over the canopy rasters. Zone IDs
+    start at 1; 0 is outside all zones.
+
+    Usage
+    -----
+        layer = ZoneLayer('counties', polygons, names)
+        for arr, xmin, ymax in blocks:
+            layer.accumulate(arr, xmin, ymax, (1, 1))
+        cover = layer.canopy_cover()
+
+    Attributes
+    ----------
+    name : str
+        layer name
+    zone_names : list
+        name of each zone
+    counts : (len(zone_names) + 1, 3) array
+        cells of each zone ID by class in CLASSES
+    '''
+    def __init__(self, name, polygons, zone_names):
+        super().__init__(polygons)
+        self.name = name
+        self.zone_names = list(zone_names)
+        self.counts = np.zeros((len(self.zone_names) + 1, len(CLASSES)),
+                               dtype=np.int64)
+
+    def zone_ids(self, xmin, ymax, cellsize, nrows, ncols):
+        '''
+        Returns the (nrows, ncols) zone ID raster of a block; cells outside
+        all zones are 0.
+        '''
+        w, h = cellsize
+        xmax = xmin + ncols * w
+        ymin = ymax - nrows * h
+        hits = np.flatnonzero((self.bounds[:, 0] < xmax) &
+                              (self.bounds[:, 2] > xmin) &
+                              (self.bounds[:, 1] < ymax) &
+                              (self.bounds[:, 3] > ymin))
+        dtype = np.uint16 if len(self.zone_names) < 2**16 else np.uint32
+        return burn_polygons([self.polygons[i] for i in hits], hits + 1,
+                             xmin, ymax, cellsize, nrows, ncols, 0, dtype)
+
+    def accumulate(self, arr, xmin, ymax, cellsize, valid=None):
+        '''
+        Adds the cells of a canopy raster block to the counts of their
+        zones. Cells where valid is False, e.g., outside the region of the
+        canopy raster, are not counted.
+
+        Parameters
+        ----------
+            arr : (nrows, ncols) array
+                canopy raster block
+            xmin, ymax : float
+                upper left corner of the block
+            cellsize : list, tuple
+                (width, height) cell size
+            valid : (nrows, ncols) array
+                boolean mask of cells to count
+        '''
+        zones = self.zone_ids(xmin, ymax, cellsize, *arr.shape)
+        codes = zones.astype(np.int64) * len(CLASSES) + canopy_classes(arr)
+        if valid is not None:
+            codes = codes[valid]
+        self.counts += np.bincount(codes.ravel(),
+                                   minlength=self.counts.size).reshape(
+                                           self.counts.shape)
+
+    def canopy_cover(self):
+        '''
+        Returns the fraction of canopy among valid cells of each zone ID;
+        NaN for zones without valid cells.
+        '''
+        valid = self.counts[:, :2].sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.counts[:, 1] / valid
@@ -0,0 +1,75 @@
+import os
+import sys
+import types
+import numpy as np
+import pytest
+from .fakearcpy import FakeArcpy
+
+# Synthetic dataset of two physiographic regions side by side with two
+# 10 x 10 NAIP tiles each:
+#   +---------+---------+---------+---------+
+#   | tile 1  | tile 2  | tile 3  | tile 4  |
+#   +---------+---------+---------+---------+
+#   |  Winder Slope (8) |  Blue Ridge (7)   |
+REGIONS = {8: 'Winder Slope', 7: 'Blue Ridge'}
+TILES = ['m_3408301_ne_17_1', 'm_3408302_ne_17_1', 'm_3408303_ne_17_1',
+         'm_3408304_ne_17_1']
+
+
+def square(x0, y0, x1, y1):
+    return [[(x0, y0), (x1, y0), (x1, y1), (x0, y1), (x0, y0)]]
+
+
+@pytest.fixture
+def arcpy(monkeypatch):
+    '''
+    A new arcpy stand-in that canopy.canopy and canopy.context use during
+    the test.
+    '''
+    fake = FakeArcpy()
+    monkeypatch.setitem(sys.modules, 'arcpy', fake)
+    monkeypatch.setitem(sys.modules, 'arcpy.da', fake.da)
+    monkeypatch.setitem(sys.modules, 'arcpy.sa', fake.sa)
+    from canopy import canopy, context
+    for module in (canopy, context):
+        monkeypatch.setattr(module, 'arcpy', fake)
+    return fake
+
+
+@pytest.fixture
+def config(arcpy, tmp_path):
+    '''
+    Configuration of the two-region dataset with random final tiles, i.e.,
+    fr*.tif files with a one-cell margin around their NAIP tiles.
+    '''
+    results_path = '%s/Results' % tmp_path
+    arcpy.add_features('phyregs', ['NAME', 'PHYSIO_ID'], [
+        {'NAME': 'Winder Slope', 'PHYSIO_ID': 8,
+         'SHAPE': square(0, 0, 20, 10)},
+        {'NAME': 'Blue Ridge', 'PHYSIO_ID': 7,
+         'SHAPE': square(20, 0, 40, 10)}])
+    arcpy.add_features('naipqq', ['FileName', 'phyregs'], [
+        {'FileName': '%s_20090929.tif' % tile,
+         'phyregs': ',8,' if i < 2 else ',7,',
+         'SHAPE': square(i * 10, 0, i * 10 + 10, 10)}
+        for i, tile in enumerate(TILES)])
+    rng = np.random.default_rng(0)
+    for i, tile in enumerate(TILES):
+        outputs = '%s/%s/Outputs' % (results_path,
+                                     REGIONS[8 if i < 2 else 7].
+                                     replace(' ', '_'))
+        os.makedirs(outputs, exist_ok=True)
+        arcpy.add_raster('%s/fr%s.tif' % (outputs, tile),
+                         rng.integers(0, 2, (12, 12)).astype(np.uint8),
+                         i * 10 - 1, 11, (1, 1), nodata=3, wkid=102039)
+    return types.SimpleNamespace(
+        phyregs_layer='phyregs', naipqq_layer='naipqq',
+        naipqq_phyregs_field='phyregs', results_path=results_path,
+        naip_path='%s/naip' % tmp_path, analysis_year=2009,
+        phyreg_ids=list(REGIONS), inverted_phyreg_ids=[],
+        snaprast_path='%s/snap.tif' % tmp_path, spatref_wkid=102039,
+        compression='DEFLATE', tile_size=256, bit_depth='2_BIT',
+        verbosity=0, num_workers=1, num_threads=1,
+        result_cache_path=None, array_cache_path=None,
+        naip_cache_path=None, scratch_path=None, cleanup_majority_size=3,
+        cleanup_min_cells=4, cleanup_max_hole_cells=2)
@@ -0,0 +1,956 @@
+import os
+import re
+import sys
+import types
+import struct
+import fnmatch
+import contextlib
+import numpy as np
+from collections import Counter
+from canopy.geometry import burn_polygons, points_in_polygon
+
+'''
+An in-process stand-in for the subset of arcpy that CanoPy uses. Feature
+classes and layers are in-memory tables, and rasters are NumPy arrays saved
+at their paths so that os.path and the journal see them as files. Every
+call is recorded with a simulated cost, so tests can exercise the
+processing functions on a synthetic dataset without ArcGIS and assert
+geoprocessing call budgets. Tests get a new stand-in from the arcpy fixture
+in conftest.py. For example,
+
+    def test_clip(arcpy, config):
+        from canopy import canopy
+        arcpy.add_features('naipqq', ['FileName', 'phyregs'], rows)
+        arcpy.add_raster('C:/.../fr_m_3408301_ne_17_1.tif', arr, xmin, ymax,
+                         (1, 1), nodata=3)
+        with arcpy.log.budget({'SelectLayerBy*': len(regions),
+                               'MakeFeatureLayer_management': num_tiles}):
+            canopy.clip_final_tiles(config)
+        print(arcpy.log.report())
+
+Scripts outside of tests call install() before importing canopy.canopy.
+The stand-in assumes that all data share one coordinate system, so
+spatial_reference arguments and projections only pass data through.
+Spatial selections test polygon vertices and points, not exact
+intersections. Tools that are not modeled are recorded and do nothing.
+
+Classes
+-------
+    BudgetExceeded:
+        Raised when a block of code makes more calls than its budget.
+    CallLog():
+        Records the count and simulated cost of calls.
+    SpatialReference(wkid):
+        Coordinate system by WKID.
+    Extent(XMin, YMin, XMax, YMax):
+        Bounding box.
+    Point(X, Y):
+        Point.
+    Geometry(type, rings):
+        Point or polygon geometry.
+    FeatureClass(name, fields, rows, oid_field):
+        In-memory feature class.
+    Layer(name, source, oids):
+        Feature layer with a definition query and a selection.
+    Raster(path):
+        Raster backed by a NumPy array.
+    FakeArcpy():
+        Stand-in for the arcpy module.
+
+Functions
+---------
+    install(fake):
+        Installs a stand-in as the arcpy, arcpy.da, and arcpy.sa modules.
+'''
+
+# simulated seconds per call and per unit (rows for cursors and selections,
+# cells for raster reads and writes) by call name; these are rough relative
+# costs of ArcGIS operations for budgets, not measurements
+COSTS = {
+    'SearchCursor': (0.05, 1e-5),
+    'UpdateCursor': (0.05, 2e-5),
+    'InsertCursor': (0.05, 2e-5),
+    'SelectLayerByAttribute_management': (0.1, 1e-6),
+    'SelectLayerByLocation_management': (0.5, 1e-5),
+    'MakeFeatureLayer_management': (0.2, 0.),
+    'Describe': (0.02, 0.),
+    'ListFields': (0.02, 0.),
+    'Raster': (0.05, 0.),
+    'RasterToNumPyArray': (0.02, 5e-9),
+    'NumPyArrayToRaster': (0.05, 5e-9),
+    'ExtractByMask': (1., 2e-8),
+    'Reclassify': (1., 2e-8),
+}
+
+# cost of tools not in COSTS
+TOOL_COST = (1., 1e-8)
+
+
+class BudgetExceeded(AssertionError):
+    '''
+    Raised by CallLog.budget() when a block of code makes more calls than
+    allowed.
+    '''
+
+
+class CallLog:
+    '''
+    Records the count and simulated cost of calls by name.
+
+    Attributes
+    ----------
+    calls : list
+        (name, seconds) of each call in order
+    counts : Counter
+        number of calls by name
+    seconds : Counter
+        simulated seconds by name
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        '''
+        Forgets all calls.
+        '''
+        self.calls = []
+        self.counts = Counter()
+        self.seconds = Counter()
+
+    def record(self, name, units=0):
+        '''
+        Records a call that processed units rows or cells and returns its
+        simulated cost.
+        '''
+        per_call, per_unit = COSTS.get(name, TOOL_COST)
+        seconds = per_call + per_unit * units
+        self.calls.append((name, seconds))
+        self.counts[name] += 1
+        self.seconds[name] += seconds
+        return seconds
+
+    def count(self, pattern='*'):
+        '''
+        Returns the number of calls whose names match an fnmatch pattern,
+        e.g., 'SelectLayerBy*'.
+        '''
+        return sum(n for name, n in self.counts.items()
+                   if fnmatch.fnmatchcase(name, pattern))
+
+    def cost(self, pattern='*'):
+        '''
+        Returns the simulated seconds of calls whose names match a pattern.
+        '''
+        return sum(s for name, s in self.seconds.items()
+                   if fnmatch.fnmatchcase(name, pattern))
+
+    def budget(self, limits):
+        '''
+        Returns a context manager that raises BudgetExceeded when the
+        calls made inside it exceed limits, a dictionary of fnmatch
+        patterns of call names, e.g., 'SelectLayerBy*', and their maximum
+        counts.
+        '''
+        @contextlib.contextmanager
+        def check():
+            start = Counter(self.counts)
+            yield self
+            made = self.counts - start
+            over = []
+            for pattern, limit in limits.items():
+                n = sum(c for name, c in made.items()
+                        if fnmatch.fnmatchcase(name, pattern))
+                if n > limit:
+                    over.append('%s: %d calls > %d' % (pattern, n, limit))
+            if over:
+                raise BudgetExceeded('; '.join(over))
+        return check()
+
+    def report(self):
+        '''
+        Returns a table of calls and simulated seconds by name, costliest
+        first.
+        '''
+        lines = ['%-40s %8s %10s' % ('call', 'count', 'seconds')]
+        for name, seconds in self.seconds.most_common():
+            lines.append('%-40s %8d %10.2f' % (name, self.counts[name],
+                                               seconds))
+        lines.append('%-40s %8d %10.2f' % ('total', self.count(),
+                                           self.cost()))
+        return '\n'.join(lines)
+
+
+class SpatialReference:
+    '''
+    Coordinate system identified by its WKID.
+    '''
+    def __init__(self, wkid=None):
+        self.factoryCode = wkid
+
+    def __eq__(self, other):
+        return isinstance(other, SpatialReference) and \
+                self.factoryCode == other.factoryCode
+
+
+class Extent:
+    '''
+    Bounding box.
+    '''
+    def __init__(self, XMin, YMin, XMax, YMax):
+        self.XMin = XMin
+        self.YMin = YMin
+        self.XMax = XMax
+        self.YMax = YMax
+        self.width = XMax - XMin
+        self.height = YMax - YMin
+
+
+class Point:
+    '''
+    Point.
+    '''
+    def __init__(self, X=0., Y=0.):
+        self.X = X
+        self.Y = Y
+
+
+class Geometry:
+    '''
+    Point or polygon geometry. A polygon is a list of rings where holes
+    follow the even-odd rule as in canopy.geometry.
+
+    Attributes
+    ----------
+    type : str
+        'Point' or 'Polygon'
+    rings : list
+        (n, 2) arrays; one (1, 2) array for a point
+    '''
+    def __init__(self, type, rings, spatialReference=None):
+        self.type = type
+        self.rings = [np.asarray(x, dtype=float).reshape(-1, 2)
+                      for x in rings]
+        self.spatialReference = spatialReference
+
+    @property
+    def __geo_interface__(self):
+        if self.type == 'Point':
+            return {'type': 'Point',
+                    'coordinates': tuple(self.rings[0][0])}
+        return {'type': 'Polygon',
+                'coordinates': [x.tolist() for x in self.rings]}
+
+    @property
+    def WKB(self):
+        if self.type == 'Point':
+            return bytearray(struct.pack('<BIdd', 1, 1, *self.rings[0][0]))
+        data = struct.pack('<BII', 1, 3, len(self.rings))
+        for ring in self.rings:
+            data += struct.pack('<I', len(ring)) + ring.astype('<f8').tobytes()
+        return bytearray(data)
+
+    @property
+    def extent(self):
+        coords = np.vstack(self.rings)
+        return Extent(*coords.min(axis=0), *coords.max(axis=0))
+
+    @property
+    def centroid(self):
+        return Point(*np.vstack(self.rings).mean(axis=0))
+
+    @property
+    def area(self):
+        area = 0.
+        for ring in self.rings:
+            x, y = ring[:, 0], ring[:, 1]
+            area += abs((x * np.roll(y, -1) - np.roll(x, -1) * y).sum()) / 2
+        return area
+
+    def vertices(self):
+        # All vertices as an (n, 2) array
+        return np.vstack(self.rings)
+
+    def contains(self, xy):
+        # Tests which points are inside a polygon
+        if self.type != 'Polygon':
+            return np.zeros(len(xy), dtype=bool)
+        xy = np.asarray(xy, dtype=float).reshape(-1, 2)
+        return points_in_polygon(xy[:, 0], xy[:, 1], self.rings)
+
+    def projectAs(self, spatial_reference):
+        return self
+
+
+class Multipoint(Geometry):
+    '''
+    Multipoint geometry made of an Array of Points.
+    '''
+    def __init__(self, points, spatialReference=None):
+        super().__init__('Multipoint', [[(p.X, p.Y) for p in points]],
+                         spatialReference)
+
+    def __iter__(self):
+        return iter(Point(*xy) for xy in self.rings[0])
+
+
+class Field:
+    '''
+    Field description returned by ListFields().
+    '''
+    def __init__(self, name, type='TEXT'):
+        self.name = name
+        self.type = type
+
+
+class FeatureClass:
+    '''
+    In-memory feature class.
+
+    Attributes
+    ----------
+    name : str
+        name or path
+    fields : list
+        field names except the OID and shape
+    rows : dict
+        OID => dict of field values and 'SHAPE'
+    oid_field : str
+        name of the OID field
+    '''
+    def __init__(self, name, fields, rows=(), oid_field='FID'):
+        self.name = name
+        self.fields = list(fields)
+        self.oid_field = oid_field
+        self.rows = {}
+        for row in rows:
+            self.insert(row)
+
+    def insert(self, row):
+        '''
+        Adds a row given as a dictionary of field values and 'SHAPE' and
+        returns its OID.
+        '''
+        oid = max(self.rows, default=-1) + 1
+        self.rows[oid] = dict(row)
+        return oid
+
+
+class Layer:
+    '''
+    Feature layer over a feature class with a definition query and a
+    selection; selection is None if no feature is selected.
+    '''
+    def __init__(self, name, source, oids=None):
+        self.name = name
+        self.source = source
+        self.oids = oids
+        self.selection = None
+
+    def defined(self):
+        # OIDs that pass the definition query
+        if self.oids is None:
+            return list(self.source.rows)
+        return [x for x in self.source.rows if x in self.oids]
+
+    def active(self):
+        # OIDs that geoprocessing tools and cursors use
+        if self.selection is None:
+            return self.defined()
+        return [x for x in self.defined() if x in self.selection]
+
+
+class Raster:
+    '''
+    Raster backed by a (bands, rows, columns) NumPy array. Rasters saved by
+    the stand-in are .npz archives at their paths.
+    '''
+    def __init__(self, path=None, arr=None, xmin=0., ymax=0.,
+                 cellsize=(1., 1.), nodata=None, wkid=None):
+        if path is not None:
+            with np.load(path) as data:
+                arr = data['arr']
+                xmin, ymax = data['corner'].tolist()
+                cellsize = tuple(data['cellsize'].tolist())
+                # empty arrays are None
+                nodata = (data['nodata'].tolist() or [None])[0]
+                wkid = (data['wkid'].tolist() or [None])[0]
+            self.catalogPath = os.path.abspath(path)
+        else:
+            self.catalogPath = None
+        self.arr = np.asarray(arr)
+        if self.arr.ndim == 2:
+            self.arr = self.arr[np.newaxis]
+        self.bandCount, self.height, self.width = self.arr.shape
+        self.meanCellWidth, self.meanCellHeight = cellsize
+        self.noDataValue = nodata
+        self.spatialReference = SpatialReference(wkid)
+        self.extent = Extent(xmin, ymax - self.height * cellsize[1],
+                             xmin + self.width * cellsize[0], ymax)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, arr=self.arr, corner=[self.extent.XMin,
+                                              self.extent.YMax],
+                     cellsize=[self.meanCellWidth, self.meanCellHeight],
+                     nodata=[] if self.noDataValue is None else
+                            [self.noDataValue],
+                     wkid=[] if self.spatialReference.factoryCode is None
+                          else [self.spatialReference.factoryCode])
+        self.catalogPath = os.path.abspath(path)
+
+    def copy(self, arr=None, nodata=None):
+        # Returns a raster on the same grid with other values
+        return Raster(arr=self.arr.copy() if arr is None else arr,
+                      xmin=self.extent.XMin, ymax=self.extent.YMax,
+                      cellsize=(self.meanCellWidth, self.meanCellHeight),
+                      nodata=self.noDataValue if nodata is None else nodata,
+                      wkid=self.spatialReference.factoryCode)
+
+    def __rsub__(self, other):
+        out = self.arr.astype(np.int64)
+        valid = out != self.noDataValue
+        out[valid] = other - out[valid]
+        return self.copy(out.astype(self.arr.dtype))
+
+
+class FakeArcpy:
+    '''
+    Stand-in for the arcpy module. Datasets are added with add_features()
+    and add_raster() and are then used by name or path like real ones.
+    Calls are recorded in log.
+
+    Attributes
+    ----------
+    log : CallLog
+        recorded calls
+    env : namespace
+        arcpy.env settings
+    da, sa : namespace
+        arcpy.da cursors and arcpy.sa tools
+    features : dict
+        feature classes by name
+    layers : dict
+        layers by name
+    '''
+    SpatialReference = SpatialReference
+    Extent = Extent
+    Point = Point
+    Multipoint = Multipoint
+    Array = list
+
+    def __init__(self):
+        self.log = CallLog()
+        self.env = types.SimpleNamespace(overwriteOutput=False,
+                addOutputsToMap=True, snapRaster=None,
+                outputCoordinateSystem=None, compression=None,
+                tileSize=None, pyramid=None, extent=None, mask=None)
+        self.da = types.SimpleNamespace(SearchCursor=self.SearchCursor,
+                                        UpdateCursor=self.UpdateCursor,
+                                        InsertCursor=self.InsertCursor)
+        self.sa = types.SimpleNamespace(ExtractByMask=self.ExtractByMask,
+                                        Reclassify=self.Reclassify,
+                                        RemapValue=list)
+        self.features = {}
+        self.layers = {}
+
+    def __getattr__(self, name):
+        # any other tool is recorded and does nothing
+        if not name.endswith(('_management', '_conversion')):
+            raise AttributeError(name)
+
+        def tool(*args, **kwargs):
+            self.log.record(name)
+        return tool
+
+    # ------------------------------------------------------------ datasets
+    def add_features(self, name, fields, rows=(), oid_field='FID',
+                     layer=True):
+        '''
+        Adds a feature class and, if layer is True, a layer of the same
+        name. Each row is a dictionary of field values and 'SHAPE', a
+        Geometry, or a list of rings for a polygon, or an (x, y) tuple for a
+        point.
+        '''
+        fc = FeatureClass(name, fields, oid_field=oid_field)
+        for row in rows:
+            row = dict(row)
+            row['SHAPE'] = self.__geometry(row.get('SHAPE'))
+            fc.insert(row)
+        self.features[name] = fc
+        if layer:
+            self.layers[name] = Layer(name, fc)
+        return fc
+
+    def add_raster(self, path, arr, xmin, ymax, cellsize=(1., 1.),
+                   nodata=None, wkid=None):
+        '''
+        Saves an array as a raster at path and returns it.
+        '''
+        ras = Raster(arr=arr, xmin=xmin, ymax=ymax, cellsize=cellsize,
+                     nodata=nodata, wkid=wkid)
+        ras.save(path)
+        return ras
+
+    def budget(self, limits):
+        '''
+        Same as log.budget(limits).
+        '''
+        return self.log.budget(limits)
+
+    def __geometry(self, shape):
+        # Converts a row shape to a Geometry
+        if shape is None or isinstance(shape, Geometry):
+            return shape
+        if len(shape) == 2 and np.isscalar(shape[0]):
+            return Geometry('Point', [[shape]])
+        return Geometry('Polygon', shape)
+
+    def __dataset(self, name):
+        # Returns the layer or a layer over the feature class of a name
+        name = getattr(name, 'name', name)
+        if name in self.layers:
+            return self.layers[name]
+        if name in self.features:
+            return Layer(name, self.features[name])
+        raise ValueError('Dataset does not exist: %s' % name)
+
+    def __where(self, fc, where_clause):
+        # Converts a simple SQL where clause to a row predicate
+        if not where_clause:
+            return lambda oid, row: True
+        expr = re.sub(r'(?<![<>!=])=(?!=)', '==', where_clause)
+        expr = expr.replace('<>', '!=')
+        expr = re.sub(r'\b(AND|OR|NOT|IN|IS NULL)\b',
+                      lambda m: {'IS NULL': 'is None'}.get(m.group(1),
+                                                           m.group(1).lower()),
+                      expr, flags=re.IGNORECASE)
+        # IN lists are tuples even with a single value
+        expr = re.sub(r'\bin\s*\(([^()]*)\)', r'in (\1,)', expr)
+        names = '|'.join(map(re.escape, fc.fields + [fc.oid_field]))
+        expr = re.sub(r'"?\b(%s)\b"?' % names, r'_row["\1"]', expr)
+        code = compile(expr, '<where>', 'eval')
+
+        def predicate(oid, row):
+            values = dict(row)
+            values[fc.oid_field] = oid
+            return eval(code, {}, {'_row': values})
+        return predicate
+
+    def __value(self, layer, oid, row, field):
+        # Returns a cursor field value
+        shape = row.get('SHAPE')
+        if field == 'OID@' or field == layer.source.oid_field:
+            return oid
+        if field == 'SHAPE@':
+            return shape
+        if field == 'SHAPE@WKB':
+            return shape.WKB
+        if field == 'SHAPE@XY':
+            c = shape.centroid
+            return (c.X, c.Y)
+        return row.get(field)
+
+    def __raster(self, raster):
+        # Returns a Raster for a path or Raster
+        if isinstance(raster, Raster):
+            return raster
+        return Raster(raster.strip().strip('\'"'))
+
+    def __rasters(self, inputs):
+        # Returns the Rasters of a list or a ;-separated string of inputs
+        if isinstance(inputs, str):
+            inputs = inputs.split(';')
+        return [self.__raster(x) for x in inputs]
+
+    # ------------------------------------------------------------- cursors
+    def SearchCursor(self, in_table, field_names, where_clause=None,
+                     spatial_reference=None, **kwargs):
+        layer = self.__dataset(in_table)
+        match = self.__where(layer.source, where_clause)
+        rows = [tuple(self.__value(layer, oid, layer.source.rows[oid], f)
+                      for f in field_names)
+                for oid in layer.active()
+                if match(oid, layer.source.rows[oid])]
+        self.log.record('SearchCursor', len(rows))
+        return _Cursor(rows)
+
+    def UpdateCursor(self, in_table, field_names, where_clause=None,
+                     **kwargs):
+        layer = self.__dataset(in_table)
+        match = self.__where(layer.source, where_clause)
+        oids = [oid for oid in layer.active()
+                if match(oid, layer.source.rows[oid])]
+        self.log.record('UpdateCursor', len(oids))
+
+        def read(oid):
+            return [self.__value(layer, oid, layer.source.rows[oid], f)
+                    for f in field_names]
+
+        def write(oid, values):
+            self.__set_values(layer.source, oid, field_names, values)
+        return _UpdateCursor(layer.source, oids, read, write)
+
+    def InsertCursor(self, in_table, field_names):
+        fc = self.__dataset(in_table).source
+        self.log.record('InsertCursor')
+
+        def insert(values):
+            oid = fc.insert({})
+            self.__set_values(fc, oid, field_names, values)
+            return oid
+        return _InsertCursor(insert)
+
+    def __set_values(self, fc, oid, field_names, values):
+        # Writes cursor values back to a row
+        row = fc.rows[oid]
+        for field, value in zip(field_names, values):
+            if field in ('SHAPE@', 'SHAPE@XY'):
+                row['SHAPE'] = self.__geometry(value)
+            elif field not in ('OID@', fc.oid_field):
+                row[field] = value
+
+    # ---------------------------------------------------------- selections
+    def SelectLayerByAttribute_management(self, in_layer_or_view,
+                                          selection_type='NEW_SELECTION',
+                                          where_clause=None, **kwargs):
+        layer = self.__dataset(in_layer_or_view)
+        self.log.record('SelectLayerByAttribute_management',
+                        len(layer.source.rows))
+        if selection_type == 'CLEAR_SELECTION':
+            layer.selection = None
+            return layer
+        match = self.__where(layer.source, where_clause)
+        layer.selection = self.__combine(layer, selection_type,
+                set(oid for oid in layer.defined()
+                    if match(oid, layer.source.rows[oid])))
+        return layer
+
+    def SelectLayerByLocation_management(self, in_layer, overlap_type=
+                                         'INTERSECT', select_features=None,
+                                         search_distance=None,
+                                         selection_type='NEW_SELECTION',
+                                         **kwargs):
+        layer = self.__dataset(in_layer)
+        others = self.__dataset(select_features)
+        shapes = [others.source.rows[x]['SHAPE'] for x in others.active()]
+        self.log.record('SelectLayerByLocation_management',
+                        len(layer.source.rows) * len(shapes))
+        within = overlap_type.upper() in ('WITHIN', 'COMPLETELY_WITHIN')
+        oids = set()
+        for oid in layer.defined():
+            shape = layer.source.rows[oid]['SHAPE']
+            for other in shapes:
+                if within:
+                    hit = other.contains(shape.vertices()).all()
+                else:
+                    hit = other.contains(shape.vertices()).any() or \
+                            shape.contains(other.vertices()).any()
+                if hit:
+                    oids.add(oid)
+                    break
+        layer.selection = self.__combine(layer, selection_type, oids)
+        return layer
+
+    def __combine(self, layer, selection_type, oids):
+        # Combines a new selection with the current one
+        current = set(layer.active()) if layer.selection is not None \
+                else set()
+        selection_type = selection_type.upper()
+        if selection_type == 'ADD_TO_SELECTION':
+            return current | oids
+        if selection_type == 'REMOVE_FROM_SELECTION':
+            return current - oids
+        if selection_type == 'SUBSET_SELECTION':
+            return current & oids
+        return oids
+
+    def MakeFeatureLayer_management(self, in_features, out_layer,
+                                    where_clause=None, **kwargs):
+        source = self.__dataset(in_features)
+        match = self.__where(source.source, where_clause)
+        self.log.record('MakeFeatureLayer_management')
+        self.layers[out_layer] = Layer(out_layer, source.source,
+                set(oid for oid in source.active()
+                    if match(oid, source.source.rows[oid])))
+        return self.layers[out_layer]
+
+    # -------------------------------------------------------------- fields
+    def ListFields(self, dataset, wild_card=None, field_type=None):
+        fc = self.__dataset(dataset).source
+        self.log.record('ListFields')
+        return [Field(x) for x in [fc.oid_field] + fc.fields
+                if wild_card is None or fnmatch.fnmatch(x, wild_card)]
+
+    def AddField_management(self, in_table, field_name, field_type,
+                            *args, **kwargs):
+        fc = self.__dataset(in_table).source
+        self.log.record('AddField_management', len(fc.rows))
+        if field_name not in fc.fields:
+            fc.fields.append(field_name)
+            for row in fc.rows.values():
+                row[field_name] = None
+
+    def DeleteField_management(self, in_table, drop_field, **kwargs):
+        fc = self.__dataset(in_table).source
+        self.log.record('DeleteField_management', len(fc.rows))
+        for field in [drop_field] if isinstance(drop_field, str) \
+                else drop_field:
+            if field in fc.fields:
+                fc.fields.remove(field)
+                for row in fc.rows.values():
+                    row.pop(field, None)
+
+    def CalculateField_management(self, in_table, field, expression,
+                                  *args, **kwargs):
+        layer = self.__dataset(in_table)
+        oids = layer.active()
+        self.log.record('CalculateField_management', len(oids))
+        code = compile(re.sub(r'!([^!]+)!', r'_row["\1"]', expression),
+                       '<expression>', 'eval')
+        for oid in oids:
+            row = layer.source.rows[oid]
+            row[field] = eval(code, {}, {'_row': row})
+
+    def CalculateGeometryAttributes_management(self, in_features,
+                                               geometry_property,
+                                               length_unit='',
+                                               area_unit='', **kwargs):
+        layer = self.__dataset(in_features)
+        oids = layer.active()
+        self.log.record('CalculateGeometryAttributes_management', len(oids))
+        scale = 1e-6 if area_unit == 'SQUARE_KILOMETERS' else 1.
+        for oid in oids:
+            row = layer.source.rows[oid]
+            for field, prop in geometry_property:
+                if prop == 'AREA':
+                    row[field] = row['SHAPE'].area * scale
+
+    # ------------------------------------------------------------- rasters
+    def Raster(self, path):
+        self.log.record('Raster')
+        return Raster(path)
+
+    def Describe(self, value):
+        self.log.record('Describe')
+        name = getattr(value, 'name', value)
+        if isinstance(value, Raster) or (name not in self.layers and
+                                         name not in self.features):
+            ras = self.__raster(value)
+            return types.SimpleNamespace(extent=ras.extent,
+                    catalogPath=ras.catalogPath,
+                    spatialReference=ras.spatialReference,
+                    meanCellWidth=ras.meanCellWidth,
+                    meanCellHeight=ras.meanCellHeight)
+        layer = self.__dataset(value)
+        shapes = [layer.source.rows[x]['SHAPE'] for x in layer.defined()]
+        coords = np.vstack([x.vertices() for x in shapes])
+        return types.SimpleNamespace(
+                extent=Extent(*coords.min(axis=0), *coords.max(axis=0)),
+                catalogPath=layer.source.name,
+                OIDFieldName=layer.source.oid_field,
+                spatialReference=SpatialReference(None))
+
+    def RasterToNumPyArray(self, in_raster, lower_left_corner=None,
+                           ncols=None, nrows=None, nodata_to_value=None):
+        ras = self.__raster(in_raster)
+        ext = ras.extent
+        w = ras.meanCellWidth
+        h = ras.meanCellHeight
+        col = 0
+        row = 0
+        if lower_left_corner is not None:
+            col = int(round((lower_left_corner.X - ext.XMin) / w))
+        ncols = ras.width - col if not ncols else ncols
+        if lower_left_corner is not None:
+            row = int(round((ext.YMax - lower_left_corner.Y) / h)) - \
+                    (nrows or 0)
+        nrows = ras.height - row if not nrows else nrows
+        arr = ras.arr[:, row:row + nrows, col:col + ncols].copy()
+        if nodata_to_value is not None and ras.noDataValue is not None:
+            arr[arr == ras.noDataValue] = nodata_to_value
+        self.log.record('RasterToNumPyArray', arr.size)
+        return arr[0] if ras.bandCount == 1 else arr
+
+    def NumPyArrayToRaster(self, in_array, lower_left_corner=None,
+                           x_cell_size=1., y_cell_size=None,
+                           value_to_nodata=None):
+        arr = np.asarray(in_array)
+        y_cell_size = y_cell_size or x_cell_size
+        corner = lower_left_corner or Point()
+        self.log.record('NumPyArrayToRaster', arr.size)
+        return Raster(arr=arr, xmin=corner.X,
+                      ymax=corner.Y + arr.shape[-2] * y_cell_size,
+                      cellsize=(x_cell_size, y_cell_size),
+                      nodata=value_to_nodata)
+
+    def CopyRaster_management(self, in_raster, out_rasterdataset,
+                              *args, nodata_value=None, **kwargs):
+        ras = self.__raster(in_raster)
+        self.log.record('CopyRaster_management', ras.arr.size)
+        if nodata_value not in (None, ''):
+            ras = ras.copy(nodata=int(nodata_value))
+        ras.save(out_rasterdataset)
+
+    def ProjectRaster_management(self, in_raster, out_raster, *args,
+                                 **kwargs):
+        ras = self.__raster(in_raster)
+        self.log.record('ProjectRaster_management', ras.arr.size)
+        ras.save(out_raster)
+
+    def DefineProjection_management(self, in_dataset, coor_system):
+        self.log.record('DefineProjection_management')
+        if os.path.exists(in_dataset):
+            ras = Raster(in_dataset)
+            ras.spatialReference = coor_system
+            ras.save(in_dataset)
+
+    def Mosaic_management(self, inputs, target, mosaic_type='LAST',
+                          *args, **kwargs):
+        out = Raster(target)
+        cells = self.__paste(out, self.__rasters(inputs))
+        self.log.record('Mosaic_management', cells)
+        out.save(target)
+
+    def MosaicToNewRaster_management(self, input_rasters, output_location,
+                                     raster_dataset_name_with_extension,
+                                     *args, **kwargs):
+        rasters = self.__rasters(input_rasters)
+        first = rasters[0]
+        w = first.meanCellWidth
+        h = first.meanCellHeight
+        xmin = min(x.extent.XMin for x in rasters)
+        ymax = max(x.extent.YMax for x in rasters)
+        ncols = int(round((max(x.extent.XMax for x in rasters) - xmin) / w))
+        nrows = int(round((ymax - min(x.extent.YMin for x in rasters)) / h))
+        nodata = first.noDataValue
+        out = Raster(arr=np.full((first.bandCount, nrows, ncols),
+                                 0 if nodata is None else nodata,
+                                 dtype=first.arr.dtype),
+                     xmin=xmin, ymax=ymax, cellsize=(w, h), nodata=nodata,
+                     wkid=first.spatialReference.factoryCode)
+        cells = self.__paste(out, rasters)
+        self.log.record('MosaicToNewRaster_management', cells)
+        out.save('%s/%s' % (output_location,
+                            raster_dataset_name_with_extension))
+
+    def __paste(self, out, rasters):
+        # Copies the valid cells of rasters onto out in order
+        cells = 0
+        for ras in rasters:
+            col = int(round((ras.extent.XMin - out.extent.XMin) /
+                            out.meanCellWidth))
+            row = int(round((out.extent.YMax - ras.extent.YMax) /
+                            out.meanCellHeight))
+            r0, c0 = max(row, 0), max(col, 0)
+            r1 = min(row + ras.height, out.height)
+            c1 = min(col + ras.width, out.width)
+            if r1 <= r0 or c1 <= c0:
+                continue
+            src = ras.arr[:, r0 - row:r1 - row, c0 - col:c1 - col]
+            dst = out.arr[:, r0:r1, c0:c1]
+            valid = src != ras.noDataValue if ras.noDataValue is not None \
+                    else np.ones(src.shape, dtype=bool)
+            dst[valid] = src[valid]
+            cells += src.size
+        return cells
+
+    def ExtractByMask(self, in_raster, in_mask_data):
+        ras = self.__raster(in_raster)
+        layer = self.__dataset(in_mask_data)
+        polygons = [layer.source.rows[x]['SHAPE'].rings
+                    for x in layer.active()]
+        inside = burn_polygons(polygons, [1] * len(polygons),
+                ras.extent.XMin, ras.extent.YMax,
+                (ras.meanCellWidth, ras.meanCellHeight), ras.height,
+                ras.width, 0, bool)
+        nodata = 3 if ras.noDataValue is None else ras.noDataValue
+        self.log.record('ExtractByMask', ras.arr.size)
+        return ras.copy(np.where(inside, ras.arr, nodata).astype(
+                ras.arr.dtype), nodata)
+
+    def Reclassify(self, in_raster, reclass_field, remap, *args, **kwargs):
+        ras = self.__raster(in_raster)
+        out = ras.arr.copy()
+        for old, new in remap:
+            out[ras.arr == old] = new
+        self.log.record('Reclassify', ras.arr.size)
+        return ras.copy(out)
+
+    def Delete_management(self, in_data, *args, **kwargs):
+        self.log.record('Delete_management')
+        name = getattr(in_data, 'name', in_data)
+        self.layers.pop(name, None)
+        self.features.pop(name, None)
+        if isinstance(name, str) and os.path.isfile(name):
+            os.remove(name)
+
+
+class _Cursor:
+    # Cursor over precomputed rows; a context manager like arcpy.da cursors
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class _UpdateCursor(_Cursor):
+    # Cursor whose rows can be updated or deleted; read(oid) returns the
+    # values of a row and write(oid, values) updates it
+    def __init__(self, fc, oids, read, write):
+        self.fc = fc
+        self.oids = oids
+        self.read = read
+        self.write = write
+        self.oid = None
+
+    def __iter__(self):
+        for oid in self.oids:
+            if oid not in self.fc.rows:
+                continue
+            self.oid = oid
+            yield self.read(oid)
+
+    def updateRow(self, row):
+        self.write(self.oid, row)
+
+    def deleteRow(self):
+        del self.fc.rows[self.oid]
+
+
+class _InsertCursor(_Cursor):
+    # Cursor that adds rows with insert(values)
+    def __init__(self, insert):
+        self.insert = insert
+
+    def insertRow(self, row):
+        return self.insert(row)
+
+
+def install(fake=None):
+    '''
+    This function installs a stand-in as the arcpy, arcpy.da, and arcpy.sa
+    modules so that importing canopy.canopy uses it. It must run before
+    canopy.canopy is imported.
+
+    Parameters
+    ----------
+        fake : FakeArcpy
+            stand-in to install (default a new one)
+
+    Returns
+    -------
+        FakeArcpy
+    '''
+    if fake is None:
+        fake = FakeArcpy()
+    sys.modules['arcpy'] = fake
+    sys.modules['arcpy.da'] = fake.da
+    sys.modules['arcpy.sa'] = fake.sa
+    return fake
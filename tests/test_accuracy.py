@@ -0,0 +1,83 @@
+import csv
+import numpy as np
+from canopy.accuracy import confusion_matrices, accuracy_metrics, \
+        bootstrap_metrics, assess_accuracy, write_accuracy_report, \
+        inversion_confidence
+
+# reference x mapped counts of two regions; a third region has no points
+CM = np.array([[[40, 10], [5, 45]],
+               [[8, 2], [2, 8]],
+               [[0, 0], [0, 0]]])
+
+
+def points(cm):
+    regions, truth, predicted = [], [], []
+    for r, t, p in np.ndindex(cm.shape):
+        regions += [r] * cm[r, t, p]
+        truth += [t] * cm[r, t, p]
+        predicted += [p] * cm[r, t, p]
+    return np.array(regions), np.array(truth), np.array(predicted)
+
+
+def test_confusion_matrices():
+    assert (confusion_matrices(*points(CM), 3, 2) == CM).all()
+
+
+def test_accuracy_metrics_by_hand():
+    metrics = accuracy_metrics(CM[:2])
+    assert metrics['n'].tolist() == [100, 20]
+    assert np.allclose(metrics['overall'], [0.85, 0.8])
+    # chance agreement is (50 * 45 + 50 * 55) / 100**2 = 0.5 and
+    # (10 * 10 + 10 * 10) / 20**2 = 0.5
+    assert np.allclose(metrics['kappa'], [0.7, 0.6])
+    assert np.allclose(metrics['user'], [[40 / 45, 45 / 55], [0.8, 0.8]])
+    assert np.allclose(metrics['producer'], [[0.8, 0.9], [0.8, 0.8]])
+    # empty regions divide by zero
+    assert np.isnan(accuracy_metrics(CM[2])['kappa'])
+
+
+def test_bootstrap_is_reproducible():
+    args = points(CM) + (3, 2, 100)
+    a = bootstrap_metrics(*args, seed=7, num_workers=1, chunk_size=30)
+    b = bootstrap_metrics(*args, seed=7, num_workers=2, chunk_size=30)
+    assert a['overall'].shape == (100, 4)
+    assert a['user'].shape == (100, 4, 2)
+    for k in a:
+        assert np.array_equal(a[k], b[k], equal_nan=True)
+    c = bootstrap_metrics(*args, seed=8, num_workers=1, chunk_size=30)
+    assert not np.array_equal(a['overall'], c['overall'])
+
+
+def test_assess_accuracy(tmp_path):
+    result = assess_accuracy(*points(CM), 3, num_resamples=500, seed=0,
+                             num_workers=1)
+    assert (result['cm'][:3] == CM).all()
+    assert (result['cm'][3] == CM.sum(axis=0)).all()
+    assert np.allclose(result['overall'][[0, 1, 3]], [0.85, 0.8, 101 / 120])
+    for k in ('overall', 'kappa', 'user', 'producer'):
+        ci = result['%s_ci' % k][[0, 1, 3]]
+        estimate = result[k][[0, 1, 3]]
+        assert (ci[..., 0] <= estimate).all()
+        assert (estimate <= ci[..., 1]).all()
+    # the smaller region has the wider interval
+    width = np.diff(result['overall_ci'], axis=-1)[:, 0]
+    assert width[1] > width[0] > width[3]
+    assert np.isnan(result['overall_ci'][2]).all()
+
+    path = '%s/accuracy.csv' % tmp_path
+    write_accuracy_report(path, ['A', 'B', 'C'], result)
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    assert [x['region'] for x in rows] == ['A', 'B', 'C', 'Statewide']
+    assert rows[0]['n'] == '100'
+    assert float(rows[0]['kappa']) == result['kappa'][0]
+    assert rows[0]['cm_0_1'] == '10'
+
+
+def test_inversion_confidence():
+    mean, inverted, confidence = inversion_confidence([0.1, 0.2, 0.15],
+                                                      [10, 10, 20])
+    assert np.isclose(mean, 0.15)
+    assert inverted and confidence > 0.99
+    assert not inversion_confidence([0.9, 0.8], [10, 10])[1]
+    assert inversion_confidence([0.1], [0])[2] == 0.5
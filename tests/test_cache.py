@@ -0,0 +1,67 @@
+import os
+import time
+from canopy.cache import FileCache, ResultCache
+
+
+def writer(data):
+    def write(path):
+        with open(path, 'w') as f:
+            f.write(data)
+    return write
+
+
+def test_file_cache_evicts_least_recently_used(tmp_path):
+    cache = FileCache('%s/cache' % tmp_path, 1000, min_age=60)
+    for name in 'abc':
+        cache.store(name, writer('x' * 100))
+    # over budget, but all the entries were just used
+    cache.max_bytes = 250
+    assert cache.evict() == 0
+    assert sorted(os.listdir(cache.cache_path)) == ['a', 'b', 'c']
+    now = time.time()
+    for i, name in enumerate('abc'):
+        os.utime(cache.entry_path(name), (now - 1000 + i, now - 1000 + i))
+
+    # a becomes the most recently used entry; d pushes b and c out
+    assert cache.lookup('a') == cache.entry_path('a')
+    assert cache.lookup('missing') is None
+    cache.store('d', writer('x' * 100))
+    assert sorted(os.listdir(cache.cache_path)) == ['a', 'd']
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 1, 2)
+    assert stats['cached_bytes'] == 200
+
+    # entries used within min_age are kept even over budget
+    cache.store('e', writer('x' * 100))
+    assert sorted(os.listdir(cache.cache_path)) == ['a', 'd', 'e']
+    assert cache.totals()['cached_bytes'] == 300
+
+
+def test_result_cache_fetch_round_trip(tmp_path):
+    cache = ResultCache('%s/cache' % tmp_path, 10**6)
+    for name in ('src1.tif', 'src2.tif'):
+        writer('input')('%s/%s' % (tmp_path, name))
+    key = cache.key('clip', ['%s/src1.tif' % tmp_path], wkid=102039)
+    # the key depends on the contents of the inputs, not their paths
+    assert cache.key('clip', ['%s/src2.tif' % tmp_path], wkid=102039) == key
+    assert cache.key('clip', ['%s/src1.tif' % tmp_path], wkid=5070) != key
+    assert cache.key('mosaic', ['%s/src1.tif' % tmp_path], wkid=102039) != \
+            key
+
+    out1 = '%s/out1.tif' % tmp_path
+    out2 = '%s/out2.tif' % tmp_path
+    assert not cache.fetch(key, out1)
+    assert not os.path.exists(out1)
+    writer('result')(out1)
+    cache.put(key, out1)
+    assert cache.fetch(key, out2)
+    with open(out2) as f:
+        assert f.read() == 'result'
+    assert not [x for x in os.listdir(tmp_path) if x.startswith('tmp_')]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # changed contents are a new key
+    with open('%s/src1.tif' % tmp_path, 'w') as f:
+        f.write('changed')
+    assert cache.key('clip', ['%s/src1.tif' % tmp_path],
+                     wkid=102039) != key
@@ -0,0 +1,115 @@
+import os
+import numpy as np
+import pytest
+from .conftest import REGIONS, TILES
+from .fakearcpy import BudgetExceeded
+
+
+def test_clip_final_tiles_selects_at_most_once_per_region(arcpy, config):
+    from canopy import canopy
+    with arcpy.log.budget({'SelectLayerBy*': len(REGIONS),
+                           'MakeFeatureLayer_management':
+                               len(REGIONS) + len(TILES)}):
+        canopy.clip_final_tiles(config)
+    for name in REGIONS.values():
+        outputs = '%s/%s/Outputs' % (config.results_path,
+                                     name.replace(' ', '_'))
+        assert len([x for x in os.listdir(outputs)
+                    if x.startswith('cfr')]) == 2
+
+
+def test_budget_exceeded(arcpy, config):
+    from canopy import canopy
+    with pytest.raises(BudgetExceeded, match='MakeFeatureLayer'):
+        with arcpy.log.budget({'MakeFeatureLayer_management': 0}):
+            canopy.clip_final_tiles(config)
+
+
+def test_plan_clip_mosaic(arcpy, config):
+    from canopy import canopy
+    plan = canopy.plan_work(config)
+    assert sorted(x.phyreg_id for x in plan) == sorted(REGIONS)
+    assert all(len(x.stage('clip').work) == 2 for x in plan)
+
+    canopy.clip_final_tiles(config)
+    canopy.mosaic_clipped_final_tiles(config)
+    for name in REGIONS.values():
+        name = name.replace(' ', '_')
+        mosaic = '%s/%s/Outputs/mosaic_2009_%s.tif' % (config.results_path,
+                                                       name, name)
+        # both final tiles of the region with their one-cell margins
+        assert arcpy.Raster(mosaic).arr.squeeze().shape == (12, 22)
+
+    plan = canopy.plan_work(config)
+    assert not any(x.stage('clip').work or x.stage('mosaic').work
+                   for x in plan)
+
+
+def test_mosaic_job(arcpy, config):
+    from canopy import canopy
+    with pytest.raises(ValueError, match='No clipped final tiles'):
+        canopy.run_job(config, {'stage': 'mosaic', 'phyreg_id': 8})
+
+    canopy.clip_final_tiles(config)
+    outputs = canopy.run_job(config, {'stage': 'mosaic', 'phyreg_id': 8})
+    assert outputs == ['%s/Winder_Slope/Outputs/canopy_2009_Winder_Slope.tif'
+                       % config.results_path]
+    assert canopy.run_job(config, {'stage': 'mosaic',
+                                   'phyreg_id': 8}) == [None]
+
+
+def test_regions_are_adopted_when_first_planned(arcpy, config):
+    from canopy import canopy
+    # outputs of runs before the journal was introduced
+    plan = canopy.plan_work(config, [8], adopt=True)
+    assert plan.journal.exists
+    plan = canopy.plan_work(config, adopt=True)
+    assert all(len(x.stage('clip').work) == 2 for x in plan)
+
+    # outputs written after adoption are trusted only if recorded
+    region = plan.regions[0]
+    with open('%s/frm_3408399_ne_17_1.tif' % region.outputs_path, 'w') as f:
+        f.write('truncated')
+    plan = canopy.plan_work(config, adopt=True)
+    assert 'frm_3408399_ne_17_1.tif' not in plan.regions[0].complete_outputs
+
+
+def test_prefilter_replaces_truncated_clipped_tile(arcpy, config):
+    from canopy import canopy
+    config.prefilter_ndvi_threshold = 0.2
+    config.prefilter_max_vegetated_fraction = 0.001
+    config.prefilter_windows = 4
+    os.makedirs('%s/34083' % config.naip_path)
+    rng = np.random.default_rng(0)
+    for i, tile in enumerate(TILES):
+        arr = rng.integers(10, 200, (4, 40, 40)).astype(np.uint8)
+        if i == 1:
+            # water: NIR below red
+            arr[3] = arr[0] // 2
+        arcpy.add_raster('%s/%s/%s.tif' % (config.naip_path, tile[2:7],
+                                          tile),
+                         arr, i * 10, 10, (0.25, 0.25), wkid=102039)
+    arcpy.add_raster(config.snaprast_path, np.zeros((1, 4, 4), np.uint8),
+                     0, 10, (1, 1), wkid=102039)
+    canopy.plan_work(config, adopt=True)
+    # left by a crash after adoption and not in the journal
+    cfr_path = '%s/Winder_Slope/Outputs/cfr%s.tif' % (config.results_path,
+                                                     TILES[1])
+    with open(cfr_path, 'w') as f:
+        f.write('truncated')
+
+    summaries = canopy.prefilter_naip_tiles(config, [8])
+    assert summaries[TILES[1]]['skipped']
+    assert not summaries[TILES[0]]['skipped']
+    assert canopy.plan_work(config, [8]).regions[0].prefiltered == \
+            {TILES[1]}
+
+
+def test_benchmark_codecs_restores_env(arcpy, config):
+    from canopy import canopy
+    canopy.clip_final_tiles(config)
+    before = vars(arcpy.env).copy()
+    results = canopy.benchmark_codecs(config, 2, ['NONE', 'LZW'], seed=0)
+    assert [(x['codec'], x['kind'], x['tiles']) for x in results] == \
+            [('NONE', 'canopy', 2), ('LZW', 'canopy', 2)]
+    assert vars(arcpy.env) == before
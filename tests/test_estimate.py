@@ -0,0 +1,67 @@
+import math
+import numpy as np
+from canopy.estimate import ratio_estimate, confidence_interval, \
+        adaptive_estimate
+
+# canopy probability of the cells of each stratum and cells per unit
+P = [0.3, 0.7]
+CELLS = 25
+
+
+def draw(h, n, rng):
+    return rng.binomial(CELLS, P[h], n), np.full(n, CELLS)
+
+
+def test_ratio_estimate_one_stratum():
+    ratio, se = ratio_estimate([1, 2, 3], [2, 2, 2], [0, 0, 0], [10])
+    assert ratio == 1.
+    # residuals -1, 0, 1 have a variance of 1; se = N * sqrt(1 / n) / X
+    assert math.isclose(se, 10 * math.sqrt(1 / 3) / 20)
+
+
+def test_ratio_estimate_strata():
+    y = np.array([1, 1, 3, 0, 2, 4])
+    x = np.array([2, 2, 2, 4, 4, 4])
+    strata = np.array([0, 0, 0, 1, 1, 1])
+    sizes = np.array([4, 6])
+    ratio, se = ratio_estimate(y, x, strata, sizes)
+    # estimated totals of y and x
+    y_total = 4 * 5 / 3 + 6 * 2
+    x_total = 4 * 2 + 6 * 4
+    assert math.isclose(ratio, y_total / x_total)
+    var = sum(sizes[h]**2 * np.var((y - ratio * x)[strata == h], ddof=1) / 3
+              for h in range(2))
+    assert math.isclose(se, math.sqrt(var) / x_total)
+
+    # an unsampled stratum is left out
+    assert ratio_estimate(y, x, strata, [4, 6, 100]) == (ratio, se)
+    # one sample in a stratum gives no standard error
+    ratio, se = ratio_estimate([1, 1, 3], [2, 2, 2], [0, 0, 1], [4, 6])
+    assert math.isclose(ratio, (4 + 18) / 20) and math.isnan(se)
+    assert all(map(math.isnan, ratio_estimate([0], [0], [0], [1])))
+
+
+def test_confidence_interval():
+    lower, upper = confidence_interval(0.5, 0.1)
+    assert math.isclose(lower, 0.5 - 0.195996, abs_tol=1e-6)
+    assert math.isclose(upper, 0.5 + 0.195996, abs_tol=1e-6)
+    lower, upper = confidence_interval(0.01, 0.1)
+    assert lower == 0. and math.isclose(upper, 0.01 + 0.195996, abs_tol=1e-6)
+    assert confidence_interval(0.99, 0.1, 0.5)[1] == 1.
+
+
+def test_adaptive_estimate_converges():
+    sizes = [1000, 3000]
+    result = adaptive_estimate(draw, sizes, error=0.01, seed=1)
+    assert result['converged']
+    assert result['half_width'] <= 0.01
+    assert 100 < result['units'] < 5000
+    # the population ratio is (1000 * 0.3 + 3000 * 0.7) / 4000
+    assert abs(result['estimate'] - 0.6) < 3 * result['se']
+    assert result['lower'] < result['estimate'] < result['upper']
+    assert adaptive_estimate(draw, sizes, error=0.01, seed=1) == result
+
+    result = adaptive_estimate(draw, sizes, error=0.0001, max_units=300,
+                               seed=1)
+    assert not result['converged']
+    assert result['units'] == 300
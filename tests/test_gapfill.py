@@ -0,0 +1,73 @@
+import numpy as np
+from canopy.gapfill import fill_gaps, has_gaps
+
+
+def test_has_gaps():
+    arr = np.zeros((6, 8), dtype=np.uint8)
+    assert not has_gaps(arr)
+    # a one-cell-wide seam between tiles
+    arr[2, 1:6] = 3
+    assert has_gaps(arr)
+    arr[2, 1:6] = 0
+    arr[1:5, 4] = 255
+    assert has_gaps(arr)
+
+    # nodata only outside the region boundary
+    arr = np.zeros((6, 8), dtype=np.uint8)
+    arr[:3, :5] = 3
+    arr[3, :2] = 3
+    assert not has_gaps(arr)
+
+
+def test_fill_gaps():
+    arr = np.zeros((12, 12), dtype=np.uint8)
+    arr[:, :6] = 1
+    inside = np.ones(arr.shape, dtype=bool)
+    inside[:, 10:] = False
+    arr[:, 10:] = 3
+    # a 3 x 3 hole in canopy and a seam between canopy and noncanopy
+    arr[4:7, 1:4] = 3
+    arr[9, 3:9] = 3
+    filled, gaps, unfilled = fill_gaps(arr, inside)
+    assert (gaps == ((arr == 3) & inside)).all()
+    assert not unfilled.any()
+    assert (filled[4:7, 1:4] == 1).all()
+    # the seam takes the majority class of its neighbors
+    assert filled[9, 3:9].tolist() == [1, 1, 1, 0, 0, 0]
+    # nodata outside the region is not a gap
+    assert (filled[:, 10:] == 3).all()
+    assert (arr[4:7, 1:4] == 3).all()
+    # ties become noncanopy
+    arr = np.array([[1, 3, 0]], dtype=np.uint8)
+    assert fill_gaps(arr, arr >= 0)[0].tolist() == [[1, 0, 0]]
+
+
+def test_fill_gaps_max_distance():
+    arr = np.ones((15, 15), dtype=np.uint8)
+    arr[2:13, 2:13] = 3
+    inside = np.ones(arr.shape, dtype=bool)
+    filled, gaps, unfilled = fill_gaps(arr, inside, max_distance=3)
+    assert gaps.sum() == 121
+    # three rings are filled and the 5 x 5 center is left as nodata
+    assert (unfilled == (np.pad(np.ones((5, 5)), 5) > 0)).all()
+    assert (filled[unfilled] == 3).all()
+    assert (filled[gaps & ~unfilled] == 1).all()
+
+
+def test_fill_gaps_blockwise_matches_whole():
+    rng = np.random.default_rng(0)
+    arr = (rng.random((60, 60)) < 0.5).astype(np.uint8)
+    arr[rng.random(arr.shape) < 0.3] = 3
+    arr[20:35, 25:45] = 3
+    inside = np.ones(arr.shape, dtype=bool)
+    inside[:, :5] = False
+    whole = fill_gaps(arr, inside, 4)[0]
+    halo = 4
+    for r in range(0, 60, 20):
+        for c in range(0, 60, 30):
+            r0, c0 = max(r - halo, 0), max(c - halo, 0)
+            block = fill_gaps(arr[r0:r + 20 + halo, c0:c + 30 + halo],
+                              inside[r0:r + 20 + halo, c0:c + 30 + halo],
+                              4)[0]
+            assert (block[r - r0:r - r0 + 20, c - c0:c - c0 + 30] ==
+                    whole[r:r + 20, c:c + 30]).all()
@@ -0,0 +1,94 @@
+import numpy as np
+from canopy.geometry import snap_grid, geometry_rings, polygon_mask, \
+        burn_polygons, points_in_polygon, PolygonIndex
+
+# a 10 x 10 square with a 4 x 4 hole and a triangle; the ring vertices are
+# off the cell centers, so no center is on an edge
+SQUARE = [np.array([(0.3, 0.3), (10.3, 0.3), (10.3, 10.3), (0.3, 10.3)]),
+          np.array([(3.3, 3.3), (7.3, 3.3), (7.3, 7.3), (3.3, 7.3)])]
+TRIANGLE = [np.array([(1.2, 0.7), (11.9, 4.1), (5.6, 11.8), (1.2, 0.7)])]
+
+
+def brute_force_inside(x, y, rings):
+    # Ray casting one point and one edge at a time
+    inside = False
+    for ring in rings:
+        ring = [tuple(p) for p in ring]
+        if ring[0] != ring[-1]:
+            ring.append(ring[0])
+        for (ax, ay), (bx, by) in zip(ring[:-1], ring[1:]):
+            if (ay > y) != (by > y) and \
+                    x < ax + (y - ay) * (bx - ax) / (by - ay):
+                inside = not inside
+    return inside
+
+
+def brute_force_mask(rings, xmin, ymax, cellsize, nrows, ncols):
+    w, h = cellsize
+    return np.array([[brute_force_inside(xmin + (c + 0.5) * w,
+                                         ymax - (r + 0.5) * h, rings)
+                      for c in range(ncols)] for r in range(nrows)])
+
+
+def full_mask(rings, xmin, ymax, cellsize, nrows, ncols):
+    out = np.zeros((nrows, ncols), dtype=bool)
+    r, c, mask = polygon_mask(rings, xmin, ymax, cellsize, nrows, ncols)
+    if mask is not None:
+        out[r:r + mask.shape[0], c:c + mask.shape[1]] = mask
+    return out
+
+
+def test_polygon_mask_matches_brute_force():
+    for rings in (SQUARE, TRIANGLE):
+        for grid in ((0., 12., (1., 1.), 12, 12),
+                     (-2., 9., (0.5, 0.75), 20, 30)):
+            expected = brute_force_mask(rings, *grid)
+            assert (full_mask(rings, *grid) == expected).all()
+    # the hole is not filled
+    mask = full_mask(SQUARE, 0., 12., (1., 1.), 12, 12)
+    assert mask.sum() == 100 - 16
+
+
+def test_polygon_mask_outside_grid():
+    assert polygon_mask(SQUARE, 100., 12., (1., 1.), 12, 12)[2] is None
+    assert polygon_mask([], 0., 12., (1., 1.), 12, 12)[2] is None
+
+
+def test_burn_polygons_later_polygons_win():
+    out = burn_polygons([SQUARE, TRIANGLE], [1, 2], 0., 12., (1., 1.), 12,
+                        12, nodata=3)
+    triangle = brute_force_mask(TRIANGLE, 0., 12., (1., 1.), 12, 12)
+    square = brute_force_mask(SQUARE, 0., 12., (1., 1.), 12, 12)
+    assert (out[triangle] == 2).all()
+    assert (out[square & ~triangle] == 1).all()
+    assert (out[~square & ~triangle] == 3).all()
+
+
+def test_points_in_polygon_matches_brute_force():
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(-1, 13, (2, 500))
+    expected = [brute_force_inside(a, b, SQUARE) for a, b in zip(x, y)]
+    assert list(points_in_polygon(x, y, SQUARE)) == expected
+    assert list(points_in_polygon(x, y, SQUARE, chunk_size=7)) == expected
+
+
+def test_polygon_index():
+    index = PolygonIndex([SQUARE, TRIANGLE, []])
+    assert list(index.lookup([5., 1., 5., 20.], [1., 5., 5., 20.])) == \
+            [0, 0, 1, -1]
+
+
+def test_snap_grid():
+    assert snap_grid((0.4, 0.6, 9.5, 9.0), (0., 0.), (1., 1.)) == \
+            (0., 9., 9, 10)
+    # edges already on the grid do not move
+    assert snap_grid((1., 2., 3., 4.), (0.5, 0.5), (0.5, 0.5)) == \
+            (1., 4., 4, 4)
+
+
+def test_geometry_rings():
+    rings = geometry_rings({'type': 'MultiPolygon', 'coordinates': [
+        [[(0, 0), (1, 0), (1, 1), (0, 0)]],
+        [[(2, 2), (3, 2), (3, 3), (2, 2)]]]})
+    assert len(rings) == 2
+    assert rings[1].shape == (4, 2)
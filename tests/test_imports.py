@@ -0,0 +1,51 @@
+import os
+import sys
+import inspect
+import subprocess
+import canopy
+
+# seconds that importing Config and the NumPy modules may take, most of it
+# for NumPy itself; importing arcpy takes several seconds
+IMPORT_BUDGET = 1.
+
+IMPORT_SCRIPT = '''
+import sys
+import time
+start = time.perf_counter()
+from canopy import Config, gapfill, objective, geometry, estimate, \\
+    accuracy, zonal
+print(time.perf_counter() - start)
+print('arcpy' in sys.modules)
+'''
+
+
+def test_all_lists_public_names_of_canopy(arcpy):
+    from canopy import canopy as module
+    defined = set(name for name, value in vars(module).items()
+                  if not name.startswith('_') and
+                  (inspect.isfunction(value) or inspect.isclass(value)) and
+                  value.__module__ == module.__name__)
+    assert set(canopy.__all__) == defined | {'Config'}
+    assert set(canopy.__all__) <= set(dir(canopy))
+    assert not [x for x in dir(canopy)
+                if x not in canopy.__all__ and not x.startswith('_') and
+                not inspect.ismodule(getattr(canopy, x))]
+
+
+def test_star_import(arcpy):
+    from canopy import canopy as module
+    namespace = {}
+    exec('from canopy import *', namespace)
+    assert namespace['clip_final_tiles'] is module.clip_final_tiles
+    assert namespace['Config'] is canopy.Config
+
+
+def test_import_without_arcpy():
+    # a new interpreter, so that modules imported by other tests do not
+    # count
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=root,
+                         capture_output=True, text=True, check=True)
+    seconds, arcpy_imported = out.stdout.split()
+    assert arcpy_imported == 'False'
+    assert float(seconds) < IMPORT_BUDGET
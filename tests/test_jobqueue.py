@@ -0,0 +1,66 @@
+import os
+import time
+import multiprocessing
+from canopy.jobqueue import JobQueue
+
+LEASE_SECONDS = 1
+
+
+def run_job(job):
+    # Appends the job ID to a log shared by all workers, so jobs that ran
+    # more than once show up
+    with open('%s/runs.log' % os.environ['CANOPY_TEST_QUEUE'], 'a') as f:
+        f.write('%s\n' % job['id'])
+    time.sleep(0.01)
+    return job['unit']
+
+
+def work(queue_path):
+    os.environ['CANOPY_TEST_QUEUE'] = queue_path
+    queue = JobQueue(queue_path, lease_seconds=LEASE_SECONDS)
+    return queue.work(run_job, poll_seconds=0.1)
+
+
+def claim_and_crash(queue_path):
+    JobQueue(queue_path, lease_seconds=LEASE_SECONDS).claim('crashed')
+    os._exit(1)
+
+
+def test_jobs_complete_exactly_once_with_crashed_worker(tmp_path):
+    queue_path = str(tmp_path)
+    queue = JobQueue(queue_path, lease_seconds=LEASE_SECONDS)
+    job_ids = [queue.put('clip', 'tile%02d' % i) for i in range(60)]
+
+    crasher = multiprocessing.Process(target=claim_and_crash,
+                                      args=(queue_path,))
+    crasher.start()
+    crasher.join()
+    assert crasher.exitcode == 1
+    assert os.listdir('%s/leases' % queue_path) == \
+            ['%s.lease' % job_ids[0]]
+
+    with multiprocessing.Pool(4) as pool:
+        counts = pool.map(work, [queue_path] * 4)
+
+    assert sum(counts) == 60
+    assert queue.status() == {'pending': 0, 'running': 0, 'done': 60,
+                              'failed': 0}
+    with open('%s/runs.log' % queue_path) as f:
+        runs = f.read().split()
+    assert sorted(runs) == sorted(job_ids)
+    assert os.listdir('%s/leases' % queue_path) == []
+
+
+def test_lost_lease_is_not_renewed_or_released(tmp_path):
+    queue = JobQueue(str(tmp_path), lease_seconds=0.2)
+    job_id = queue.put('clip', 'tile')
+    assert queue.claim('stalled')['id'] == job_id
+    time.sleep(0.3)
+    assert queue.claim('other')['id'] == job_id
+
+    assert not queue.renew(job_id, 'stalled')
+    queue.complete(job_id, 'stalled')
+    assert os.listdir('%s/leases' % tmp_path) == ['%s.lease' % job_id]
+    assert queue.renew(job_id, 'other')
+    assert queue.release(job_id, 'other')
+    assert os.listdir('%s/leases' % tmp_path) == []
@@ -0,0 +1,64 @@
+import os
+import pytest
+from canopy.journal import Journal, atomic_output, TMP_PREFIX
+
+
+def write(path, data):
+    with open(path, 'w') as f:
+        f.write(data)
+
+
+def test_is_complete_rejects_truncated_output(tmp_path):
+    results_path = str(tmp_path)
+    os.makedirs('%s/Region' % results_path)
+    path = '%s/Region/frm_3408301_ne.tif' % results_path
+    write(path, 'x' * 100)
+    journal = Journal(results_path)
+    assert not journal.exists
+    journal.record('convert', path)
+    assert journal.is_complete(path, 100)
+
+    # a crash rewriting the output leaves a truncated file
+    write(path, 'x' * 40)
+    assert not journal.is_complete(path, os.path.getsize(path))
+    assert not journal.is_complete('%s/Region/missing.tif' % results_path,
+                                   0)
+
+    # other processes see the entry, and a partial last line is ignored
+    with open(journal.path, 'a') as f:
+        f.write('{"stage": "convert", "artif')
+    journal = Journal(results_path, 'host1')
+    assert journal.exists
+    assert journal.is_complete(path, 100)
+    assert journal.adopted('%s/Region' % results_path)
+    assert not journal.adopted('%s/Other' % results_path)
+    journal.adopt([('clip', '%s/Other/cfr.tif' % results_path, 5)],
+                  '%s/Other' % results_path)
+    journal = Journal(results_path)
+    assert journal.is_complete('%s/Other/cfr.tif' % results_path, 5)
+    assert journal.adopted('%s/Other' % results_path)
+
+
+def test_atomic_output_leaves_no_tmp_file(tmp_path):
+    path = '%s/out.tif' % tmp_path
+    write(path, 'old')
+    with pytest.raises(RuntimeError):
+        with atomic_output(path) as tmp:
+            assert os.path.basename(tmp) == '%sout.tif' % TMP_PREFIX
+            write(tmp, 'new')
+            write('%s.aux.xml' % tmp[:-4], 'aux')
+            raise RuntimeError('crash')
+    assert sorted(os.listdir(tmp_path)) == ['out.tif']
+    with open(path) as f:
+        assert f.read() == 'old'
+
+    # leftovers of a previous crash are removed and sidecars follow the
+    # main file
+    write('%s/%sout.tfw' % (tmp_path, TMP_PREFIX), 'stale')
+    with atomic_output(path) as tmp:
+        assert not os.path.exists('%s/%sout.tfw' % (tmp_path, TMP_PREFIX))
+        write(tmp, 'new')
+        write('%s.aux.xml' % tmp[:-4], 'aux')
+    assert sorted(os.listdir(tmp_path)) == ['out.aux.xml', 'out.tif']
+    with open(path) as f:
+        assert f.read() == 'new'
@@ -0,0 +1,105 @@
+import numpy as np
+from canopy.morphology import box_sum, majority_filter, label_components, \
+        sieve, cleanup_halo, clean_canopy
+
+
+def random_canopy(seed, shape=(40, 50), nodata=0.05):
+    # canopy and noncanopy patches with scattered nodata (3) cells
+    rng = np.random.default_rng(seed)
+    arr = (rng.random(shape) < 0.5).astype(np.uint8)
+    arr = majority_filter(arr, 3)
+    arr[rng.random(shape) < nodata] = 3
+    return arr
+
+
+def brute_force_labels(mask):
+    # Flood fill from each unlabeled cell; labels by the smallest flat index
+    labels = np.arange(mask.size).reshape(mask.shape)
+    seen = np.zeros(mask.shape, dtype=bool)
+    for start in zip(*np.nonzero(mask)):
+        if seen[start]:
+            continue
+        stack = [start]
+        cells = []
+        seen[start] = True
+        while stack:
+            r, c = stack.pop()
+            cells.append((r, c))
+            for rr, cc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                if 0 <= rr < mask.shape[0] and 0 <= cc < mask.shape[1] and \
+                        mask[rr, cc] and not seen[rr, cc]:
+                    seen[rr, cc] = True
+                    stack.append((rr, cc))
+        root = min(r * mask.shape[1] + c for r, c in cells)
+        for cell in cells:
+            labels[cell] = root
+    return labels
+
+
+def test_box_sum_matches_brute_force():
+    arr = np.random.default_rng(0).integers(0, 5, (9, 13))
+    padded = np.pad(arr, 2)
+    for radius in (0, 1, 2):
+        size = 2 * radius + 1
+        expected = np.array([[padded[r + 2 - radius:r + 2 - radius + size,
+                                     c + 2 - radius:c + 2 - radius + size]
+                              .sum() for c in range(13)] for r in range(9)])
+        assert (box_sum(arr, radius) == expected).all()
+
+
+def test_majority_filter():
+    arr = np.array([[1, 1, 0, 3],
+                    [1, 0, 1, 3],
+                    [0, 0, 0, 1]], dtype=np.uint8)
+    out = majority_filter(arr, 3)
+    # (0, 2) and (1, 0) are ties; (2, 3) has two canopy cells out of three
+    # valid cells
+    assert out.tolist() == [[1, 1, 0, 3],
+                            [1, 0, 0, 3],
+                            [0, 0, 0, 1]]
+    # the input is not changed
+    assert arr[1, 2] == 1
+
+
+def test_label_components_match_brute_force():
+    for seed in range(5):
+        mask = random_canopy(seed) == 1
+        assert (label_components(mask) == brute_force_labels(mask)).all()
+    # a spiral has a long diameter
+    spiral = np.zeros((9, 9), dtype=bool)
+    spiral[0, :] = spiral[:, 8] = spiral[8, :] = spiral[2:, 0] = True
+    spiral[2, :7] = spiral[2:7, 6] = spiral[6, 2:7] = spiral[4:7, 2] = True
+    assert (label_components(spiral) == brute_force_labels(spiral)).all()
+
+
+def test_sieve_keeps_edge_and_nodata_components():
+    arr = np.array([[1, 0, 0, 0, 0, 0],
+                    [0, 0, 1, 0, 0, 0],
+                    [0, 0, 0, 0, 1, 3],
+                    [0, 1, 1, 0, 0, 0],
+                    [0, 0, 0, 0, 0, 0]], dtype=np.uint8)
+    out = sieve(arr, 1, 2)
+    # the single cells at the edge and next to nodata are kept
+    assert out[0, 0] == 1 and out[2, 4] == 1
+    assert out[1, 2] == 0
+    assert (out[3, 1:3] == 1).all()
+    assert (sieve(arr, 1, 3)[3, 1:3] == 0).all()
+    assert (sieve(arr, 1, 1) == arr).all()
+
+
+def test_clean_canopy_blockwise_matches_whole():
+    params = (3, 6, 4)
+    halo = cleanup_halo(*params)
+    for seed in range(5):
+        arr = random_canopy(seed, (60, 70))
+        whole = clean_canopy(arr, *params)
+        assert not (whole == arr).all()
+        blocks = np.zeros_like(arr)
+        for r in range(0, 60, 20):
+            for c in range(0, 70, 25):
+                r0, c0 = max(r - halo, 0), max(c - halo, 0)
+                block = clean_canopy(arr[r0:r + 20 + halo, c0:c + 25 + halo],
+                                     *params)
+                blocks[r:r + 20, c:c + 25] = block[r - r0:r - r0 + 20,
+                                                   c - c0:c - c0 + 25]
+        assert (blocks == whole).all()
@@ -0,0 +1,116 @@
+import math
+import numpy as np
+import pytest
+from canopy.qqgrid import parse_qq, qq_code, qq_id, lonlat_to_qq, \
+        projected_to_lonlat, xy_to_qq, QQIndex, ALBERS, QUARTERS
+
+
+def qq_bounds(name):
+    # The 3.75-minute cell of a QQ counted from the northwest corner of its
+    # 1-degree cell, which is keyed by its southeast corner
+    lat, lon, quad, quarter = parse_qq(name)
+    quarter = QUARTERS.index(quarter)
+    row = (quad - 1) // 8 * 2 + quarter // 2
+    col = (quad - 1) % 8 * 2 + quarter % 2
+    top = lat + 1 - row / 16
+    left = -lon - 1 + col / 16
+    return left, top - 1 / 16, left + 1 / 16, top
+
+
+def albers_forward(lon, lat, wkid):
+    # Snyder (1987), pp. 100-101
+    a, rf, lat1, lat2, lat0, lon0, x0, y0 = ALBERS[wkid]
+    f = 1 / rf
+    e2 = 2 * f - f**2
+    e = math.sqrt(e2)
+
+    def m(lat):
+        return math.cos(lat) / math.sqrt(1 - e2 * math.sin(lat)**2)
+
+    def q(lat):
+        s = math.sin(lat)
+        return (1 - e2) * (s / (1 - e2 * s**2) - 1 / (2 * e) *
+                           math.log((1 - e * s) / (1 + e * s)))
+
+    lat, lat0, lat1, lat2 = map(math.radians, (lat, lat0, lat1, lat2))
+    n = (m(lat1)**2 - m(lat2)**2) / (q(lat2) - q(lat1))
+    C = m(lat1)**2 + n * q(lat1)
+    rho = a * math.sqrt(C - n * q(lat)) / n
+    rho0 = a * math.sqrt(C - n * q(lat0)) / n
+    theta = n * math.radians(lon - lon0)
+    return x0 + rho * math.sin(theta), y0 + rho0 - rho * math.cos(theta)
+
+
+def test_qq_code_round_trip():
+    for name in ('m_3408301_ne', 'm_3408364_sw', 'm_4912201_se'):
+        assert qq_id(qq_code(name)) == name
+    assert qq_code('rm_3408301_NE_17_1_20090929.tif') == \
+            qq_code('m_3408301_ne')
+    with pytest.raises(ValueError):
+        parse_qq('m_34083_ne')
+
+
+def test_lonlat_to_qq_at_tile_corners():
+    eps = 1e-6
+    names = ['m_3408301_ne', 'm_3408301_nw', 'm_3408364_se',
+             'm_3408337_sw', 'm_4912208_ne', 'm_2508160_nw']
+    for name in names:
+        left, bottom, right, top = qq_bounds(name)
+        lon = [left + eps, right - eps, left + eps, right - eps]
+        lat = [top - eps, top - eps, bottom + eps, bottom + eps]
+        assert (lonlat_to_qq(lon, lat) == qq_code(name)).all()
+    # m_3408301_ne is the second QQ from the northwest corner of 34/083
+    assert qq_bounds('m_3408301_ne') == (-84 + 1 / 16, 35 - 1 / 16,
+                                         -84 + 1 / 8, 35)
+
+
+def test_lonlat_to_qq_covers_a_cell():
+    # every QQ of a 1-degree cell is hit once by its center
+    codes = []
+    for quad in range(1, 65):
+        for quarter in QUARTERS:
+            left, bottom, right, top = qq_bounds('m_34083%02d_%s' %
+                                                 (quad, quarter))
+            codes.append(lonlat_to_qq((left + right) / 2,
+                                      (bottom + top) / 2))
+    assert [qq_id(x) for x in codes] == \
+            ['m_34083%02d_%s' % (quad, quarter) for quad in range(1, 65)
+             for quarter in QUARTERS]
+
+
+def test_projected_to_lonlat_inverts_albers():
+    lon, lat = projected_to_lonlat(0., 0., 102039)
+    assert abs(lon + 96) < 1e-9 and abs(lat - 23) < 1e-9
+    lon, lat = projected_to_lonlat(0., 0., 102003)
+    assert abs(lon + 96) < 1e-9 and abs(lat - 37.5) < 1e-9
+
+    points = [(-83.9, 34.9), (-84.39, 33.75), (-122.3, 47.6), (-70.1, 25.2)]
+    for wkid in (102039, 5070, 102003):
+        xy = np.array([albers_forward(lon, lat, wkid)
+                       for lon, lat in points])
+        lon, lat = projected_to_lonlat(xy[:, 0], xy[:, 1], wkid)
+        assert np.abs(lon - [p[0] for p in points]).max() < 1e-9
+        assert np.abs(lat - [p[1] for p in points]).max() < 1e-9
+
+    x, y = albers_forward(-83.92, 34.97, 102039)
+    assert xy_to_qq([x], [y], 102039)[0] == qq_code('m_3408301_ne')
+    assert xy_to_qq([-83.92], [34.97], 4269)[0] == qq_code('m_3408301_ne')
+    with pytest.raises(ValueError, match='Unsupported WKID'):
+        projected_to_lonlat(0., 0., 32617)
+
+
+def test_qq_index():
+    index = QQIndex(['m_3408301_ne_17_1_20090929',
+                     'm_3408301_ne_17_1_20130601',
+                     'm_3408302_nw_17_1_20130601'])
+    assert len(index) == 2
+    codes = [qq_code('m_3408302_nw'), qq_code('m_3408301_sw'),
+             qq_code('m_3408301_ne'), qq_code('m_9999999_se')]
+    assert list(index.lookup(codes)) == [1, -1, 0, -1]
+    # the latest file of a QQ wins
+    assert index.filenames(codes) == ['m_3408302_nw_17_1_20130601', None,
+                                      'm_3408301_ne_17_1_20130601', None]
+    assert index.path('naip', codes[0]) == \
+            'naip/34083/m_3408302_nw_17_1_20130601.tif'
+    assert index.path('naip', codes[1]) is None
+    assert list(QQIndex([]).lookup(codes)) == [-1] * 4
@@ -0,0 +1,52 @@
+import numpy as np
+from canopy.geometry import points_in_polygon
+from canopy.sampling import sample_points
+
+# a 10 x 10 square with a 4 x 4 hole
+RINGS = [np.array([(0., 0.), (10., 0.), (10., 10.), (0., 10.)]),
+         np.array([(3., 3.), (7., 3.), (7., 7.), (3., 7.)])]
+
+
+def test_points_are_inside_and_reproducible():
+    x, y, attrs = sample_points(RINGS, 500, seed=1)
+    assert len(x) == len(y) == 500
+    assert attrs == {}
+    assert points_in_polygon(x, y, RINGS).all()
+    x2, y2, attrs = sample_points(RINGS, 500, seed=1)
+    assert (x == x2).all() and (y == y2).all()
+    x3, y3, attrs = sample_points(RINGS, 500, seed=2)
+    assert not (x == x3).all()
+
+
+def test_points_are_uniform():
+    x, y, attrs = sample_points(RINGS, 8400, seed=0)
+    # the left and bottom strips outside the hole hold 3 / 8.4 of the area
+    assert abs((x < 3).mean() - 30 / 84) < 0.02
+    assert abs((y < 3).mean() - 30 / 84) < 0.02
+
+
+def test_classify_rejects_negative_attributes():
+    def classify(x, y):
+        return {'tile': np.where(x < 5, -1, (y // 5).astype(np.int64))}
+
+    x, y, attrs = sample_points(RINGS, 200, seed=0, classify=classify)
+    assert len(x) == 200
+    assert (x >= 5).all()
+    assert (attrs['tile'] == (y // 5)).all()
+
+
+def test_stratified_sample_fills_rare_strata():
+    def classify(x, y):
+        # canopy covers only a 1 x 10 strip, i.e., 1 / 8.4 of the area
+        return {'canopy': (x > 9).astype(np.int64)}
+
+    x, y, attrs = sample_points(RINGS, 101, seed=0, classify=classify,
+                                stratify='canopy')
+    assert np.bincount(attrs['canopy']).tolist() == [51, 50]
+    assert (x[attrs['canopy'] == 1] > 9).all()
+
+    x, y, attrs = sample_points(RINGS, 10, seed=0, classify=classify,
+                                stratify='canopy', strata=[1, 0, 2],
+                                max_batches=3)
+    # stratum 2 never occurs and is returned short
+    assert np.bincount(attrs['canopy'], minlength=3).tolist() == [3, 4, 0]
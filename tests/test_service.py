@@ -0,0 +1,38 @@
+import os
+import stat
+import time
+import threading
+import multiprocessing
+import pytest
+from canopy.service import serve, submit, shutdown
+
+
+def test_service_key(tmp_path, monkeypatch):
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.delenv('CANOPY_SERVICE_KEY', raising=False)
+    address = '%s/sock' % tmp_path
+    with pytest.raises(ValueError, match='No service key'):
+        shutdown(address)
+
+    # no workers are needed to check the connection
+    thread = threading.Thread(target=serve, args=(None, address, 0))
+    thread.start()
+    try:
+        key_dir = '%s/.canopy' % tmp_path
+        for i in range(100):
+            if os.path.exists(address) and os.path.isdir(key_dir) and \
+                    os.listdir(key_dir):
+                break
+            time.sleep(0.05)
+        key_path = '%s/%s' % (key_dir, os.listdir(key_dir)[0])
+        assert stat.S_IMODE(os.stat(key_path).st_mode) == 0o600
+        with open(key_path) as f:
+            assert len(f.read()) == 64
+
+        assert list(submit([], address)) == []
+        with pytest.raises(multiprocessing.AuthenticationError):
+            list(submit([], address, authkey='canopy'))
+    finally:
+        shutdown(address)
+        thread.join(10)
+    assert not thread.is_alive()